@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the directory record store.
+
+usage: bench_directory_store.py [-h] [-n N] [--fs-records N] [--check]
+
+Micro benchmarks time mapping identifiers to file paths, in each layout,
+against the reference mapping that the store used to compute for every
+record. Macro benchmarks time creating directories, writing records and
+deleting them in a temporary directory.
+
+optional arguments:
+  -h, --help       show this help message and exit
+  -n N             number of synthetic identifiers to map (default: 1000000)
+  --fs-records N   number of records to write and delete (default: 1000000)
+  --check          exit with status 1 if any mapping is slower than the
+                   reference, or maps an identifier differently
+
+Run from the root of the repository, e.g.:
+
+    python benchmarks/bench_directory_store.py -n 100000 --check
+"""
+import hashlib
+import os
+import platform
+import shutil
+import sys
+import time
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+
+from mock import Mock
+from six import string_types
+from six.moves.urllib import parse as urllib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oaiharvest.record import Record  # noqa: E402
+from oaiharvest.stores.directory_store import DirectoryRecordStore  # noqa: E402
+
+LAYOUTS = [
+    ("flat", {}),
+    ("subdirs", {"createSubDirs": True}),
+    ("subdirs-on", {"createSubDirs": ":"}),
+    ("sharded", {"shardDepth": 2}),
+]
+
+
+def reference_filepath(store, identifier, metadataPrefix):
+    """Map ``identifier`` to a path as the store did before precomputing."""
+    filename = "{0}.{1}.xml".format(identifier, metadataPrefix)
+    protected = []
+    if platform.system() != "Windows":
+        protected.append(":")
+    if store.createSubDirs and not store.shardDepth:
+        if isinstance(store.createSubDirs, string_types):
+            filename = filename.replace(store.createSubDirs, os.path.sep)
+        protected.append(os.path.sep)
+    filename = urllib.quote(filename, "".join(protected))
+    shards = []
+    if store.shardDepth:
+        digest = hashlib.md5(identifier.encode("utf-8")).hexdigest()
+        width = store.shardWidth
+        shards = [digest[i * width : (i + 1) * width] for i in range(store.shardDepth)]
+    return os.path.join(store.directory, *(shards + [filename]))
+
+
+def identifiers(n):
+    """Generate ``n`` synthetic identifiers in the styles seen in the wild."""
+    styles = [
+        "oai:repository.example.ac.uk:{0}",
+        "oai:example.org:collection/item/{0}",
+        "oai:arXiv.org:hep-th/{0:07d}",
+        "oai:bibliothèque.example.fr:notice {0}",
+    ]
+    for i in range(n):
+        yield styles[i % len(styles)].format(i)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def best_of(repeat, func):
+    """Return the shortest time taken by ``func``, and its result."""
+    times, results = zip(*(timed(func) for i in range(repeat)))
+    return min(times), results[0]
+
+
+def bench_mapping(ids, repeat=3):
+    """Time both mappings in each layout; return list of failures."""
+    failures = []
+    print(
+        "{0:<12} {1:>12} {2:>12} {3:>8}".format(
+            "layout", "reference", "store", "speedup"
+        )
+    )
+    for name, kwargs in LAYOUTS:
+        store = DirectoryRecordStore("/tmp/records", **kwargs)
+        ref, expected = best_of(
+            repeat, lambda: [reference_filepath(store, i, "oai_dc") for i in ids]
+        )
+        new, actual = best_of(
+            repeat, lambda: [store.get_filepath(i, "oai_dc") for i in ids]
+        )
+        print(
+            "{0:<12} {1:>11.3f}s {2:>11.3f}s {3:>7.2f}x".format(
+                name, ref, new, ref / new
+            )
+        )
+        if actual != expected:
+            failures.append("{0}: paths differ from reference".format(name))
+        if new > ref:
+            failures.append("{0}: slower than reference".format(name))
+    return failures
+
+
+def bench_filesystem(ids):
+    """Time writing and deleting records in each layout."""
+    print(
+        "{0:<12} {1:>12} {2:>12} {3:>12}".format("layout", "write", "delete", "batched")
+    )
+    for name, kwargs in LAYOUTS:
+        directory = mkdtemp()
+        try:
+            records = [_make_record(i) for i in ids]
+            store = DirectoryRecordStore(directory, **kwargs)
+            write, _ = timed(_write_all, store, records)
+            delete, _ = timed(_delete_all, store, records)
+            _write_all(store, records)
+            store = DirectoryRecordStore(
+                directory, deleteBatchSize=1000, deleteWorkers=4, **kwargs
+            )
+            batched, _ = timed(_delete_all, store, records)
+        finally:
+            shutil.rmtree(directory)
+        print(
+            "{0:<12} {1:>11.3f}s {2:>11.3f}s {3:>11.3f}s".format(
+                name, write, delete, batched
+            )
+        )
+
+
+def _make_record(identifier):
+    header = Mock()
+    header.identifier.return_value = identifier
+    return Record(header, "<xml>data</xml>", None)
+
+
+def _write_all(store, records):
+    for record in records:
+        store.write(record, "oai_dc")
+    store.flush()
+
+
+def _delete_all(store, records):
+    for record in records:
+        store.delete(record, "oai_dc")
+    store.flush()
+
+
+def main(argv=None):
+    args = argparser.parse_args(argv)
+    print("Mapping {0} identifiers".format(args.n))
+    failures = bench_mapping(list(identifiers(args.n)))
+    if args.fsRecords:
+        print("\nWriting and deleting {0} records".format(args.fsRecords))
+        bench_filesystem(list(identifiers(args.fsRecords)))
+    for failure in failures:
+        print("FAIL {0}".format(failure))
+    return 1 if args.check and failures else 0
+
+
+docbits = __doc__.split("\n\n")
+argparser = ArgumentParser(description=docbits[1])
+argparser.add_argument(
+    "-n",
+    dest="n",
+    type=int,
+    default=1000000,
+    help="number of synthetic identifiers to map (default: 1000000)",
+)
+argparser.add_argument(
+    "--fs-records",
+    dest="fsRecords",
+    type=int,
+    default=1000000,
+    metavar="N",
+    help="number of records to write and delete (default: 1000000)",
+)
+argparser.add_argument(
+    "--check",
+    action="store_true",
+    help=(
+        "exit with status 1 if any mapping is slower than the reference, or "
+        "maps an identifier differently"
+    ),
+)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
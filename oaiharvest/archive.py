@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Archive of raw OAI-PMH responses, to harvest again without the network.
+
+Each response is kept gzip compressed in a directory, keyed by the base URL
+and the parameters of the request (including any resumptionToken), with an
+index in a sqlite database in the same directory. Pages of records are
+grouped into the lists that they belong to, so that records can be harvested
+again from the archive, e.g. into a store with a different layout, by
+replaying each list that was harvested in the order in which it was
+harvested.
+
+When the archive grows larger than its size limit, whole lists are evicted,
+least recently used first, so that no list is left with pages missing.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from six.moves.urllib.parse import parse_qsl
+
+
+class ResponseArchive(object):
+    """Compressed OAI-PMH responses on disk.
+
+    ``directory`` => directory in which to keep responses; created if
+    necessary
+    ``maxBytes`` => maximum size of compressed responses to keep, or None for
+    no limit
+    ``replay`` => if True, clients should take all responses from the
+    archive rather than from the provider
+    """
+
+    def __init__(self, directory, maxBytes=None, replay=False):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.replay = replay
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Shared by harvests in several threads
+        self._lock = threading.Lock()
+        self._cxn = sqlite3.connect(
+            os.path.join(directory, "index.db"),
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+        )
+        self._cxn.execute(
+            "CREATE TABLE IF NOT EXISTS pages("
+            "key varchar primary key, "
+            "list varchar, "
+            "url varchar, "
+            "request varchar, "
+            "size integer, "
+            "fetched timestamp, "
+            "used timestamp)"
+        )
+        self._cxn.execute("CREATE INDEX IF NOT EXISTS pages_list ON pages(list)")
+        # Total size of archived responses, to evict only when over maxBytes
+        self._size = self._cxn.execute("SELECT total(size) FROM pages").fetchone()[0]
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def get(self, url, request):
+        """Return the archived response to ``request`` to ``url``, or None."""
+        key = self._key(url, request)
+        with self._lock:
+            row = self._cxn.execute(
+                "SELECT list FROM pages WHERE key=?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._cxn:
+                self._cxn.execute(
+                    "UPDATE pages SET used=? WHERE list=?", (datetime.now(), row[0])
+                )
+        try:
+            with gzip.open(self._filepath(key), "rb") as fh:
+                return fh.read()
+        except (IOError, OSError):
+            self.logger.warning("Archived response %s is missing", key)
+            return None
+
+    def put(self, url, request, body, listRequest=None):
+        """Archive ``body`` as the response to ``request`` to ``url``.
+
+        ``listRequest`` => the request that started the list of records that
+        this response continues, or None if it started one itself
+        """
+        key = self._key(url, request)
+        listKey = self._key(url, listRequest or request)
+        fp = self._filepath(key)
+        if not os.path.isdir(os.path.dirname(fp)):
+            os.makedirs(os.path.dirname(fp))
+        with gzip.open(fp, "wb", compresslevel=6) as fh:
+            fh.write(body)
+        now = datetime.now()
+        size = os.path.getsize(fp)
+        with self._lock:
+            row = self._cxn.execute(
+                "SELECT size FROM pages WHERE key=?", (key,)
+            ).fetchone()
+            with self._cxn:
+                self._cxn.execute(
+                    "INSERT OR REPLACE INTO pages"
+                    "(key, list, url, request, size, fetched, used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, listKey, url, request, size, now, now),
+                )
+            self._size += size - (row[0] if row else 0)
+            full = self.maxBytes is not None and self._size > self.maxBytes
+        if full:
+            self.evict(self.maxBytes, keep=listKey)
+
+    def start_list(self, url, listRequest):
+        """Record the start of a list continued from a resumptionToken.
+
+        ``listRequest`` => request with the metadataPrefix of the list and the
+        resumptionToken from which it was started, as passed to ``put`` for
+        each of its responses, so that the list can be replayed from it
+        """
+        key = self._key(url, listRequest)
+        now = datetime.now()
+        with self._lock:
+            with self._cxn:
+                self._cxn.execute(
+                    "INSERT OR REPLACE INTO pages"
+                    "(key, list, url, request, size, fetched, used) "
+                    "VALUES (?, ?, ?, ?, 0, ?, ?)",
+                    (key, key, url, listRequest, now, now),
+                )
+
+    def lists(self, url, metadataPrefix):
+        """Return the parameters of each list of records archived for ``url``.
+
+        Return a list of dicts of the parameters of the request that started
+        each list in ``metadataPrefix``, in the order they were harvested.
+        """
+        with self._lock:
+            rows = self._cxn.execute(
+                "SELECT request FROM pages WHERE url=? AND key=list "
+                "ORDER BY fetched",
+                (url,),
+            ).fetchall()
+        lists = []
+        for (request,) in rows:
+            params = dict(parse_qsl(request))
+            if (
+                params.get("verb") == "ListRecords"
+                and params.get("metadataPrefix") == metadataPrefix
+            ):
+                lists.append(params)
+        return lists
+
+    def size(self):
+        """Return the total size in bytes of archived responses."""
+        with self._lock:
+            return self._cxn.execute("SELECT total(size) FROM pages").fetchone()[0]
+
+    def evict(self, maxBytes, keep=None):
+        """Remove least recently used lists until within ``maxBytes``.
+
+        Never remove the list ``keep``, e.g. one still being harvested.
+        """
+        with self._lock:
+            total = self._cxn.execute("SELECT total(size) FROM pages").fetchone()[0]
+            self._size = total
+            if total <= maxBytes:
+                return
+            lists = self._cxn.execute(
+                "SELECT list, total(size) FROM pages GROUP BY list "
+                "ORDER BY max(used)"
+            ).fetchall()
+            for listKey, size in lists:
+                if total <= maxBytes:
+                    break
+                if listKey == keep:
+                    continue
+                keys = self._cxn.execute(
+                    "SELECT key FROM pages WHERE list=?", (listKey,)
+                ).fetchall()
+                for (key,) in keys:
+                    try:
+                        os.remove(self._filepath(key))
+                    except OSError:
+                        pass
+                with self._cxn:
+                    self._cxn.execute("DELETE FROM pages WHERE list=?", (listKey,))
+                total -= size
+                self._size = total
+                self.logger.debug("Evicted list %s of %d responses", listKey, len(keys))
+
+    def close(self):
+        self._cxn.close()
+
+    def _key(self, url, request):
+        return hashlib.sha1("{0}?{1}".format(url, request).encode("utf-8")).hexdigest()
+
+    def _filepath(self, key):
+        return os.path.join(self.directory, key[:2], key + ".xml.gz")
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Cache of rarely changing OAI-PMH responses.
+
+Responses to ``Identify`` and ``ListMetadataFormats`` requests hardly ever
+change, so they are kept in the provider registry database and re-used
+until they expire, saving a round trip to the provider before every harvest.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+#: Verbs whose responses may be cached
+CACHEABLE_VERBS = ("Identify", "ListMetadataFormats")
+
+
+class CachedResponse(object):
+    """A response held in the :class:`ResponseCache`."""
+
+    def __init__(self, body, fetched, etag=None, lastModified=None):
+        self.body = body
+        self.fetched = fetched
+        self.etag = etag
+        self.lastModified = lastModified
+
+    def conditional_headers(self):
+        """Return HTTP headers with which to revalidate this response."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.lastModified:
+            headers["If-Modified-Since"] = self.lastModified
+        return headers
+
+
+class ResponseCache(object):
+    """TTL based cache of OAI-PMH responses in the registry database.
+
+    ``cxn`` => instance of ``sqlite3.Connection`` as returned by
+    ``oaiharvest.registry.verify_database``
+    ``ttl`` => ``datetime.timedelta`` for which responses are fresh
+    ``refresh`` => if True, treat all cached responses as stale
+
+    A cache may be used by harvests in several threads at once.
+    """
+
+    def __init__(self, cxn, ttl=timedelta(days=1), refresh=False):
+        self.cxn = cxn
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def get(self, url, request):
+        """Return the ``CachedResponse`` for ``request`` to ``url`` or None."""
+        with self._lock:
+            row = self.cxn.execute(
+                "SELECT body, fetched [timestamp], etag, lastModified "
+                "FROM responses WHERE url=? AND request=?",
+                (url, request),
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(bytes(row[0]), row[1], row[2], row[3])
+
+    def is_fresh(self, response):
+        """Can ``response`` be used without revalidating it?"""
+        if self.refresh or response is None:
+            return False
+        return datetime.now() - response.fetched < self.ttl
+
+    def put(self, url, request, body, etag=None, lastModified=None):
+        """Store ``body`` as the response to ``request`` to ``url``."""
+        self.logger.debug("Caching %s response from %s", request, url)
+        with self._lock, self.cxn:
+            self.cxn.execute(
+                "INSERT OR REPLACE INTO responses"
+                "(url, request, body, fetched, etag, lastModified) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, request, body, datetime.now(), etag, lastModified),
+            )
+
+    def touch(self, url, request):
+        """Mark the response to ``request`` to ``url`` as freshly validated."""
+        self.logger.debug("Revalidated cached %s response from %s", request, url)
+        with self._lock, self.cxn:
+            self.cxn.execute(
+                "UPDATE responses SET fetched=? WHERE url=? AND request=?",
+                (datetime.now(), url, request),
+            )
+
+    def clear(self, url=None):
+        """Remove cached responses for ``url``, or for all URLs."""
+        with self._lock, self.cxn:
+            if url is None:
+                self.cxn.execute("DELETE FROM responses")
+            else:
+                self.cxn.execute("DELETE FROM responses WHERE url=?", (url,))
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""OAI-PMH client used by the harvester.
+
+Extends the pyoai ``Client`` so that responses to rarely changing requests
+can be served from a :class:`oaiharvest.cache.ResponseCache`, so that all
+responses can be kept in, or replayed from, a
+:class:`oaiharvest.archive.ResponseArchive`, and so that
+records are listed a page at a time, optionally fetching pages ahead subject
+to :class:`oaiharvest.memory.BufferLimits` and parsing them in a
+:class:`oaiharvest.parallel.ParallelPageParser`. Each page reports the
+``completeListSize`` and ``cursor`` of its resumptionToken, and a request
+that stalls is retried rather than holding up the harvest indefinitely.
+"""
+import logging
+import re
+import socket
+import sys
+import time
+from collections import deque
+
+from oaipmh import client
+from oaipmh.datestamp import datestamp_to_datetime
+from oaipmh.error import DatestampError
+from six.moves.urllib import request as urllib2
+from six.moves.urllib.error import HTTPError, URLError
+from six.moves.urllib.parse import urlencode
+
+from oaiharvest.cache import CACHEABLE_VERBS
+from oaiharvest.exceptions import NotArchivedException
+from oaiharvest.memory import prefetch
+from oaiharvest.parallel import find_list_position, find_resumption_token
+
+#: Number of times to retry a request that stalled before giving up
+STALL_RETRIES = 3
+
+
+_RESPONSE_DATE_RE = re.compile(rb"<(?:[\w.-]+:)?responseDate>\s*([^<\s]+)\s*<")
+
+
+class Page(object):
+    """A page of records returned in response to a single request.
+
+    ``records`` => list of (header, metadata, about) tuples
+    ``token`` => resumptionToken for the next page, or None for the last
+    ``size`` => size of the response in bytes
+    ``completeListSize`` => number of records in the complete list, as
+    reported with the resumptionToken, or None
+    ``cursor`` => number of records in the list before this page, as
+    reported with the resumptionToken, or None
+    ``seconds`` => time taken to receive the response
+    """
+
+    def __init__(
+        self, records, token, size=0, completeListSize=None, cursor=None, seconds=0.0
+    ):
+        self.records = records
+        self.token = token
+        self.size = size
+        self.completeListSize = completeListSize
+        self.cursor = cursor
+        self.seconds = seconds
+
+
+class Client(client.Client):
+    """pyoai ``Client`` with a cache for ``Identify`` and ``ListMetadataFormats``.
+
+    ``responseCache`` => instance of ``oaiharvest.cache.ResponseCache``, or
+    None to always ask the server
+    ``bufferLimits`` => instance of ``oaiharvest.memory.BufferLimits``, or
+    None to fetch each page only when the previous one has been consumed
+    ``pageParser`` => instance of ``oaiharvest.parallel.ParallelPageParser``
+    with which to parse pages of records after the first, or None to parse
+    them in this thread
+    ``archive`` => instance of ``oaiharvest.archive.ResponseArchive`` in
+    which to keep every response, or from which to replay them all
+    ``stallTimeout`` => seconds to wait for the server to respond before
+    retrying the request, up to ``STALL_RETRIES`` times, or None to wait
+    indefinitely
+    """
+
+    def __init__(
+        self,
+        base_url,
+        metadata_registry=None,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        archive=None,
+        stallTimeout=None,
+        **kwargs
+    ):
+        client.Client.__init__(self, base_url, metadata_registry, **kwargs)
+        self.responseCache = responseCache
+        self.bufferLimits = bufferLimits
+        self.pageParser = pageParser
+        self.archive = archive
+        self.stallTimeout = stallTimeout
+        # Request that started the list being archived
+        self._listRequest = None
+        self._identify = None
+        self._responseSize = 0
+        self._responseSeconds = 0.0
+        # completeListSize and cursor of the last page of records
+        self._listPosition = (None, None)
+        #: Server's responseDate when starting the last list of records
+        self.responseDate = None
+        #: Called with the resumptionToken for each page after the first,
+        #: before any of its records are returned
+        self.beforePage = None
+        #: Called with each ``Page`` before any of its records are returned
+        self.onPage = None
+        #: Number of requests answered, and seconds taken to answer them
+        self.requests = 0
+        self.requestSeconds = 0.0
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def identify(self, **kw):
+        # Identify is requested both to validate the base URL and to update
+        # the granularity; only ask once per client
+        if self._identify is None:
+            self._identify = self.handleVerb("Identify", kw)
+        return self._identify
+
+    def handleVerb(self, verb, kw):
+        token = kw.get("resumptionToken")
+        if verb == "ListRecords" and token is not None:
+            if self.archive is not None and not self.archive.replay:
+                # Archive responses as a list that can be replayed from the
+                # token, in the metadataPrefix of the records
+                self._listRequest = urlencode(
+                    sorted(
+                        [
+                            ("metadataPrefix", kw["metadataPrefix"]),
+                            ("resumptionToken", token),
+                            ("verb", verb),
+                        ]
+                    )
+                )
+                self.archive.start_list(self._base_url, self._listRequest)
+            # Continue a list from a resumptionToken; pyoai only validates
+            # the arguments to start a new list
+            tree = self.makeRequestErrorHandling(verb=verb, resumptionToken=token)
+            return self.ListRecords_impl(kw, tree)
+        return client.Client.handleVerb(self, verb, kw)
+
+    def ListRecords_impl(self, args, tree):
+        if self.pageParser is not None:
+            pages = self._iter_parsed_pages(args["metadataPrefix"], tree)
+        else:
+            pages = self._iter_pages(args["metadataPrefix"], tree)
+        if self.bufferLimits is not None and self.bufferLimits.maxPages:
+            pages = prefetch(pages, self.bufferLimits)
+        previous = None
+        try:
+            for page in pages:
+                if previous is not None and self.beforePage is not None:
+                    self.beforePage(previous.token)
+                if self.onPage is not None:
+                    self.onPage(page)
+                for record in page.records:
+                    yield record
+                previous = page
+        finally:
+            # Stop requesting pages ahead, e.g. once the harvest is paused
+            pages.close()
+
+    def _iter_pages(self, metadataPrefix, tree):
+        """Generate ``Page``s of records, starting with the one in ``tree``."""
+        namespaces = self.getNamespaces()
+        while True:
+            records, token = self.buildRecords(
+                metadataPrefix, namespaces, self._metadata_registry, tree
+            )
+            yield Page(
+                records,
+                token,
+                self._responseSize,
+                *self._listPosition,
+                seconds=self._responseSeconds
+            )
+            if token is None:
+                return
+            tree = self.makeRequestErrorHandling(
+                verb="ListRecords", resumptionToken=token
+            )
+
+    def _iter_parsed_pages(self, metadataPrefix, tree):
+        """Generate ``Page``s of records, parsing them in ``pageParser``.
+
+        The first page, in ``tree``, has already been parsed. Subsequent pages
+        are requested as soon as the resumptionToken is found in the previous
+        response, up to ``pageParser.maxPending`` pages ahead.
+        """
+        records, token = self.buildRecords(
+            metadataPrefix, self.getNamespaces(), self._metadata_registry, tree
+        )
+        yield Page(
+            records,
+            token,
+            self._responseSize,
+            *self._listPosition,
+            seconds=self._responseSeconds
+        )
+        pending = deque()
+        try:
+            while token is not None or pending:
+                while token is not None and len(pending) < self.pageParser.maxPending:
+                    xml = self.makeRequest(verb="ListRecords", resumptionToken=token)
+                    token = find_resumption_token(xml)
+                    pending.append(
+                        (
+                            self.pageParser.parse(xml, metadataPrefix),
+                            token,
+                            len(xml),
+                            self._listPosition,
+                            self._responseSeconds,
+                        )
+                    )
+                future, pageToken, size, position, seconds = pending.popleft()
+                yield Page(
+                    self.pageParser.records(future),
+                    pageToken,
+                    size,
+                    *position,
+                    seconds=seconds
+                )
+        finally:
+            # Pages requested ahead of a harvest that stopped are not parsed
+            for future, pageToken, size, position, seconds in pending:
+                future.cancel()
+
+    def makeRequest(self, **kw):
+        started = time.time()
+        body = self._makeRequest(**kw)
+        self._responseSeconds = time.time() - started
+        self._responseSize = len(body)
+        if kw.get("verb") == "ListRecords":
+            self._listPosition = find_list_position(body)
+            if "resumptionToken" not in kw:
+                self.responseDate = self._find_response_date(body)
+        return body
+
+    def _find_response_date(self, body):
+        """Return responseDate from ``body`` as a ``datetime``, or None."""
+        match = _RESPONSE_DATE_RE.search(body)
+        if match is None:
+            return None
+        try:
+            return datestamp_to_datetime(match.group(1).decode("ascii"))
+        except (DatestampError, UnicodeDecodeError):
+            return None
+
+    def _makeRequest(self, **kw):
+        if self._local_file:
+            return client.Client.makeRequest(self, **kw)
+        request = urlencode(sorted(kw.items()))
+        if self.archive is None:
+            return self._fetch(kw, request)
+        listRequest = self._listRequest
+        if "resumptionToken" not in kw:
+            listRequest = self._listRequest = request
+        if self.archive.replay:
+            body = self.archive.get(self._base_url, request)
+            if body is None:
+                raise NotArchivedException(
+                    "No archived response to {0}?{1}".format(self._base_url, request)
+                )
+            return body
+        body = self._fetch(kw, request)
+        self.archive.put(self._base_url, request, body, listRequest)
+        return body
+
+    def _fetch(self, kw, request):
+        """Return the response to ``kw`` from the cache or the server."""
+        if self.responseCache is None or kw.get("verb") not in CACHEABLE_VERBS:
+            return self._retrieve(kw)[0]
+        cached = self.responseCache.get(self._base_url, request)
+        if self.responseCache.is_fresh(cached):
+            self.logger.debug("Using cached {0} response".format(kw["verb"]))
+            return cached.body
+        headers = {}
+        if cached is not None and not self.responseCache.refresh:
+            headers = cached.conditional_headers()
+        try:
+            body, info = self._retrieve(kw, headers, get=True)
+        except HTTPError as e:
+            if e.code != 304 or cached is None:
+                raise
+            # Not Modified
+            self.responseCache.touch(self._base_url, request)
+            return cached.body
+        if cached is not None and body == cached.body:
+            self.responseCache.touch(self._base_url, request)
+        else:
+            self.responseCache.put(
+                self._base_url,
+                request,
+                body,
+                info.get("ETag"),
+                info.get("Last-Modified"),
+            )
+        return body
+
+    def _retrieve(self, kw, headers=None, get=False):
+        """Request ``kw`` from the server, return body and response headers.
+
+        Handles 503 Retry-After in the same way as pyoai, and retries a
+        request that stalls for longer than ``stallTimeout``.
+        """
+        request_headers = {"User-Agent": "pyoai"}
+        if self._credentials is not None:
+            request_headers["Authorization"] = "Basic " + self._credentials.strip()
+        request_headers.update(headers or {})
+        if get or self._force_http_get:
+            request = urllib2.Request(
+                "{0}?{1}".format(self._base_url, urlencode(kw)),
+                headers=request_headers,
+            )
+        else:
+            request = urllib2.Request(
+                self._base_url,
+                data=urlencode(kw).encode("utf-8"),
+                headers=request_headers,
+            )
+        stalls = 0
+        for i in range(client.WAIT_MAX):
+            started = time.time()
+            try:
+                if self.stallTimeout:
+                    f = urllib2.urlopen(request, timeout=self.stallTimeout)
+                else:
+                    f = urllib2.urlopen(request)
+                try:
+                    body = f.read()
+                finally:
+                    f.close()
+                self.requests += 1
+                self.requestSeconds += time.time() - started
+                return body, f.info()
+            except HTTPError:
+                e = sys.exc_info()[1]
+                if e.code != 503:
+                    raise
+                try:
+                    retryAfter = int(e.hdrs.get("Retry-After"))
+                except TypeError:
+                    retryAfter = client.WAIT_DEFAULT
+                time.sleep(retryAfter)
+            except (socket.timeout, URLError) as e:
+                if not _is_timeout(e) or stalls >= STALL_RETRIES:
+                    raise
+                stalls += 1
+                self.logger.warning(
+                    "No response from %s within %ss; retrying request (%d of %d)",
+                    self._base_url,
+                    self.stallTimeout,
+                    stalls,
+                    STALL_RETRIES,
+                )
+        raise client.Error("Waited too often (more than %s times)" % client.WAIT_MAX)
+
+
+def _is_timeout(error):
+    """Return whether ``error`` was raised because a request timed out."""
+    if isinstance(error, socket.timeout):
+        return True
+    return isinstance(getattr(error, "reason", None), socket.timeout)
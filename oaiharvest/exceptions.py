@@ -11,3 +11,40 @@ class NotOAIPMHBaseURLException(OAIPMHHarvestException):
     """URL is not an OAI-PMH base URL."""
 
     pass
+
+
+class HarvestPausedException(OAIPMHHarvestException):
+    """Harvest paused outside of the wall clock time window for harvesting.
+
+    ``resumeAt`` => ``datetime`` at which harvesting may resume
+    ``resumptionToken`` => token from which to resume, or None to resume
+    from the last completed harvest
+    ``watermark`` => time up to which records will have been harvested once
+    the list continued by ``resumptionToken`` is completed, if known
+    """
+
+    def __init__(self, resumeAt, resumptionToken=None, watermark=None):
+        OAIPMHHarvestException.__init__(
+            self, "Harvest paused until {0}".format(resumeAt)
+        )
+        self.resumeAt = resumeAt
+        self.resumptionToken = resumptionToken
+        self.watermark = watermark
+
+
+class NoSuchProviderException(OAIPMHHarvestException):
+    """Provider is not in the registry, e.g. removed since it was queued."""
+
+    pass
+
+
+class NotArchivedException(OAIPMHHarvestException):
+    """Response to a request to be replayed is not in the archive."""
+
+    pass
+
+
+class LeaseLostException(OAIPMHHarvestException):
+    """Lease on a queued harvest expired, and it may be claimed by another."""
+
+    pass
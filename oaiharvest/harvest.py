@@ -3,10 +3,37 @@
 
 usage: %prog [-h] [--db DATABASEPATH] [-p METADATAPREFIX] [-r TOKEN]
              [-f YYYY-MM-DD] [-u YYYY-MM-DD] [-s SET] [-b HH:MM HH:MM]
-             [-d DIR] [--delete | --no-delete] [-l LIMIT]
-             [--create-subdirs | --subdirs-on SUBDIRS]
+             [-d DIR | --stream {json,xml} | --object-store URL |
+              --columnar DIR]
+             [--endpoint-url URL] [--max-in-flight N] [--max-retries N]
+             [--columnar-format {parquet,arrow}] [--field NAME=XPATH]
+             [--columnar-batch N] [--index PATH]
+             [-o PATH]
+             [--delete | --no-delete] [--delete-batch N]
+             [--delete-workers N] [--cache-dir-entries] [-l LIMIT]
+             [--create-subdirs | --subdirs-on SUBDIRS | --shard-depth N]
+             [--shard-width N]
+             [--cache-ttl HOURS] [--refresh-cache]
+             [-w WORKERS] [--per-host N] [--prefetch-pages N]
+             [--max-buffered-records N] [--max-buffered-mb MB]
+             [--memory-budget MB] [--parse-processes N]
+             [--validate] [--schema PREFIX=LOCATION] [--validate-workers N]
+             [--quarantine DIR] [--window DAYS]
+             [--failure-threshold N] [--reprobe HOURS] [--ignore-health]
+             [--strategy {auto,sequential,slices,sets}] [--max-partitions N]
+             [--parallel-after SECONDS]
+             [--checkpoint-pages N] [--archive DIR] [--archive-max-mb MB] [--replay]
+             [--journal DIR]
+             [--progress SECONDS] [--stall-timeout SECONDS] [-v | -q]
+             [--log-file PATH] [--log-json] [--log-sample N]
              provider [provider ...]
 
+usage: %prog enqueue|worker ... (see oaiharvest.worker)
+
+usage: %prog search ... (see oaiharvest.search)
+
+usage: %prog journal ... (see oaiharvest.journal)
+
 positional arguments:
   provider              OAI-PMH Provider from which to harvest. This may be
                         the base URL of an OAI-PMH server, or the short name
@@ -30,13 +57,50 @@ optional arguments:
   -s SET, --set SET     harvest only records within this set
   -b HH:MM HH:MM, --between HH:MM HH:MM
                         harvest only between the first and the second wall
-                        clock time (enables incremental harvesting)
+                        clock time (enables incremental harvesting). Harvests
+                        are paused outside of these times, and resume in the
+                        next window. Over-rides the registered harvest window
   -d DIR, --dir DIR     where to output files for harvested records.default:
                         current working path
+  --stream {json,xml}   write harvested records and deletions to a stream
+                        instead of files, as newline-delimited JSON or as
+                        length-prefixed XML
+  --object-store URL    upload records to object storage at
+                        s3://bucket/prefix, or to a local stand-in at
+                        file:///path
+  --endpoint-url URL    URL of an S3 compatible service, e.g. MinIO. default:
+                        AWS
+  --columnar DIR        write the headers of records, and fields extracted
+                        from their metadata, to batches of columnar files in
+                        DIR, e.g. for analytical queries
+  --max-in-flight N     maximum number of object storage requests at once
+                        (default: 16)
+  --max-retries N       number of times to retry failed object storage
+                        requests (default: 3)
+  --columnar-format {parquet,arrow}
+                        format of --columnar files (default: parquet)
+  --field NAME=XPATH    extract the values of XPATH from the metadata of each
+                        record into column NAME; may be repeated (default:
+                        Dublin Core title, creator, subject, date, type and
+                        identifier, as dc_title etc.)
+  --columnar-batch N    number of records in each --columnar file (default:
+                        100000)
+  --index PATH          keep a full-text index of the records written and
+                        deleted in a SQLite database at PATH, updated after
+                        each page, to query with oai-harvest search
+  -o PATH, --output PATH
+                        stream to write to, e.g. a named pipe. default: -
+                        (stdout)
   --delete              respect the server's instructions regarding deletions,
                         i.e. delete the files locally (default)
   --no-delete           ignore the server's instructions regarding deletions,
                         i.e. DO NOT delete the files locally
+  --delete-batch N      remove the files of deleted records N at a time
+                        (default: 1000)
+  --delete-workers N    number of threads removing the files of deleted
+                        records (default: 4)
+  --cache-dir-entries   list each output directory once, so that files of
+                        deleted records that were never harvested are skipped
   -l LIMIT, --limit LIMIT
                         limit the number of records to harvest from each
                         provider
@@ -45,6 +109,93 @@ optional arguments:
                         other than /, use the newer--subdirs-on option
   --subdirs-on SUBDIRS  create target subdirs based on occurrences of the
                         given characterin identifiers
+  --shard-depth N       spread files over N levels of subdirs named from a
+                        hash of the identifier
+  --shard-width N       number of hex digits in the name of each shard subdir
+                        (default: 2)
+  --cache-ttl HOURS     re-use cached Identify responses for this many hours
+                        (default: 24)
+  --refresh-cache       ignore cached Identify responses; revalidate with
+                        the provider
+  -w WORKERS, --workers WORKERS
+                        number of providers to harvest concurrently
+                        (default: 1)
+  --per-host N          maximum number of providers on the same host to
+                        harvest concurrently (default: 1)
+  --prefetch-pages N    fetch up to N pages of records ahead of storing them
+                        (default: 0)
+  --max-buffered-records N
+                        maximum number of records fetched ahead from each
+                        provider
+  --max-buffered-mb MB  maximum size of responses fetched ahead from each
+                        provider
+  --memory-budget MB    maximum size of responses fetched ahead from all
+                        providers together
+  --parse-processes N   parse pages of records in a pool of N processes
+                        (default: 0, parse while harvesting)
+  --validate            validate the metadata of each record against the XML
+                        Schema of its metadataPrefix, as listed by the
+                        provider, and count invalid records in the run
+                        summary
+  --schema PREFIX=LOCATION
+                        validate records in PREFIX against the XML Schema at
+                        LOCATION, a path or URL, rather than the one listed
+                        by the provider; may be repeated
+  --validate-workers N  number of threads in which to --validate records
+                        (default: 4)
+  --quarantine DIR      write records that are not valid to a subdirectory of
+                        DIR for each provider, with their errors, rather than
+                        storing them
+  --window DAYS         harvest records in windows of DAYS days, recording
+                        progress in the registry as each is completed
+  --failure-threshold N
+                        skip providers that have failed N times in a row,
+                        until their next probe (default: 3)
+  --reprobe HOURS       hours after which to try a skipped provider again,
+                        doubled after each further failure (default: 1)
+  --ignore-health       harvest from providers however often they have
+                        failed, and wait for them as long as the
+                        --stall-timeout
+  --strategy {auto,sequential,slices,sets}
+                        how to divide each harvest into lists of records
+                        requested concurrently: as tuned from the sizes and
+                        response times of recent pages from the provider
+                        (default), a single list, slices of datestamps, or
+                        top-level sets
+  --max-partitions N    maximum number of lists to request from a provider at
+                        once (default: 4)
+  --parallel-after SECONDS
+                        divide harvests expected to take longer than SECONDS
+                        in a single list, if tuned to do so (default: 600)
+  --checkpoint-pages N  record the resumptionToken every N pages, so that a
+                        harvest that is interrupted, e.g. by a crash,
+                        continues from it next time (default: 0, only when
+                        paused outside of its harvest window)
+  --archive DIR         keep compressed copies of all responses in DIR, e.g.
+                        to --replay
+  --archive-max-mb MB   maximum size of the archive; least recently used lists
+                        of records are removed to make room
+  --replay              harvest again from the responses in the --archive
+                        rather than from the providers, e.g. into a different
+                        layout. The registry is not updated
+  --journal DIR         record every file written or removed in the
+                        directories of records, with its previous content,
+                        in a journal of this run in DIR, so that the run can
+                        be rolled back or replayed with oai-harvest journal
+  --progress SECONDS    log the progress of each harvest every SECONDS
+                        seconds, with an estimate of when it will be complete
+                        if the provider reports the size of the list of
+                        records (default: 60, 0 to disable)
+  --stall-timeout SECONDS
+                        retry requests to which a provider has not responded
+                        within SECONDS seconds, and warn about harvests that
+                        have stalled (default: 300, 0 to wait indefinitely)
+  -v, --verbose         log debug messages
+  -q, --quiet           only log warnings and errors
+  --log-file PATH       also write log messages to PATH
+  --log-json            log messages as JSON objects, one per line
+  --log-sample N        log only one in every N debug messages about single
+                        records
 
 Copyright (c) 2013, the University of Liverpool <http://www.liv.ac.uk>.
 All rights reserved.
@@ -57,23 +208,84 @@ from __future__ import absolute_import, with_statement
 import logging
 import os
 import sys
+import time
 from argparse import ArgumentParser
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from datetime import datetime, timedelta
 
-from oaipmh.error import NoRecordsMatchError
+from oaipmh.error import BadResumptionTokenError
 
+from oaiharvest.archive import ResponseArchive
+from oaiharvest.cache import ResponseCache
+from oaiharvest.exceptions import (
+    HarvestPausedException,
+    LeaseLostException,
+    NoSuchProviderException,
+)
+from oaiharvest.health import HealthRegistry
+from oaiharvest.harvesters.base import OAIRecordGetter
+from oaiharvest.harvesters.columnar_harvester import ColumnarOAIHarvester
 from oaiharvest.harvesters.directory_harvester import DirectoryOAIHarvester
+from oaiharvest.harvesters.object_harvester import ObjectStoreOAIHarvester
+from oaiharvest.harvesters.stream_harvester import StreamOAIHarvester
+from oaiharvest.journal import HarvestJournal
+from oaiharvest.log import ProgressReporter, add_logging_arguments, configure_logging
+from oaiharvest.memory import BufferLimits, MemoryBudget, peak_rss
+from oaiharvest.parallel import ParallelPageParser
+from oaiharvest.scheduler import HarvestJob, HarvestScheduler
+from oaiharvest.stores.columnar_store import (
+    DC_FIELDS,
+    ColumnarRecordStore,
+    parse_field,
+)
+from oaiharvest.stores.index_store import IndexedRecordStore
+from oaiharvest.stores.object_store import object_client
+from oaiharvest.stores.stream_store import StreamRecordStore
+from oaiharvest.validation import RecordValidator, parse_schema
+from oaiharvest.tuning import (
+    PARALLEL_AFTER,
+    STRATEGIES,
+    TuningRegistry,
+    list_size,
+    sets_cover,
+    slices,
+    top_level_sets,
+)
 from .metadata import DefaultingMetadataRegistry, XMLMetadataReader
-from .registry import verify_database
+from .registry import parse_time, parse_window, verify_database
 
 
 def main(argv=None):
     """Process command line arguments, harvest records accordingly."""
     global argparser, metadata_registry
     if argv is None:
-        args = argparser.parse_args()
-    else:
-        args = argparser.parse_args(argv)
+        argv = sys.argv[1:]
+    # Subcommands may not be names of providers (see registry.check_name);
+    # those registered before they were added are harvested after "--"
+    if argv and argv[0] in ("worker", "enqueue"):
+        # Harvest from a queue shared with other workers
+        from oaiharvest import worker
+
+        return worker.main(argv)
+    if argv and argv[0] == "search":
+        # Search the full-text index of harvested records
+        from oaiharvest import search
+
+        return search.main(argv[1:])
+    if argv and argv[0] == "journal":
+        # Roll back, replay or compact the journals of runs
+        from oaiharvest import journal
+
+        return journal.main(argv[1:])
+    args = argparser.parse_args(argv)
+    if args.replay and args.archiveDir is None:
+        argparser.error("--replay requires --archive")
+    if args.journalDir is not None and (
+        args.stream or args.columnar or args.objectStore
+    ):
+        argparser.error("--journal requires harvesting into a directory")
+    configure_logging(args)
     logger = logging.getLogger(__name__).getChild("main")
     # Establish connection to persistent storage
     cxn = verify_database(args.databasePath)
@@ -85,19 +297,13 @@ def main(argv=None):
         providers.remove("all")
         # Update set with all registered providers
         providers.update([row[0] for row in cxn.execute("SELECT name FROM providers")])
+    health = health_registry(args, cxn)
+    jobs = []
     for provider in providers:
         if not provider.startswith(("http://", "https://")):
-            # Fetch details from provider registry
-            cursor = cxn.execute(
-                "SELECT url, "
-                "destination, "
-                "metadataPrefix, "
-                "lastHarvest [timestamp]"
-                "FROM providers "
-                "WHERE name=?",
-                (provider,),
-            )
-            row = cursor.fetchone()
+            row = cxn.execute(
+                "SELECT url FROM providers WHERE name=?", (provider,)
+            ).fetchone()
             if row is None:
                 logger.error(
                     "Provider {0} does not exists in database {1}"
@@ -105,143 +311,859 @@ def main(argv=None):
                 )
                 continue
             baseUrl = row[0]
-            logger.info(
-                "Harvesting from registered provider {0} - {1}"
-                "".format(provider, baseUrl)
-            )
-            # Allow over-ride of default destination
-            if args.dir is not None:
-                logger.warning(
-                    "Value for command line option --dir"
-                    " over-rides registered destination"
-                )
-            else:
-                args.dir = row[1]
-            # Allow over-ride of default metadataPrefix
-            if args.metadataPrefix is not None:
-                logger.warning(
-                    "Value for command line option --metadataPrefix"
-                    " over-rides registered value"
-                )
-            else:
-                args.metadataPrefix = row[2]
-            # Allow over-ride of stored lastHarvest time
-            # e.g. to repair some locally munged data
-            if args.from_ is not None:
-                logger.warning(
-                    "Value for command line option --from"
-                    " over-rides recorded lastHarvest timestamp"
-                )
-            elif args.resumptionToken is None:
-                args.from_ = row[3]
         else:
             baseUrl = provider
-            logger.info("Harvesting from {0}".format(baseUrl))
-            if args.dir is None:
-                args.dir = "."
+        state = health.get(provider)
+        if state.is_open() and not args.ignoreHealth:
+            logger.warning(
+                "Skipping {0} until {1} after {2} consecutive failures; last "
+                "error: {3}".format(
+                    provider, state.retryAt, state.failures, state.lastError
+                )
+            )
+            continue
+        jobs.append(
+            HarvestJob(
+                provider,
+                baseUrl,
+                expected_duration(cxn, provider),
+                failures=state.failures,
+            )
+        )
+    cxn.close()
+    prepare(args)
+    scheduler = HarvestScheduler(maxWorkers=args.workers, maxPerHost=args.perHost)
+    try:
+        results = scheduler.run(
+            jobs,
+            lambda job: harvest_provider(
+                args, job.name, resume=job.notBefore is not None
+            ),
+        )
+    finally:
+        close(args)
+    # Run summary
+    values = list(results.values())
+    logger.info(
+        "Harvested from {0} providers: {1} completed, {2} incomplete, "
+        "{3} failed".format(
+            len(values),
+            values.count(True),
+            values.count(False),
+            values.count(None),
+        )
+    )
+    if args.validator is not None:
+        for provider, stats in sorted(args.validator.stats().items()):
+            logger.info("Validated records from {0}: {1}".format(provider, stats))
+    rss = peak_rss()
+    if rss is not None:
+        logger.info("Peak memory use: {0:.1f} MB".format(rss / MB))
+    if args.bufferLimits.budget is not None:
+        logger.info(
+            "Peak buffered responses: {0:.1f} MB".format(
+                args.bufferLimits.budget.peak / MB
+            )
+        )
+
+
+def prepare(args):
+    """Set up resources shared by all harvests according to ``args``.
+
+    These are added to ``args``, e.g. as ``args.bufferLimits``, and should be
+    released with ``close``.
+    """
+    global metadata_registry
+    budget = None
+    if args.memoryBudget:
+        budget = MemoryBudget(int(args.memoryBudget * MB))
+    args.bufferLimits = BufferLimits(
+        maxPages=args.prefetchPages,
+        maxRecords=args.maxBufferedRecords,
+        maxBytes=int(args.maxBufferedMB * MB) if args.maxBufferedMB else None,
+        budget=budget,
+    )
+    # Stream shared by all providers when not harvesting into directories
+    args.outputStream = None
+    if args.stream is not None:
+        if args.output == "-":
+            args.outputStream = sys.stdout.buffer
+        else:
+            args.outputStream = open(args.output, "wb")
+    # Pool of processes shared by all providers for parsing pages
+    args.pageParser = None
+    if args.parseProcesses:
+        args.pageParser = ParallelPageParser(metadata_registry, args.parseProcesses)
+    # Pool of threads shared by all providers for validating records
+    args.validator = None
+    if args.validate:
+        args.validator = RecordValidator(
+            dict(args.schemas or ()),
+            workers=args.validateWorkers,
+            quarantine=args.quarantine and os.path.abspath(args.quarantine),
+            timeout=args.stallTimeout or None,
+        )
+    # Journal of the changes made by this run to directories of records
+    args.journal = None
+    if args.journalDir is not None:
+        args.journal = HarvestJournal(os.path.abspath(args.journalDir))
+        logging.getLogger(__name__).getChild("prepare").info(
+            "Recording changes in journal {0}".format(args.journal.run.path)
+        )
+    # Archive of responses shared by all providers
+    args.archive = None
+    if args.archiveDir is not None:
+        args.archive = ResponseArchive(
+            os.path.abspath(args.archiveDir),
+            maxBytes=int(args.archiveMaxMB * MB) if args.archiveMaxMB else None,
+            replay=args.replay,
+        )
+    # Progress of all providers, logged periodically
+    args.progressReporter = None
+    if args.progress:
+        args.progressReporter = ProgressReporter(
+            args.progress, stallTimeout=args.stallTimeout or None
+        )
+        args.progressReporter.start()
+
+
+def close(args):
+    """Release resources set up by ``prepare``."""
+    if args.outputStream not in (None, sys.stdout.buffer):
+        args.outputStream.close()
+    if args.pageParser is not None:
+        args.pageParser.close()
+    if args.validator is not None:
+        args.validator.close()
+    if args.progressReporter is not None:
+        args.progressReporter.stop()
+    if args.archive is not None:
+        args.archive.close()
+    if args.journal is not None:
+        args.journal.close()
 
-        if args.metadataPrefix is None:
-            args.metadataPrefix = "oai_dc"
 
-        # Init harvester object
+def harvest_provider(args, provider, resume=False):
+    """Harvest records from a single provider according to ``args``.
+
+    Return whether or not all available records were harvested, or None if
+    the harvest failed. Each call
+    uses its own database connection so that providers may be harvested in
+    separate threads.
+
+    Raise ``HarvestPausedException`` if the harvest is paused outside of its
+    harvest window, having recorded where to continue from. ``resume`` =>
+    continue a harvest paused earlier in this process, whatever the
+    starting point given in ``args``.
+    """
+    # Settings from the registry must not leak into other providers
+    args = copy(args)
+    # Resume a harvest that was paused outside of its harvest window, unless
+    # told explicitly where to start
+    explicitStart = args.from_ is not None or args.resumptionToken is not None
+    resume = resume or not explicitStart
+    cxn = verify_database(args.databasePath)
+    configured = False
+    try:
+        baseUrl = configure_provider(args, cxn, provider)
+        configured = True
+        partitions = plan_partitions(args, cxn, provider, baseUrl, resume)
+        if partitions is not None:
+            return harvest_partitions(args, cxn, provider, baseUrl, partitions)
+        harvester = make_harvester(args, cxn, provider)
+        try:
+            completed = run_harvest(
+                args,
+                provider,
+                harvester,
+                baseUrl,
+                harvest_arguments(args),
+                cxn,
+                resume=resume,
+            )
+        except BaseException:
+            close_store(harvester)
+            raise
+        if not close_store(harvester):
+            return None
+        return completed
+    finally:
+        if configured and not args.replay:
+            # Choose how to harvest next time
+            tuning_registry(args, cxn).tune(provider)
+        cxn.close()
+
+
+def close_store(harvester):
+    """Close the store of ``harvester``, return whether that succeeded.
+
+    Errors are logged rather than raised, so that they do not hide those of
+    the harvest itself.
+    """
+    try:
+        harvester.store.close()
+    except Exception as e:
+        logger = logging.getLogger(__name__).getChild("main")
+        logger.error("Could not close store: {0}".format(e), exc_info=True)
+        return False
+    return True
+
+
+def configure_provider(args, cxn, provider):
+    """Update ``args`` with registered settings for ``provider``.
+
+    Settings given in ``args`` over-ride those in the registry. Return the
+    base URL of the provider. Raise ``NoSuchProviderException`` if it is not
+    registered.
+    """
+    logger = logging.getLogger(__name__).getChild("main")
+    if not provider.startswith(("http://", "https://")):
+        # Fetch details from provider registry
+        cursor = cxn.execute(
+            "SELECT url, "
+            "destination, "
+            "metadataPrefix, "
+            "lastHarvest [timestamp], "
+            "harvestWindow "
+            "FROM providers "
+            "WHERE name=?",
+            (provider,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise NoSuchProviderException(
+                "Provider {0} does not exists in database {1}"
+                "".format(provider, args.databasePath)
+            )
+        baseUrl = row[0]
+        logger.info(
+            "Harvesting from registered provider {0} - {1}"
+            "".format(provider, baseUrl)
+        )
+        # Allow over-ride of default destination
+        if args.dir is not None:
+            logger.warning(
+                "Value for command line option --dir"
+                " over-rides registered destination"
+            )
+        else:
+            args.dir = row[1]
+        # Allow over-ride of default metadataPrefix
+        if args.metadataPrefix is not None:
+            logger.warning(
+                "Value for command line option --metadataPrefix"
+                " over-rides registered value"
+            )
+        else:
+            args.metadataPrefix = row[2]
+        # Allow over-ride of stored lastHarvest time
+        # e.g. to repair some locally munged data
+        if args.from_ is not None:
+            logger.warning(
+                "Value for command line option --from"
+                " over-rides recorded lastHarvest timestamp"
+            )
+        elif args.resumptionToken is None:
+            args.from_ = row[3]
+        # Allow over-ride of registered harvest window
+        if args.between is None:
+            args.between = parse_window(row[4])
+    else:
+        baseUrl = provider
+        logger.info("Harvesting from {0}".format(baseUrl))
+        if args.dir is None:
+            args.dir = "."
+
+    if args.metadataPrefix is None:
+        args.metadataPrefix = "oai_dc"
+
+    if args.stallTimeout and not args.ignoreHealth:
+        # Time out sooner than usual if the provider usually responds quickly
+        timeout = health_registry(args, cxn).get(provider).timeout(args.stallTimeout)
+        if timeout != args.stallTimeout:
+            logger.debug(
+                "Timing out requests to {0} after {1:.1f}s".format(provider, timeout)
+            )
+        args.stallTimeout = timeout
+
+    if args.replay:
+        # Replay lists as they were harvested, whenever that was
+        args.window = None
+    return baseUrl
+
+
+def response_cache(args, cxn):
+    """Return ``ResponseCache`` of Identify responses in ``cxn``."""
+    return ResponseCache(
+        cxn, ttl=timedelta(hours=args.cacheTTL), refresh=args.refreshCache
+    )
+
+
+def make_harvester(args, cxn, provider, label=None):
+    """Return a harvester for ``provider`` configured by ``args``.
+
+    ``cxn`` => registry database, in which to cache responses
+    ``label`` => name under which to report progress, if not ``provider``
+    """
+    global metadata_registry
+    responseCache = response_cache(args, cxn)
+    progress = None
+    if args.progressReporter is not None:
+        progress = args.progressReporter.counter(label or provider)
+    validator = None
+    if args.validator is not None:
+        validator = args.validator.for_provider(provider)
+    # Init harvester object
+    if args.stream is not None:
+        harvester = StreamOAIHarvester(
+            metadata_registry,
+            args.outputStream,
+            args.stream,
+            source=provider,
+            respectDeletions=args.deletions,
+            nRecs=args.limit,
+            responseCache=responseCache,
+            bufferLimits=args.bufferLimits,
+            pageParser=args.pageParser,
+            window=args.window,
+            progress=progress,
+            archive=args.archive,
+            stallTimeout=args.stallTimeout or None,
+            validator=validator,
+        )
+    elif args.columnar is not None:
+        harvester = ColumnarOAIHarvester(
+            metadata_registry,
+            os.path.abspath(args.columnar),
+            fields=args.fields or DC_FIELDS,
+            format=args.columnarFormat,
+            source=provider,
+            batchSize=args.columnarBatch,
+            respectDeletions=args.deletions,
+            nRecs=args.limit,
+            responseCache=responseCache,
+            bufferLimits=args.bufferLimits,
+            pageParser=args.pageParser,
+            window=args.window,
+            progress=progress,
+            archive=args.archive,
+            stallTimeout=args.stallTimeout or None,
+            validator=validator,
+        )
+    elif args.objectStore is not None:
+        client, prefix = object_client(
+            args.objectStore, args.endpointUrl, maxConnections=args.maxInFlight
+        )
+        harvester = ObjectStoreOAIHarvester(
+            metadata_registry,
+            client,
+            prefix,
+            respectDeletions=args.deletions,
+            nRecs=args.limit,
+            responseCache=responseCache,
+            bufferLimits=args.bufferLimits,
+            pageParser=args.pageParser,
+            window=args.window,
+            progress=progress,
+            archive=args.archive,
+            stallTimeout=args.stallTimeout or None,
+            validator=validator,
+            maxInFlight=args.maxInFlight,
+            maxRetries=args.maxRetries,
+        )
+    else:
         harvester = DirectoryOAIHarvester(
             metadata_registry,
             os.path.abspath(args.dir),
             respectDeletions=args.deletions,
             createSubDirs=args.subdirs,
             nRecs=args.limit,
+            responseCache=responseCache,
+            shardDepth=args.shardDepth,
+            shardWidth=args.shardWidth,
+            bufferLimits=args.bufferLimits,
+            pageParser=args.pageParser,
+            window=args.window,
+            progress=progress,
+            archive=args.archive,
+            stallTimeout=args.stallTimeout or None,
+            validator=validator,
+            deleteBatchSize=args.deleteBatch,
+            deleteWorkers=args.deleteWorkers,
+            cacheEntries=args.cacheDirEntries,
+            journal=args.journal,
         )
-        # Create a dictionary of keyword args
-        # Avoid sending kwargs with value of None - e.g. set=None causes
-        # error on servers that don't support set hierarchy.
-        kwargs = {}
-        if args.from_ is not None:
-            kwargs["from_"] = args.from_
-        if args.until is not None:
-            kwargs["until"] = args.until
-            # Set the end time of the harvest slice with which to
-            # update the registry if necessary
-            lastHarvestEndTime = args.until
-        else:
-            # Set the end time of the harvest slice to now
-            # The first request might create a snapshot of the data on
-            # the provider server in order for resumption tokens to work
-            # correctly. Any records added after this snapshot, but
-            # before completion of harvesting must be included in next
-            # harvest.
-            lastHarvestEndTime = datetime.now()
-
-        if args.set is not None:
-            kwargs["set"] = args.set
-        if args.between is not None:
-            kwargs["between"] = args.between
-        if args.resumptionToken is not None:
-            kwargs["resumptionToken"] = args.resumptionToken
+    if args.index is not None:
+        # Index records as they are written and deleted
+        harvester.store = IndexedRecordStore(
+            harvester.store, os.path.abspath(args.index), provider
+        )
+    return harvester
+
+
+def harvest_arguments(args):
+    """Return keyword args for ``harvest`` from ``args``."""
+    # Create a dictionary of keyword args
+    # Avoid sending kwargs with value of None - e.g. set=None causes
+    # error on servers that don't support set hierarchy.
+    kwargs = {}
+    if args.from_ is not None:
+        kwargs["from_"] = args.from_
+    if args.until is not None:
+        kwargs["until"] = args.until
+    if args.set is not None:
+        kwargs["set"] = args.set
+    if args.between is not None:
+        kwargs["between"] = args.between
+    if args.resumptionToken is not None:
+        kwargs["resumptionToken"] = args.resumptionToken
+    return kwargs
+
+
+def run_harvest(
+    args,
+    provider,
+    harvester,
+    baseUrl,
+    kwargs,
+    cxn,
+    resume=False,
+    checkpoints=None,
+    updateRegistry=True,
+    raiseErrors=False,
+):
+    """Harvest from ``provider`` with ``harvester``, committing to ``cxn``.
+
+    ``resume`` => continue any harvest paused outside of its harvest window
+    ``checkpoints`` => where to record and look up resumptionTokens from
+    which to continue, default ``RegistryCheckpoints`` of ``provider``
+    ``updateRegistry`` => update the provider's lastHarvest as each window of
+    records is completed
+    ``raiseErrors`` => raise the exception for a failed harvest rather than
+    returning None
+
+    Return value and exceptions are as for ``harvest_provider``.
+    """
+    logger = logging.getLogger(__name__).getChild("main")
+    if checkpoints is None:
+        checkpoints = RegistryCheckpoints(cxn, provider)
+
+    def commit(watermark):
+        # Update lastHarvest time for registered provider. This is the end
+        # of the harvest slice, i.e. the given --until time, or the time of
+        # the server's first response. The first request might create a
+        # snapshot of the data on the provider server in order for
+        # resumption tokens to work correctly. Any records added after
+        # this snapshot, but before completion of harvesting must be
+        # included in next harvest.
+        logger.debug("Harvested {0} up to {1}".format(provider, watermark))
+        if updateRegistry:
+            with cxn:
+                cxn.execute(
+                    "UPDATE providers SET lastHarvest=? WHERE name=?",
+                    (watermark, provider),
+                )
+        if args.checkpointPages:
+            # Tokens of the completed list must not be resumed from
+            checkpoints.save(None, watermark)
+
+    if args.replay:
+        # Store records from archived responses; the registry is unchanged
         try:
-            completed = harvester.harvest(baseUrl, args.metadataPrefix, **kwargs)
-        except NoRecordsMatchError:
-            # Nothing to harvest
-            completed = True
-            logger.info("0 records to harvest")
-            logger.debug(
-                "The combination of the values of the from={0}, "
-                "until={1}, set=(N/A) and metadataPrefix={2} "
-                "arguments results in an empty list."
-                "".format(args.from_, args.until, args.metadataPrefix)
-            )
+            return harvester.replay(baseUrl, args.metadataPrefix)
         except Exception as e:
-            # Log error
+            if raiseErrors:
+                raise
             logger.error(str(e), exc_info=True)
-            # Continue to next provide without updating database lastHarvest
-            continue
+            return None
 
+    checkpoint = None
+    if resume:
+        checkpoint = checkpoints.load()
+
+    # Record where to resume every few pages, e.g. after a crash
+    onCheckpoint = None
+    if args.checkpointPages:
+        onCheckpoint = checkpoints.save
+
+    started = time.time()
+    try:
+        completed = True
+        if checkpoint is not None:
+            token, watermark = checkpoint
+            logger.info("Resuming interrupted harvest from {0}".format(provider))
+            try:
+                completed = harvester.harvest(
+                    baseUrl,
+                    args.metadataPrefix,
+                    onCommit=commit,
+                    onCheckpoint=onCheckpoint,
+                    checkpointPages=args.checkpointPages,
+                    resumptionToken=token,
+                    until=watermark,
+                    between=args.between,
+                )
+            except BadResumptionTokenError:
+                logger.warning(
+                    "resumptionToken for interrupted harvest has expired; "
+                    "harvesting again from the last completed time"
+                )
+            else:
+                # Continue from the end of the interrupted list of records
+                kwargs["from_"] = harvester.watermark
+            kwargs.pop("resumptionToken", None)
+            checkpoints.save(None)
         if completed:
-            # Update lastHarvest time for registered provider
-            with cxn:
-                cxn.execute(
-                    "UPDATE providers SET lastHarvest=? WHERE name=?",
-                    (lastHarvestEndTime, provider),
+            completed = harvester.harvest(
+                baseUrl,
+                args.metadataPrefix,
+                onCommit=commit,
+                onCheckpoint=onCheckpoint,
+                checkpointPages=args.checkpointPages,
+                **kwargs
+            )
+    except HarvestPausedException as e:
+        # Release the connection, record where to resume in the next window
+        checkpoints.save(e.resumptionToken, e.watermark)
+        record_health(args, cxn, provider, harvester)
+        record_pages(args, cxn, provider, harvester)
+        raise
+    except LeaseLostException:
+        raise
+    except Exception as e:
+        record_health(args, cxn, provider, harvester, e)
+        record_pages(args, cxn, provider, harvester)
+        if raiseErrors:
+            raise
+        # Log error
+        logger.error(str(e), exc_info=True)
+        # Continue to next provider; lastHarvest reflects completed windows
+        return None
+    record_duration(cxn, provider, started)
+    record_health(args, cxn, provider, harvester)
+    record_pages(args, cxn, provider, harvester)
+
+    if not completed:
+        logger.warn(
+            "Harvesting incomplete; additional records were "
+            "available from the server"
+        )
+    return completed
+
+
+class RegistryCheckpoints(object):
+    """Where to resume harvests from ``provider``, in the registry ``cxn``."""
+
+    def __init__(self, cxn, provider):
+        self.cxn = cxn
+        self.provider = provider
+
+    def load(self):
+        """Return (resumptionToken, watermark) to resume from, or None."""
+        return load_checkpoint(self.cxn, self.provider)
+
+    def save(self, resumptionToken, watermark=None):
+        """Record where to resume, or that there is nothing to resume."""
+        save_checkpoint(self.cxn, self.provider, resumptionToken, watermark)
+
+
+def load_checkpoint(cxn, provider):
+    """Return (resumptionToken, watermark) of interrupted harvest, or None."""
+    return cxn.execute(
+        "SELECT resumptionToken, watermark [timestamp] "
+        "FROM checkpoints WHERE provider=?",
+        (provider,),
+    ).fetchone()
+
+
+def save_checkpoint(cxn, provider, resumptionToken, watermark=None):
+    """Record where to resume an interrupted harvest from ``provider``.
+
+    Without a ``resumptionToken`` there is no list of records to continue,
+    and the next harvest starts from the provider's lastHarvest.
+    """
+    with cxn:
+        cxn.execute("DELETE FROM checkpoints WHERE provider=?", (provider,))
+        if resumptionToken is not None:
+            cxn.execute(
+                "INSERT INTO checkpoints(provider, resumptionToken, watermark) "
+                "VALUES (?, ?, ?)",
+                (provider, resumptionToken, watermark),
+            )
+
+
+def health_registry(args, cxn):
+    """Return ``HealthRegistry`` of providers in ``cxn``, as set in ``args``."""
+    return HealthRegistry(
+        cxn,
+        threshold=args.failureThreshold,
+        reprobe=timedelta(hours=args.reprobe),
+    )
+
+
+def record_health(args, cxn, provider, harvester, error=None):
+    """Record the health of ``provider`` after a harvest by ``harvester``.
+
+    ``error`` => exception with which the harvest failed, or None
+    """
+    requests, seconds = harvester.record_getter.request_stats()
+    health = health_registry(args, cxn)
+    if error is None:
+        health.record_success(provider, requests, seconds)
+    else:
+        health.record_failure(provider, error, requests, seconds)
+
+
+def tuning_registry(args, cxn):
+    """Return ``TuningRegistry`` of providers in ``cxn``, as set in ``args``."""
+    return TuningRegistry(
+        cxn, maxPartitions=args.maxPartitions, parallelAfter=args.parallelAfter
+    )
+
+
+def record_pages(args, cxn, provider, harvester):
+    """Record the pages of records received from ``provider`` by ``harvester``."""
+    stats = harvester.record_getter.pageStats
+    if stats.pages:
+        tuning_registry(args, cxn).record_pages(provider, stats)
+
+
+def plan_partitions(args, cxn, provider, baseUrl, resume=False):
+    """Return keyword args for each list into which to divide a harvest.
+
+    The strategy is ``args.strategy``, or, if that is "auto", the one tuned
+    for ``provider``. Return None to harvest in a single list, e.g. if the
+    harvest is expected to be quick, or cannot be divided.
+
+    ``resume`` => whether an interrupted harvest is to be resumed
+    """
+    logger = logging.getLogger(__name__).getChild("tuning")
+    registry = tuning_registry(args, cxn)
+    tuning = registry.get(provider)
+    strategy = args.strategy
+    if strategy == "auto":
+        strategy = tuning.strategy
+    if strategy == "sequential":
+        return None
+    if (
+        args.replay
+        or args.between is not None
+        or args.resumptionToken is not None
+        or args.limit
+        or (resume and load_checkpoint(cxn, provider) is not None)
+    ):
+        logger.debug(
+            "Harvesting {0} in a single list; this harvest cannot be "
+            "divided".format(provider)
+        )
+        return None
+    try:
+        return _plan_partitions(
+            args, cxn, registry, tuning, strategy, provider, baseUrl
+        )
+    except Exception as e:
+        logger.warning(
+            "Harvesting {0} in a single list; could not divide the harvest: "
+            "{1}".format(provider, e)
+        )
+        return None
+
+
+def _plan_partitions(args, cxn, registry, tuning, strategy, provider, baseUrl):
+    logger = logging.getLogger(__name__).getChild("tuning")
+    getter = OAIRecordGetter(
+        metadata_registry,
+        responseCache=response_cache(args, cxn),
+        stallTimeout=args.stallTimeout or None,
+    )
+    client = getter.get_client(baseUrl)
+    kwargs = harvest_arguments(args)
+    count = args.maxPartitions
+    size = None
+    if args.strategy == "auto" or strategy == "sets":
+        size = list_size(client, args.metadataPrefix, **kwargs)
+        if size == 0:
+            return None
+    if args.strategy == "auto":
+        # Only divide harvests that are expected to take a while
+        count = registry.partitions(tuning.expected_seconds(size))
+        if count < 2:
+            logger.debug(
+                "Harvesting {0} in a single list; {1} records to "
+                "harvest".format(provider, size)
+            )
+            return None
+    if strategy == "sets" and args.set is None:
+        sets = top_level_sets(client)
+        # Sets may overlap, so their sizes cannot show that they cover all
+        checked = sets_cover(client, args.metadataPrefix, sets, **kwargs)
+        registry.record_sets_cover(provider, checked is not None)
+        if checked is not None:
+            logger.info(
+                "Harvesting {0} in {1} sets, {2} at a time".format(
+                    provider, len(sets), count
                 )
-        else:
-            logger.warn(
-                "Harvesting incomplete; additional records were "
-                "available from the server"
             )
+            # Records changed since the check may be in no set; they are
+            # left to the next harvest
+            until = kwargs.get("until") or checked
+            return [dict(kwargs, set=spec, until=until) for spec in sets]
+        logger.info(
+            "Not harvesting {0} in sets; they do not include all "
+            "records".format(provider)
+        )
+    start = kwargs.get("from_") or client.identify().earliestDatestamp()
+    end = kwargs.get("until") or datetime.utcnow()
+    bounds = slices(start, end, count, client._day_granularity)
+    if len(bounds) < 2:
+        return None
+    logger.info(
+        "Harvesting {0} in {1} slices of datestamps".format(provider, len(bounds))
+    )
+    partitions = [dict(kwargs, from_=from_, until=until) for from_, until in bounds]
+    # The last slice ends with the harvest, open-ended unless --until is given
+    del partitions[-1]["until"]
+    if "until" in kwargs:
+        partitions[-1]["until"] = kwargs["until"]
+    return partitions
+
+
+def harvest_partitions(args, cxn, provider, baseUrl, partitions):
+    """Harvest the lists of ``partitions`` from ``provider`` concurrently.
+
+    ``partitions`` => keyword args for ``harvest`` of each list, as returned
+    by ``plan_partitions``
+
+    The provider's lastHarvest is updated once all lists are completed, to
+    the earliest time up to which those that end with the harvest, or the
+    sets, have harvested records. Return value is as for ``harvest_provider``.
+    """
+    logger = logging.getLogger(__name__).getChild("main")
+    # Resuming from checkpoints of several lists is not supported
+    partArgs = copy(args)
+    partArgs.checkpointPages = 0
+
+    def harvest_partition(kwargs):
+        partCxn = verify_database(args.databasePath)
+        harvester = make_harvester(
+            partArgs, partCxn, provider, label=_partition_label(provider, kwargs)
+        )
+        try:
+            completed = run_harvest(
+                partArgs,
+                provider,
+                harvester,
+                baseUrl,
+                dict(kwargs),
+                partCxn,
+                checkpoints=_NoCheckpoints(),
+                updateRegistry=False,
+            )
+        except BaseException:
+            close_store(harvester)
+            raise
+        finally:
+            partCxn.close()
+        if not close_store(harvester):
+            completed = None
+        return completed, harvester.watermark, harvester.record_getter.pageStats
+
+    with ThreadPoolExecutor(max_workers=args.maxPartitions) as executor:
+        results = list(executor.map(harvest_partition, partitions))
+    completed = [result[0] for result in results]
+    if None in completed:
+        return None
+    if partitions[0].get("set") == args.set:
+        # Sliced; how evenly records are spread decides whether to try sets
+        tuning_registry(args, cxn).record_slices(
+            provider, [result[2].records for result in results]
+        )
+    if not all(completed):
+        logger.warn(
+            "Harvesting incomplete; additional records were "
+            "available from the server"
+        )
+        return False
+    watermark = min(
+        result[1]
+        for kwargs, result in zip(partitions, results)
+        if kwargs.get("until") == args.until or kwargs.get("set") != args.set
+    )
+    logger.debug("Harvested {0} up to {1}".format(provider, watermark))
+    with cxn:
+        cxn.execute(
+            "UPDATE providers SET lastHarvest=? WHERE name=?",
+            (watermark, provider),
+        )
+    return True
+
+
+def _partition_label(provider, kwargs):
+    """Return name of the partition of a harvest with ``kwargs``."""
+    if kwargs.get("set") is not None:
+        return "{0} set {1}".format(provider, kwargs["set"])
+    return "{0} from {1:%Y-%m-%d %H:%M}".format(provider, kwargs["from_"])
+
+
+class _NoCheckpoints(object):
+    """Checkpoints of a list that is not to be resumed."""
+
+    def load(self):
+        return None
+
+    def save(self, resumptionToken, watermark=None):
+        pass
+
+
+def expected_duration(cxn, provider, history=5):
+    """Return mean duration in seconds of recent harvests from ``provider``.
+
+    Return None if there is no history for the provider.
+    """
+    return cxn.execute(
+        "SELECT avg(duration) FROM ("
+        "SELECT duration FROM harvests WHERE provider=? "
+        "ORDER BY started DESC LIMIT ?)",
+        (provider, history),
+    ).fetchone()[0]
+
+
+def record_duration(cxn, provider, started):
+    """Record how long a harvest from ``provider`` took."""
+    with cxn:
+        cxn.execute(
+            "INSERT INTO harvests(provider, started, duration) VALUES (?, ?, ?)",
+            (provider, datetime.fromtimestamp(started), time.time() - started),
+        )
+
+
+#: Bytes in a megabyte, for memory options
+MB = 1024 * 1024
 
 
 def parse_date(argument):
-    """ Date parser to be used as type argument for argparser options. """
+    """Date parser to be used as type argument for argparser options."""
     return datetime.strptime(argument, "%Y-%m-%d")
 
 
-def parse_time(argument):
-    """ Time parser to be used as type argument for argparser options. """
-    return datetime.strptime(argument, "%H:%M")
+def parse_days(argument):
+    """Duration parser to be used as type argument for argparser options."""
+    return timedelta(days=float(argument))
 
 
 # Set up argument parser
 docbits = __doc__.split("\n\n")
 
-argparser = ArgumentParser(description=docbits[0], epilog="\n\n".join(docbits[-2:]))
-argparser.add_argument(
+# Options shared with other commands, e.g. worker
+options = ArgumentParser(add_help=False)
+options.add_argument(
     "--db",
     "--database",
     dest="databasePath",
     default=os.path.expanduser("~/.oai-harvest/registry.db"),
     help=("Path to provider registry database. Currently " "supports sqlite3 only."),
 )
-argparser.add_argument(
-    "provider",
-    nargs="+",
-    help=(
-        "OAI-PMH Provider from which to harvest. This may"
-        " be the base URL of an OAI-PMH server, or the "
-        "short name of a registered provider. You may "
-        'also specify "all" for all registered '
-        "providers."
-    ),
-)
-argparser.add_argument(
+options.add_argument(
     "-p",
     "--metadataPrefix",
     dest="metadataPrefix",
@@ -250,14 +1172,14 @@ argparser.add_argument(
         "in which records should be harvested."
     ),
 )
-argparser.add_argument(
+options.add_argument(
     "-r",
     "--resume-from",
     dest="resumptionToken",
     metavar="TOKEN",
     help="start at the given resumption TOKEN",
 )
-argparser.add_argument(
+options.add_argument(
     "-f",
     "--from",
     type=parse_date,
@@ -265,7 +1187,7 @@ argparser.add_argument(
     metavar="YYYY-MM-DD",
     help=("harvest only records added/modified after this " "date."),
 )
-argparser.add_argument(
+options.add_argument(
     "-u",
     "--until",
     type=parse_date,
@@ -273,10 +1195,10 @@ argparser.add_argument(
     metavar="YYYY-MM-DD",
     help=("harvest only records added/modified up to this " "date."),
 )
-argparser.add_argument(
+options.add_argument(
     "-s", "--set", dest="set", help=("harvest only records within this set")
 )
-argparser.add_argument(
+options.add_argument(
     "-b",
     "--between",
     type=parse_time,
@@ -284,11 +1206,13 @@ argparser.add_argument(
     metavar="HH:MM",
     help=(
         "harvest only between the first and the second wall clock time "
-        "(enables incremental harvesting)"
+        "(enables incremental harvesting). Harvests are paused outside of "
+        "these times, and resume in the next window. Over-rides the "
+        "registered harvest window"
     ),
 )
 
-group = argparser.add_mutually_exclusive_group()
+group = options.add_mutually_exclusive_group()
 group.add_argument(
     "-d",
     "--dir",
@@ -297,8 +1221,103 @@ group.add_argument(
         "where to output files for harvested records." "default: current working path"
     ),
 )
+group.add_argument(
+    "--stream",
+    dest="stream",
+    choices=StreamRecordStore.FORMATS,
+    help=(
+        "write harvested records and deletions to a stream instead of files, "
+        "as newline-delimited JSON or as length-prefixed XML"
+    ),
+)
+group.add_argument(
+    "--object-store",
+    dest="objectStore",
+    metavar="URL",
+    help=(
+        "upload records to object storage at s3://bucket/prefix, or to a "
+        "local stand-in at file:///path"
+    ),
+)
+group.add_argument(
+    "--columnar",
+    dest="columnar",
+    metavar="DIR",
+    help=(
+        "write the headers of records, and fields extracted from their "
+        "metadata, to batches of columnar files in DIR, e.g. for analytical "
+        "queries"
+    ),
+)
+options.add_argument(
+    "--endpoint-url",
+    dest="endpointUrl",
+    metavar="URL",
+    help="URL of an S3 compatible service, e.g. MinIO. default: AWS",
+)
+options.add_argument(
+    "--max-in-flight",
+    dest="maxInFlight",
+    type=int,
+    default=16,
+    metavar="N",
+    help="maximum number of object storage requests at once (default: 16)",
+)
+options.add_argument(
+    "--max-retries",
+    dest="maxRetries",
+    type=int,
+    default=3,
+    metavar="N",
+    help="number of times to retry failed object storage requests (default: 3)",
+)
+options.add_argument(
+    "--columnar-format",
+    dest="columnarFormat",
+    choices=ColumnarRecordStore.FORMATS,
+    default="parquet",
+    help="format of --columnar files (default: parquet)",
+)
+options.add_argument(
+    "--field",
+    dest="fields",
+    action="append",
+    type=parse_field,
+    metavar="NAME=XPATH",
+    help=(
+        "extract the values of XPATH from the metadata of each record into "
+        "column NAME; may be repeated (default: Dublin Core title, creator, "
+        "subject, date, type and identifier, as dc_title etc.)"
+    ),
+)
+options.add_argument(
+    "--columnar-batch",
+    dest="columnarBatch",
+    type=int,
+    default=100000,
+    metavar="N",
+    help="number of records in each --columnar file (default: 100000)",
+)
+options.add_argument(
+    "--index",
+    dest="index",
+    metavar="PATH",
+    help=(
+        "keep a full-text index of the records written and deleted in a "
+        "SQLite database at PATH, updated after each page, to query with "
+        "oai-harvest search"
+    ),
+)
+options.add_argument(
+    "-o",
+    "--output",
+    dest="output",
+    default="-",
+    metavar="PATH",
+    help="stream to write to, e.g. a named pipe. default: - (stdout)",
+)
 # What to do about deletions
-group = argparser.add_mutually_exclusive_group()
+group = options.add_mutually_exclusive_group()
 group.set_defaults(deletions=True)
 group.add_argument(
     "--delete",
@@ -318,7 +1337,33 @@ group.add_argument(
         "deletions, i.e. DO NOT delete the files locally"
     ),
 )
-argparser.add_argument(
+options.add_argument(
+    "--delete-batch",
+    dest="deleteBatch",
+    type=int,
+    default=1000,
+    metavar="N",
+    help="remove the files of deleted records N at a time (default: 1000)",
+)
+options.add_argument(
+    "--delete-workers",
+    dest="deleteWorkers",
+    type=int,
+    default=4,
+    metavar="N",
+    help="number of threads removing the files of deleted records (default: 4)",
+)
+options.add_argument(
+    "--cache-dir-entries",
+    action="store_true",
+    dest="cacheDirEntries",
+    default=False,
+    help=(
+        "list each output directory once, so that files of deleted records "
+        "that were never harvested are skipped"
+    ),
+)
+options.add_argument(
     "-l",
     "--limit",
     dest="limit",
@@ -326,7 +1371,7 @@ argparser.add_argument(
     help="limit the number of records to harvest from each provider",
 )
 # What to do about sub-directories
-group = argparser.add_mutually_exclusive_group()
+group = options.add_mutually_exclusive_group()
 group.set_defaults(subdirs=None)
 group.add_argument(
     "--create-subdirs",
@@ -347,7 +1392,300 @@ group.add_argument(
         "in identifiers"
     ),
 )
+group.add_argument(
+    "--shard-depth",
+    dest="shardDepth",
+    type=int,
+    default=0,
+    metavar="N",
+    help=(
+        "spread files over N levels of subdirs named from a hash of the "
+        "identifier"
+    ),
+)
+options.add_argument(
+    "--shard-width",
+    dest="shardWidth",
+    type=int,
+    default=2,
+    metavar="N",
+    help="number of hex digits in the name of each shard subdir (default: 2)",
+)
+options.add_argument(
+    "--cache-ttl",
+    dest="cacheTTL",
+    type=float,
+    default=24,
+    metavar="HOURS",
+    help="re-use cached Identify responses for this many hours (default: 24)",
+)
+options.add_argument(
+    "--refresh-cache",
+    action="store_true",
+    dest="refreshCache",
+    default=False,
+    help="ignore cached Identify responses; revalidate with the provider",
+)
+options.add_argument(
+    "-w",
+    "--workers",
+    dest="workers",
+    type=int,
+    default=1,
+    help="number of providers to harvest concurrently (default: 1)",
+)
+options.add_argument(
+    "--per-host",
+    dest="perHost",
+    type=int,
+    default=1,
+    metavar="N",
+    help=(
+        "maximum number of providers on the same host to harvest "
+        "concurrently (default: 1)"
+    ),
+)
+options.add_argument(
+    "--prefetch-pages",
+    dest="prefetchPages",
+    type=int,
+    default=0,
+    metavar="N",
+    help="fetch up to N pages of records ahead of storing them (default: 0)",
+)
+options.add_argument(
+    "--max-buffered-records",
+    dest="maxBufferedRecords",
+    type=int,
+    metavar="N",
+    help="maximum number of records fetched ahead from each provider",
+)
+options.add_argument(
+    "--max-buffered-mb",
+    dest="maxBufferedMB",
+    type=float,
+    metavar="MB",
+    help="maximum size of responses fetched ahead from each provider",
+)
+options.add_argument(
+    "--memory-budget",
+    dest="memoryBudget",
+    type=float,
+    metavar="MB",
+    help="maximum size of responses fetched ahead from all providers together",
+)
+options.add_argument(
+    "--parse-processes",
+    dest="parseProcesses",
+    type=int,
+    default=0,
+    metavar="N",
+    help=(
+        "parse pages of records in a pool of N processes "
+        "(default: 0, parse while harvesting)"
+    ),
+)
+options.add_argument(
+    "--validate",
+    dest="validate",
+    action="store_true",
+    default=False,
+    help=(
+        "validate the metadata of each record against the XML Schema of its "
+        "metadataPrefix, as listed by the provider, and count invalid records "
+        "in the run summary"
+    ),
+)
+options.add_argument(
+    "--schema",
+    dest="schemas",
+    action="append",
+    type=parse_schema,
+    metavar="PREFIX=LOCATION",
+    help=(
+        "validate records in PREFIX against the XML Schema at LOCATION, a "
+        "path or URL, rather than the one listed by the provider; may be "
+        "repeated"
+    ),
+)
+options.add_argument(
+    "--validate-workers",
+    dest="validateWorkers",
+    type=int,
+    default=4,
+    metavar="N",
+    help="number of threads in which to --validate records (default: 4)",
+)
+options.add_argument(
+    "--quarantine",
+    dest="quarantine",
+    metavar="DIR",
+    help=(
+        "write records that are not valid to a subdirectory of DIR for each "
+        "provider, with their errors, rather than storing them"
+    ),
+)
+options.add_argument(
+    "--window",
+    dest="window",
+    type=parse_days,
+    metavar="DAYS",
+    help=(
+        "harvest records in windows of DAYS days, recording progress in the "
+        "registry as each is completed"
+    ),
+)
 
+options.add_argument(
+    "--failure-threshold",
+    dest="failureThreshold",
+    type=int,
+    default=3,
+    metavar="N",
+    help=(
+        "skip providers that have failed N times in a row, until their next "
+        "probe (default: 3)"
+    ),
+)
+options.add_argument(
+    "--reprobe",
+    type=float,
+    default=1,
+    metavar="HOURS",
+    help=(
+        "hours after which to try a skipped provider again, doubled after "
+        "each further failure (default: 1)"
+    ),
+)
+options.add_argument(
+    "--ignore-health",
+    dest="ignoreHealth",
+    action="store_true",
+    help=(
+        "harvest from providers however often they have failed, and wait "
+        "for them as long as the --stall-timeout"
+    ),
+)
+options.add_argument(
+    "--strategy",
+    dest="strategy",
+    choices=("auto",) + STRATEGIES,
+    default="auto",
+    help=(
+        "how to divide each harvest into lists of records requested "
+        "concurrently: as tuned from the sizes and response times of recent "
+        "pages from the provider (default), a single list, slices of "
+        "datestamps, or top-level sets"
+    ),
+)
+options.add_argument(
+    "--max-partitions",
+    dest="maxPartitions",
+    type=int,
+    default=4,
+    metavar="N",
+    help="maximum number of lists to request from a provider at once (default: 4)",
+)
+options.add_argument(
+    "--parallel-after",
+    dest="parallelAfter",
+    type=float,
+    default=PARALLEL_AFTER,
+    metavar="SECONDS",
+    help=(
+        "divide harvests expected to take longer than SECONDS in a single "
+        "list, if tuned to do so (default: {0})".format(PARALLEL_AFTER)
+    ),
+)
+options.add_argument(
+    "--checkpoint-pages",
+    dest="checkpointPages",
+    type=int,
+    default=0,
+    metavar="N",
+    help=(
+        "record the resumptionToken every N pages, so that a harvest that "
+        "is interrupted, e.g. by a crash, continues from it next time "
+        "(default: 0, only when paused outside of its harvest window)"
+    ),
+)
+options.add_argument(
+    "--archive",
+    dest="archiveDir",
+    metavar="DIR",
+    help="keep compressed copies of all responses in DIR, e.g. to --replay",
+)
+options.add_argument(
+    "--archive-max-mb",
+    dest="archiveMaxMB",
+    type=float,
+    metavar="MB",
+    help=(
+        "maximum size of the archive; least recently used lists of records "
+        "are removed to make room"
+    ),
+)
+options.add_argument(
+    "--replay",
+    action="store_true",
+    dest="replay",
+    default=False,
+    help=(
+        "harvest again from the responses in the --archive rather than from "
+        "the providers, e.g. into a different layout. The registry is not "
+        "updated"
+    ),
+)
+options.add_argument(
+    "--journal",
+    dest="journalDir",
+    metavar="DIR",
+    help=(
+        "record every file written or removed in the directories of records, "
+        "with its previous content, in a journal of this run in DIR, so that "
+        "the run can be rolled back or replayed with oai-harvest journal"
+    ),
+)
+options.add_argument(
+    "--progress",
+    dest="progress",
+    type=float,
+    default=60,
+    metavar="SECONDS",
+    help=(
+        "log the progress of each harvest every SECONDS seconds, with an "
+        "estimate of when it will be complete if the provider reports the "
+        "size of the list of records (default: 60, 0 to disable)"
+    ),
+)
+options.add_argument(
+    "--stall-timeout",
+    dest="stallTimeout",
+    type=float,
+    default=300,
+    metavar="SECONDS",
+    help=(
+        "retry requests to which a provider has not responded within SECONDS "
+        "seconds, and warn about harvests that have stalled (default: 300, 0 "
+        "to wait indefinitely)"
+    ),
+)
+add_logging_arguments(options)
+
+argparser = ArgumentParser(
+    description=docbits[0], epilog="\n\n".join(docbits[-2:]), parents=[options]
+)
+argparser.add_argument(
+    "provider",
+    nargs="+",
+    help=(
+        "OAI-PMH Provider from which to harvest. This may"
+        " be the base URL of an OAI-PMH server, or the "
+        "short name of a registered provider. You may "
+        'also specify "all" for all registered '
+        "providers."
+    ),
+)
 
 # Set up metadata registry
 xmlReader = XMLMetadataReader()
@@ -358,20 +1696,6 @@ appdir = os.path.expanduser("~/.oai-harvest")
 if not os.path.exists(appdir):
     os.mkdir(appdir)
 
-# Set up logger
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s %(name)-16s %(levelname)-8s %(message)s",
-    datefmt="[%Y-%m-%d %H:%M:%S]",
-    filename=os.path.join(appdir, "harvest.log"),
-)
-
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(levelname)-8s %(message)s")
-ch.setFormatter(formatter)
-logging.getLogger(__name__).addHandler(ch)
-
 
 if __name__ == "__main__":
     sys.exit(main())
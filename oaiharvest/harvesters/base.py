@@ -2,15 +2,21 @@
 """Document base here."""
 import ast
 import logging
+import warnings
 from abc import ABCMeta
 from datetime import datetime, timedelta
 from time import sleep
 
 import six
-from oaipmh.client import Client
+from oaipmh.datestamp import datestamp_to_datetime
 
-from oaiharvest.exceptions import NotOAIPMHBaseURLException
+from oaiharvest.client import Client
+from oaiharvest.exceptions import (
+    HarvestPausedException,
+    NotOAIPMHBaseURLException,
+)
 from oaiharvest.record import Record
+from oaiharvest.tuning import PageStats
 
 
 @six.add_metaclass(ABCMeta)
@@ -29,36 +35,103 @@ class OAIHarvester(object):
 
 
 class OAIRecordGetter(object):
-    def __init__(self, mdRegistry):
+    def __init__(
+        self,
+        mdRegistry,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        archive=None,
+        stallTimeout=None,
+    ):
         self._mdRegistry = mdRegistry
+        self._responseCache = responseCache
+        self._bufferLimits = bufferLimits
+        self._pageParser = pageParser
+        self._archive = archive
+        self._stallTimeout = stallTimeout
+        self._clients = {}
+        #: Sizes and response times of the pages of records received
+        self.pageStats = PageStats()
 
-    def pause(self, now, until):
-        """ Unconditionally pause the process from `now` to `until`. """
-        logger = logging.getLogger(__name__).getChild("OAIHarvester.pause")
-        logger.info("Pausing until {} (incremental harvest).".format(until))
-        sleep((until - now) / timedelta(seconds=1))
+    def next_window_start(self, time_range, now=None):
+        """Return when the next incremental time range starts.
 
-    def maybe_pause_if_incremental(self, time_range):
-        """ Pause the process depending on incremental time range settings. """
+        Return None if ``now`` is within the time range, i.e. there is no need
+        to pause.
+        """
         if time_range is None:
-            return
-        now = datetime.now()
+            return None
+        if now is None:
+            now = datetime.now()
         start = datetime.combine(now.date(), time_range[0].time())
         stop = datetime.combine(now.date(), time_range[1].time())
         if now < start:
             if now < stop < start:
-                return
-            return self.pause(now, start)
+                return None
+            return start
         if start < stop <= now:
-            return self.pause(now, start + timedelta(days=1))
+            return start + timedelta(days=1)
         # If we reach this point, there is no need to pause.
+        return None
 
-    def get_records(self, baseUrl, metadataPrefix="oai_dc", **kwargs):
-        # Generator to yield records from baseUrl in the given metadataPrefix
-        # Add metatdataPrefix to args
-        kwargs["metadataPrefix"] = metadataPrefix
-        client = Client(baseUrl, self._mdRegistry)
-        incremental_range = kwargs.pop("between", None)
+    def check_incremental_window(self, time_range, resumptionToken=None):
+        """Pause the harvest depending on incremental time range settings.
+
+        Raise ``HarvestPausedException``, with the ``resumptionToken`` from
+        which to resume, if outside of the time range.
+        """
+        resumeAt = self.next_window_start(time_range)
+        if resumeAt is not None:
+            logger = logging.getLogger(__name__).getChild("OAIHarvester.pause")
+            logger.info("Pausing until {} (incremental harvest).".format(resumeAt))
+            raise HarvestPausedException(resumeAt, resumptionToken)
+
+    def pause(self, now, until):
+        """Unconditionally pause the process from `now` to `until`.
+
+        Deprecated; harvests are paused with ``check_incremental_window``.
+        """
+        warnings.warn(
+            "pause is deprecated; use check_incremental_window",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        logger = logging.getLogger(__name__).getChild("OAIHarvester.pause")
+        logger.info("Pausing until {} (incremental harvest).".format(until))
+        sleep((until - now) / timedelta(seconds=1))
+
+    def maybe_pause_if_incremental(self, time_range):
+        """Pause the process depending on incremental time range settings.
+
+        Deprecated; harvests are paused with ``check_incremental_window``.
+        """
+        warnings.warn(
+            "maybe_pause_if_incremental is deprecated; use " "check_incremental_window",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        now = datetime.now()
+        resumeAt = self.next_window_start(time_range, now)
+        if resumeAt is not None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                self.pause(now, resumeAt)
+
+    def get_client(self, baseUrl):
+        """Return a client for baseUrl, re-used for subsequent requests."""
+        client = self._clients.get(baseUrl)
+        if client is not None:
+            return client
+        client = Client(
+            baseUrl,
+            self._mdRegistry,
+            responseCache=self._responseCache,
+            bufferLimits=self._bufferLimits,
+            pageParser=self._pageParser,
+            archive=self._archive,
+            stallTimeout=self._stallTimeout,
+        )
         # Check that baseUrl actually represents an OAI-PMH target
         try:
             client.identify()
@@ -69,7 +142,84 @@ class OAIRecordGetter(object):
             )
         # Check server timestamp granularity support
         client.updateGranularity()
-        self.maybe_pause_if_incremental(incremental_range)
+        self._clients[baseUrl] = client
+        return client
+
+    def get_response_date(self, baseUrl):
+        """Return the server's responseDate when it started the last list.
+
+        Return None if the server did not report it.
+        """
+        responseDate = getattr(self.get_client(baseUrl), "responseDate", None)
+        if isinstance(responseDate, datetime):
+            return responseDate
+        return None
+
+    def request_stats(self):
+        """Return number of requests answered, and seconds taken to answer."""
+        clients = list(self._clients.values())
+        return (
+            sum(client.requests for client in clients),
+            sum(client.requestSeconds for client in clients),
+        )
+
+    def archived_lists(self, baseUrl, metadataPrefix="oai_dc"):
+        """Return keyword args for each list of records archived for baseUrl.
+
+        Lists are returned in the order in which they were harvested, and
+        may be harvested again by passing the keyword args to
+        ``get_records`` while replaying from the archive.
+        """
+        if self._archive is None:
+            return []
+        lists = []
+        for params in self._archive.lists(baseUrl, metadataPrefix):
+            kwargs = {}
+            if "from" in params:
+                kwargs["from_"] = datestamp_to_datetime(params["from"])
+            if "until" in params:
+                kwargs["until"] = datestamp_to_datetime(params["until"])
+            if "set" in params:
+                kwargs["set"] = params["set"]
+            if "resumptionToken" in params:
+                # List continued from a resumptionToken, e.g. with -r TOKEN
+                kwargs["resumptionToken"] = params["resumptionToken"]
+            lists.append(kwargs)
+        return lists
+
+    def get_records(self, baseUrl, metadataPrefix="oai_dc", **kwargs):
+        # Generator to yield records from baseUrl in the given metadataPrefix
+        # Add metatdataPrefix to args
+        kwargs["metadataPrefix"] = metadataPrefix
+        incremental_range = kwargs.pop("between", None)
+        # Called with each oaiharvest.client.Page, e.g. to report progress
+        # from the completeListSize and cursor of its resumptionToken
+        onPage = kwargs.pop("onPage", None)
+        # Called with the resumptionToken before each page after the first,
+        # once all records before it have been returned
+        beforePage = kwargs.pop("beforePage", None)
+        self.check_incremental_window(incremental_range, kwargs.get("resumptionToken"))
+        client = self.get_client(baseUrl)
+
+        def before_page(token):
+            if beforePage is not None:
+                beforePage(token)
+            # Check again before requesting each subsequent page
+            self.check_incremental_window(incremental_range, token)
+
+        if incremental_range is not None or beforePage is not None:
+            client.beforePage = before_page
+        else:
+            client.beforePage = None
+        # Lists of records in any set tell how many records there are
+        complete = kwargs.get("set") is None
+
+        def on_page(page):
+            self.pageStats.add(page, complete)
+            if onPage is not None:
+                onPage(page)
+
+        client.onPage = on_page
         for record in client.listRecords(**kwargs):
             # Unit test hotfix
             header, metadata, about = record
@@ -77,4 +227,3 @@ class OAIRecordGetter(object):
             if isinstance(metadata, str) and metadata.startswith("b'"):
                 metadata = ast.literal_eval(metadata).decode("utf-8")
             yield Record(header, metadata, about)
-            self.maybe_pause_if_incremental(incremental_range)
\ No newline at end of file
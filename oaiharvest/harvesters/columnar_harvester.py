@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Document columnar_harvester here."""
+from oaiharvest.harvesters.store_harvester import RecordStoreOAIHarvester
+from oaiharvest.stores.columnar_store import DC_FIELDS, ColumnarRecordStore
+
+
+class ColumnarOAIHarvester(RecordStoreOAIHarvester):
+    """OAI-PMH Harvester to output headers and fields of records in columns.
+
+    Directory, fields to extract and file format (see
+    ``oaiharvest.stores.columnar_store``) are specified at object
+    init/construction time.
+    """
+
+    def __init__(
+        self,
+        mdRegistry,
+        directory,
+        fields=DC_FIELDS,
+        format="parquet",
+        source=None,
+        batchSize=100000,
+        respectDeletions=True,
+        nRecs=0,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        window=None,
+        progress=None,
+        archive=None,
+        stallTimeout=None,
+        validator=None,
+    ):
+        RecordStoreOAIHarvester.__init__(
+            self,
+            mdRegistry,
+            ColumnarRecordStore(
+                directory, fields, format, source=source, batchSize=batchSize
+            ),
+            respectDeletions=respectDeletions,
+            nRecs=nRecs,
+            responseCache=responseCache,
+            bufferLimits=bufferLimits,
+            pageParser=pageParser,
+            window=window,
+            progress=progress,
+            archive=archive,
+            stallTimeout=stallTimeout,
+            validator=validator,
+        )
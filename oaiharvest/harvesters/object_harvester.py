@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Document object_harvester here."""
+from oaiharvest.harvesters.store_harvester import RecordStoreOAIHarvester
+from oaiharvest.stores.object_store import ObjectRecordStore
+
+
+class ObjectStoreOAIHarvester(RecordStoreOAIHarvester):
+    """OAI-PMH Harvester to output harvested records to object storage.
+
+    Object storage client (see ``oaiharvest.stores.object_store``) and the
+    prefix for the keys of objects are specified at object
+    init/construction time.
+    """
+
+    def __init__(
+        self,
+        mdRegistry,
+        client,
+        prefix="",
+        respectDeletions=True,
+        nRecs=0,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        window=None,
+        progress=None,
+        archive=None,
+        maxInFlight=16,
+        maxRetries=3,
+        stallTimeout=None,
+        validator=None,
+    ):
+        RecordStoreOAIHarvester.__init__(
+            self,
+            mdRegistry,
+            ObjectRecordStore(
+                client, prefix, maxInFlight=maxInFlight, maxRetries=maxRetries
+            ),
+            respectDeletions=respectDeletions,
+            nRecs=nRecs,
+            responseCache=responseCache,
+            bufferLimits=bufferLimits,
+            pageParser=pageParser,
+            window=window,
+            progress=progress,
+            archive=archive,
+            stallTimeout=stallTimeout,
+            validator=validator,
+        )
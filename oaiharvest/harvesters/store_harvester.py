@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""Document store_harvester here."""
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from oaipmh.error import NoRecordsMatchError
+
+from oaiharvest.exceptions import HarvestPausedException
+from oaiharvest.harvesters.base import OAIHarvester, OAIRecordGetter
+from oaiharvest.log import DELETE_EVENT
+
+
+class RecordStoreOAIHarvester(OAIHarvester):
+    """OAI-PMH Harvester to output harvested records to a record store.
+
+    Store (an instance of ``oaiharvest.stores.base.RecordStore``) is
+    specified at object init/construction time.
+
+    If ``window`` (a ``datetime.timedelta``) is given, selective harvests are
+    split into consecutive windows of that length, each of which is
+    committed once all of its records have been stored.
+
+    If ``progress`` (an ``oaiharvest.log.ProgressCounter``) is given, it is
+    updated with each page and record harvested.
+
+    If ``archive`` (an ``oaiharvest.archive.ResponseArchive``) is given, all
+    responses are kept in it, or, in replay mode, taken from it.
+
+    If ``stallTimeout`` is given, requests to which the server has not
+    responded within that many seconds are retried.
+
+    If ``validator`` (an ``oaiharvest.validation.ProviderValidator``) is
+    given, the metadata of each record is validated against its schema
+    before the record is stored, and invalid records may be quarantined
+    instead. Records are stored in the order in which they were harvested.
+    """
+
+    def __init__(
+        self,
+        mdRegistry,
+        store,
+        respectDeletions=True,
+        nRecs=0,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        window=None,
+        progress=None,
+        archive=None,
+        stallTimeout=None,
+        validator=None,
+    ):
+        self.record_getter = OAIRecordGetter(
+            mdRegistry, responseCache, bufferLimits, pageParser, archive, stallTimeout
+        )
+        self.store = store
+        self.respectDeletions = respectDeletions
+        self.nRecs = nRecs
+        self.window = window
+        self.progress = progress
+        self.validator = validator
+        # Records waiting to be validated before they are stored, with their
+        # metadataPrefix and the future results of their validation
+        self._pending = deque()
+        #: Time up to which all records have been harvested
+        self.watermark = None
+
+    def harvest(
+        self,
+        baseUrl,
+        metadataPrefix,
+        onCommit=None,
+        onCheckpoint=None,
+        checkpointPages=10,
+        **kwargs
+    ):
+        """Harvest records, return if completed.
+
+        :rtype: bool
+        :returns: Were all available records fetched and stored?
+
+        Harvest records, output records to the store and return a boolean
+        for whether or not all of the records that the server could return
+        were actually stored locally.
+
+        ``onCommit`` is called with the new ``watermark`` each time all
+        records up to it have been stored, i.e. after each window. The
+        watermark is the ``until`` argument of the window, or, for a window
+        that is open-ended, the server's ``responseDate`` for its first
+        request.
+
+        ``onCheckpoint`` is called with a resumptionToken and the watermark
+        of its window every ``checkpointPages`` pages, once all records
+        before that token have been stored, so that the harvest can be
+        resumed from it, e.g. after a crash.
+        """
+        progress = self.progress
+        if progress is not None:
+            # Pages are expected from now on, so as to detect stalls
+            progress.active = True
+            progress.lastPage = time.time()
+        try:
+            completed = self._harvest(
+                baseUrl,
+                metadataPrefix,
+                onCommit,
+                onCheckpoint,
+                checkpointPages,
+                **kwargs
+            )
+        except BaseException:
+            # Records of a failed harvest are not stored
+            self._pending.clear()
+            try:
+                self.store.flush()
+            except Exception as e:
+                # Must not hide why the harvest failed, e.g. that it paused
+                logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+                logger.error("Could not flush store: {0}".format(e), exc_info=True)
+            raise
+        finally:
+            if progress is not None:
+                progress.active = False
+        self.store.flush()
+        return completed
+
+    def replay(self, baseUrl, metadataPrefix):
+        """Harvest again every list of records archived for ``baseUrl``.
+
+        Requires an ``archive`` in replay mode. Return whether all of the
+        records in each list were stored.
+        """
+        lists = self.record_getter.archived_lists(baseUrl, metadataPrefix)
+        if not lists:
+            logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+            logger.warning("No archived lists of records from %s", baseUrl)
+        completed = True
+        for kwargs in lists:
+            completed = self.harvest(baseUrl, metadataPrefix, **kwargs)
+            if not completed:
+                break
+        return completed
+
+    def _harvest(
+        self,
+        baseUrl,
+        metadataPrefix,
+        onCommit,
+        onCheckpoint=None,
+        checkpointPages=10,
+        **kwargs
+    ):
+        logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        # A counter for the number of records actually returned
+        # enumerate() not used as it would include deleted records
+        i = 0
+        progress = self.progress
+
+        def on_page(page):
+            # Store records of the previous page still being validated, so
+            # that all of them have been written or deleted
+            self._drain()
+            self.store.end_page()
+            if progress is not None:
+                progress.page(page)
+
+        kwargs["onPage"] = on_page
+        schema = None
+        if self.validator is not None:
+            schema = self.validator.schema_location(
+                metadataPrefix, self.record_getter.get_client(baseUrl)
+            )
+        for window, watermark in self._windows(baseUrl, kwargs):
+            # Fallback if server doesn't report responseDate
+            started = datetime.utcnow()
+            deletions = 0
+            if onCheckpoint is not None:
+                window = dict(
+                    window,
+                    beforePage=self._checkpointer(
+                        baseUrl,
+                        window,
+                        watermark,
+                        started,
+                        onCheckpoint,
+                        checkpointPages,
+                    ),
+                )
+            try:
+                for record in self.record_getter.get_records(
+                    baseUrl, metadataPrefix=metadataPrefix, **window
+                ):
+
+                    if self.nRecs and self.nRecs > 0 and self.nRecs <= i:
+                        logger.info(
+                            "Stopping harvest; set limit of {0} has been "
+                            "reached".format(self.nRecs)
+                        )
+                        # Loop stopped due to arbitrary limit
+                        self._drain()
+                        return False
+
+                    if not record.header.isDeleted():
+                        i += 1
+                        if progress is not None:
+                            progress.records += 1
+                    else:
+                        deletions += 1
+                        if progress is not None:
+                            progress.deleted += 1
+                    if self.validator is None:
+                        self._store(record, metadataPrefix)
+                    else:
+                        self._validate(record, metadataPrefix, schema)
+            except HarvestPausedException as e:
+                # Records before the token to resume from must be stored
+                self._drain()
+                # Record how far completing the list will have harvested
+                if watermark is None and "resumptionToken" not in window:
+                    watermark = self.record_getter.get_response_date(baseUrl) or started
+                e.watermark = watermark
+                raise
+            except NoRecordsMatchError:
+                # Nothing to harvest
+                logger.info("0 records to harvest")
+                logger.debug(
+                    "The combination of the values of the from={0}, "
+                    "until={1}, set={2} and metadataPrefix={3} "
+                    "arguments results in an empty list."
+                    "".format(
+                        window.get("from_"),
+                        window.get("until"),
+                        window.get("set"),
+                        metadataPrefix,
+                    )
+                )
+            # Window completed, all available records stored
+            self._drain()
+            self.store.flush()
+            if deletions:
+                logger.info(
+                    "%s server requests to delete %d records",
+                    "Respected" if self.respectDeletions else "Ignored",
+                    deletions,
+                )
+            if watermark is None and "resumptionToken" not in window:
+                watermark = self.record_getter.get_response_date(baseUrl)
+            self.watermark = watermark or started
+            if onCommit is not None:
+                onCommit(self.watermark)
+        # Harvesting completed, all available records stored
+        return True
+
+    def _store(self, record, metadataPrefix):
+        """Write ``record`` to the store, or delete it."""
+        if not record.header.isDeleted():
+            self.store.write(record, metadataPrefix)
+            return
+        logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        if self.respectDeletions:
+            logger.debug(
+                "Respecting server request to delete record %s.%s",
+                record.header.identifier(),
+                metadataPrefix,
+                extra=DELETE_EVENT,
+            )
+            self.store.delete(record, metadataPrefix)
+        else:
+            logger.debug(
+                "Ignoring server request to delete file %s.%s",
+                record.header.identifier(),
+                metadataPrefix,
+                extra=DELETE_EVENT,
+            )
+
+    def _validate(self, record, metadataPrefix, schema):
+        """Validate ``record``, storing it and those before it once validated.
+
+        Waits for the oldest record to be validated if too many are pending.
+        """
+        future = None
+        if not record.header.isDeleted():
+            future = self.validator.submit(schema, record)
+        self._pending.append((record, metadataPrefix, future))
+        while self._pending:
+            future = self._pending[0][2]
+            if (
+                future is not None
+                and not future.done()
+                and len(self._pending) <= self.validator.maxPending
+            ):
+                break
+            self._store_validated(*self._pending.popleft())
+
+    def _drain(self):
+        """Store all records waiting to be validated."""
+        while self._pending:
+            self._store_validated(*self._pending.popleft())
+
+    def _store_validated(self, record, metadataPrefix, future):
+        if not record.header.isDeleted():
+            errors = None if future is None else future.result()
+            if self.validator.record(record, metadataPrefix, errors):
+                # Quarantined rather than stored
+                return
+        self._store(record, metadataPrefix)
+
+    def _checkpointer(self, baseUrl, window, watermark, started, onCheckpoint, every):
+        """Return a ``beforePage`` callback to call ``onCheckpoint``."""
+        pages = [0]
+
+        def checkpoint(token):
+            pages[0] += 1
+            if pages[0] % max(1, every):
+                return
+            # Records before the token must be stored before resuming from it
+            self._drain()
+            self.store.flush()
+            mark = watermark
+            if mark is None and "resumptionToken" not in window:
+                mark = self.record_getter.get_response_date(baseUrl) or started
+            onCheckpoint(token, mark)
+
+        return checkpoint
+
+    def _windows(self, baseUrl, kwargs):
+        """Generate keyword args for each window of a harvest with ``kwargs``.
+
+        Generates tuples of keyword args for ``get_records`` and the time up
+        to which records will have been harvested once that window is
+        complete, or None if this is only known from the server's response.
+
+        Generates ``kwargs`` itself when the harvest is not to be split into
+        windows. When continuing a list from a ``resumptionToken``, ``until``
+        is the time up to which records will have been harvested when the
+        list is complete.
+        """
+        if kwargs.get("resumptionToken") is not None:
+            window = dict(
+                (key, value)
+                for key, value in kwargs.items()
+                if key not in ("from_", "until", "set")
+            )
+            yield window, kwargs.get("until")
+            return
+        if self.window is None:
+            yield kwargs, kwargs.get("until")
+            return
+        start = kwargs.get("from_")
+        if start is None:
+            identify = self.record_getter.get_client(baseUrl).identify()
+            start = identify.earliestDatestamp()
+        until = kwargs.get("until")
+        end = until or datetime.utcnow()
+        while True:
+            window = dict(kwargs, from_=start)
+            stop = start + self.window
+            if stop >= end:
+                # Final window
+                yield window, until
+                return
+            window["until"] = stop
+            yield window, stop
+            start = stop
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Document stream_harvester here."""
+from oaiharvest.harvesters.store_harvester import RecordStoreOAIHarvester
+from oaiharvest.stores.stream_store import StreamRecordStore
+
+
+class StreamOAIHarvester(RecordStoreOAIHarvester):
+    """OAI-PMH Harvester to output harvested records to a stream.
+
+    Stream (e.g. stdout or a named pipe) and format are specified at object
+    init/construction time.
+    """
+
+    def __init__(
+        self,
+        mdRegistry,
+        stream,
+        format="json",
+        source=None,
+        respectDeletions=True,
+        nRecs=0,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        window=None,
+        progress=None,
+        archive=None,
+        stallTimeout=None,
+        validator=None,
+    ):
+        RecordStoreOAIHarvester.__init__(
+            self,
+            mdRegistry,
+            StreamRecordStore(stream, format, source=source),
+            respectDeletions=respectDeletions,
+            nRecs=nRecs,
+            responseCache=responseCache,
+            bufferLimits=bufferLimits,
+            pageParser=pageParser,
+            window=window,
+            progress=progress,
+            archive=archive,
+            stallTimeout=stallTimeout,
+            validator=validator,
+        )
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Health of providers, kept in the registry to avoid waiting on dead ones.
+
+After each harvest, the number of consecutive failed harvests, the last
+error and the average time taken to respond to a request are recorded for
+the provider. Providers that have failed are harvested after healthy ones;
+once a provider has failed ``threshold`` times in a row its circuit breaker
+opens, and it is skipped until a re-probe time that doubles with each
+further failure. The next harvest after that time is the probe: success
+closes the circuit, failure opens it again.
+
+The timeout for requests to a provider that has responded before is
+derived from its average latency, so that an endpoint that stops responding
+does not hold up harvesting for the full default timeout.
+"""
+import logging
+from datetime import datetime, timedelta
+
+#: Weight of the latest harvest in the moving average of latency
+LATENCY_WEIGHT = 0.3
+
+#: Multiple of the average latency after which to time out a request
+TIMEOUT_FACTOR = 10
+
+#: Shortest timeout, in seconds, however quickly a provider usually responds
+MIN_TIMEOUT = 10
+
+
+class ProviderHealth(object):
+    """Health of a single provider, as recorded in the registry.
+
+    ``failures`` => number of consecutive failed harvests
+    ``lastError`` => message of the error of the last failed harvest
+    ``latency`` => moving average of seconds taken to respond to a request,
+    or None if unknown
+    ``requests`` => number of requests from which the latency was averaged
+    ``retryAt`` => time before which not to harvest, while the circuit
+    breaker is open, or None
+    """
+
+    def __init__(
+        self,
+        provider,
+        failures=0,
+        lastError=None,
+        lastFailure=None,
+        lastSuccess=None,
+        latency=None,
+        requests=0,
+        retryAt=None,
+    ):
+        self.provider = provider
+        self.failures = failures
+        self.lastError = lastError
+        self.lastFailure = lastFailure
+        self.lastSuccess = lastSuccess
+        self.latency = latency
+        self.requests = requests
+        self.retryAt = retryAt
+
+    def is_open(self, now=None):
+        """Return whether harvests should be skipped at ``now``."""
+        if self.retryAt is None:
+            return False
+        return (now or datetime.now()) < self.retryAt
+
+    def timeout(self, default=None):
+        """Return seconds after which to time out requests to the provider.
+
+        The timeout is ``TIMEOUT_FACTOR`` times the average latency, no
+        shorter than ``MIN_TIMEOUT`` and no longer than ``default``.
+        """
+        if not self.latency:
+            return default
+        timeout = max(MIN_TIMEOUT, self.latency * TIMEOUT_FACTOR)
+        if default:
+            timeout = min(default, timeout)
+        return timeout
+
+
+class HealthRegistry(object):
+    """Health of providers in the registry database.
+
+    ``cxn`` => instance of ``sqlite3.Connection`` as returned by
+    ``oaiharvest.registry.verify_database``
+    ``threshold`` => number of consecutive failures after which to open the
+    circuit breaker of a provider
+    ``reprobe`` => ``datetime.timedelta`` after which to probe a provider
+    when its circuit breaker first opens; doubled for each further failure
+    ``maxReprobe`` => longest ``datetime.timedelta`` between probes
+    """
+
+    def __init__(
+        self,
+        cxn,
+        threshold=3,
+        reprobe=timedelta(hours=1),
+        maxReprobe=timedelta(days=7),
+    ):
+        self.cxn = cxn
+        self.threshold = threshold
+        self.reprobe = reprobe
+        self.maxReprobe = maxReprobe
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def get(self, provider):
+        """Return the ``ProviderHealth`` of ``provider``."""
+        row = self.cxn.execute(
+            "SELECT provider, failures, lastError, lastFailure [timestamp], "
+            "lastSuccess [timestamp], latency, requests, retryAt [timestamp] "
+            "FROM health WHERE provider=?",
+            (provider,),
+        ).fetchone()
+        if row is None:
+            return ProviderHealth(provider)
+        return ProviderHealth(*row)
+
+    def record_success(self, provider, requests=0, seconds=0.0):
+        """Record a successful harvest, closing the circuit breaker.
+
+        ``requests`` => number of requests made during the harvest
+        ``seconds`` => total time taken to respond to them
+        """
+        health = self.get(provider)
+        if health.retryAt is not None or health.failures >= self.threshold:
+            self.logger.info("%s has recovered; closing circuit breaker", provider)
+        health.failures = 0
+        health.retryAt = None
+        health.lastSuccess = datetime.now()
+        self._update_latency(health, requests, seconds)
+        self._save(health)
+        return health
+
+    def record_failure(self, provider, error, requests=0, seconds=0.0):
+        """Record a failed harvest, opening the circuit breaker if need be.
+
+        ``error`` => the exception, or a message
+        """
+        health = self.get(provider)
+        health.failures += 1
+        health.lastError = str(error) or error.__class__.__name__
+        health.lastFailure = datetime.now()
+        if health.failures >= self.threshold:
+            interval = min(
+                self.maxReprobe,
+                self.reprobe * 2 ** (health.failures - self.threshold),
+            )
+            health.retryAt = health.lastFailure + interval
+            self.logger.warning(
+                "%s has failed %d times in a row; skipping until %s",
+                provider,
+                health.failures,
+                health.retryAt,
+            )
+        self._update_latency(health, requests, seconds)
+        self._save(health)
+        return health
+
+    def _update_latency(self, health, requests, seconds):
+        if not requests:
+            return
+        latency = seconds / requests
+        if health.latency is None:
+            health.latency = latency
+        else:
+            health.latency = (
+                LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * health.latency
+            )
+        health.requests += requests
+
+    def _save(self, health):
+        with self.cxn:
+            self.cxn.execute(
+                "INSERT OR REPLACE INTO health(provider, failures, lastError, "
+                "lastFailure, lastSuccess, latency, requests, retryAt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    health.provider,
+                    health.failures,
+                    health.lastError,
+                    health.lastFailure,
+                    health.lastSuccess,
+                    health.latency,
+                    health.requests,
+                    health.retryAt,
+                ),
+            )
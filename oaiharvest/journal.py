@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""Journals of the changes that harvests make to directories of records.
+
+usage: oai-harvest journal [-h] --journal DIR [--to DIR] [--force] [-v | -q]
+                           [--log-file PATH] [--log-json] [--log-sample N]
+                           {list,rollback,replay,compact} [run]
+
+Harvests given ``--journal DIR`` record every file that they write or
+remove in a directory of records in a journal of their own under DIR, with
+the content of the file before and after the change. A run can then be
+rolled back, restoring every file that it changed, or replayed, e.g. into
+another directory. Files that have changed since the run are not rolled
+back unless --force is given. When a run is finished, its journal is
+compacted to the net change to each file.
+
+The journal of a run is a directory of segments, each an append-only file
+of JSON entries, one per line, with a pack of the compressed contents that
+they refer to. Entries and contents are only ever appended, so that
+journalling costs little more than writing the records themselves.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from argparse import ArgumentParser
+from collections import OrderedDict
+from datetime import datetime
+
+from oaiharvest.log import add_logging_arguments, configure_logging
+
+#: Number of entries in each segment before starting another
+SEGMENT_ENTRIES = 100000
+
+COMMANDS = ("list", "rollback", "replay", "compact")
+
+
+def content_hash(content):
+    """Return the hex SHA-1 digest of ``content`` bytes."""
+    return hashlib.sha1(content).hexdigest()
+
+
+def read_file(fp):
+    """Return the content of file ``fp`` as bytes, or None if it is missing."""
+    try:
+        with open(fp, "rb") as fh:
+            return fh.read()
+    except (IOError, OSError):
+        return None
+
+
+class HarvestJournal(object):
+    """Append-only journal of the changes made by a run of harvests.
+
+    ``directory`` => directory of journals, in which to start a journal for
+    this run; created if necessary
+    ``segmentEntries`` => number of entries in each segment
+    ``level`` => zlib compression level of contents
+
+    ``write`` and ``delete`` must be called before the file is written or
+    removed, so that its previous content can be recorded; each entry is
+    written to the journal's files before they return, so that a run that
+    crashes can be rolled back. ``flush`` also syncs them to disk. Several
+    harvests may share a journal.
+    """
+
+    def __init__(self, directory, segmentEntries=SEGMENT_ENTRIES, level=1):
+        self.segmentEntries = segmentEntries
+        self.level = level
+        started = datetime.now()
+        name = started.strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(directory, name)
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(directory, "{0}-{1}".format(name, suffix))
+        os.makedirs(path)
+        self.run = JournalRun(path)
+        self.run.save_info(started=started.isoformat(), entries=0)
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._segment = 0
+        self._entries = 0
+        self._total = 0
+        self._index = self._pack = None
+
+    def write(self, directory, path, content):
+        """Record that ``content`` is about to be written to ``path``.
+
+        ``directory`` => directory of records
+        ``path`` => path of the file, relative to ``directory``
+        ``content`` => text that is to be written to the file
+        """
+        previous = read_file(os.path.join(directory, path))
+        self._append("write", directory, path, previous, content.encode("utf-8"))
+
+    def delete(self, directory, path):
+        """Record that the file at ``path`` is about to be removed."""
+        previous = read_file(os.path.join(directory, path))
+        self._append("delete", directory, path, previous, None)
+
+    def flush(self):
+        """Write all entries so far to disk."""
+        with self._lock:
+            for fh in (self._pack, self._index):
+                if fh is not None:
+                    fh.flush()
+                    os.fsync(fh.fileno())
+
+    def close(self, compact=True):
+        """Finish the journal of this run, compacting it if ``compact``."""
+        with self._lock:
+            self._close_segment()
+        self.run.save_info(finished=datetime.now().isoformat(), entries=self._total)
+        if compact and self._segment:
+            self.run.compact()
+
+    def _append(self, op, directory, path, previous, content):
+        # Compress outside the lock, so that harvests compress concurrently
+        blobs = [self._blob(previous)]
+        if content is not None and content == previous:
+            # Unchanged; refer to the same content
+            blobs.append(blobs[0])
+        else:
+            blobs.append(self._blob(content))
+        with self._lock:
+            if self._index is None or self._entries >= self.segmentEntries:
+                self._close_segment()
+                self._open_segment()
+            entry = OrderedDict(
+                [
+                    ("seq", self._total),
+                    ("op", op),
+                    ("directory", directory),
+                    ("path", path),
+                ]
+            )
+            refs = {}
+            for name, blob in zip(("previous", "content"), blobs):
+                if blob is None:
+                    entry[name] = None
+                elif id(blob) in refs:
+                    entry[name] = refs[id(blob)]
+                else:
+                    offset = self._pack.tell()
+                    self._pack.write(blob[1])
+                    entry[name] = refs[id(blob)] = [blob[0], offset, len(blob[1])]
+            self._index.write(json.dumps(entry) + "\n")
+            # Write ahead of the change: the entry must reach the OS before
+            # the file is changed, and the contents before the entry
+            self._pack.flush()
+            self._index.flush()
+            self._entries += 1
+            self._total += 1
+
+    def _blob(self, data):
+        if data is None:
+            return None
+        return content_hash(data), zlib.compress(data, self.level)
+
+    def _open_segment(self):
+        self._segment += 1
+        self._entries = 0
+        base = self.run.segment_path(self._segment)
+        self._pack = open(base + ".pack", "ab")
+        self._index = open(base + ".jsonl", "a")
+
+    def _close_segment(self):
+        for fh in (self._pack, self._index):
+            if fh is not None:
+                fh.flush()
+                os.fsync(fh.fileno())
+                fh.close()
+        self._index = self._pack = None
+
+
+class JournalRun(object):
+    """The journal of a single run, to list, roll back, replay or compact.
+
+    ``path`` => directory of the run's journal
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        # Packs opened for reading, by segment
+        self._packs = {}
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def info(self):
+        """Return dictionary of the run's start, finish, entries etc."""
+        try:
+            with open(os.path.join(self.path, "run.json")) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_info(self, **values):
+        info = self.info()
+        info.update(values)
+        fp = os.path.join(self.path, "run.json")
+        with open(fp + ".tmp", "w") as fh:
+            json.dump(info, fh, sort_keys=True)
+        os.replace(fp + ".tmp", fp)
+
+    def segment_path(self, number):
+        """Return path of segment ``number``, without extension."""
+        return os.path.join(self.path, "segment-{0:06d}".format(number))
+
+    def segments(self):
+        """Return paths of all segments, without extension, in order."""
+        return [
+            os.path.join(self.path, filename[: -len(".jsonl")])
+            for filename in sorted(os.listdir(self.path))
+            if filename.startswith("segment-") and filename.endswith(".jsonl")
+        ]
+
+    def entries(self):
+        """Generate (segment, entry) of all entries, in order.
+
+        An incomplete entry at the end of a segment, e.g. after a crash, is
+        ignored.
+        """
+        for segment in self.segments():
+            packSize = os.path.getsize(segment + ".pack")
+            with open(segment + ".jsonl") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        self.logger.warning("Ignoring incomplete entry in %s", segment)
+                        break
+                    refs = [ref for ref in (entry["previous"], entry["content"]) if ref]
+                    if any(ref[1] + ref[2] > packSize for ref in refs):
+                        self.logger.warning("Ignoring incomplete entry in %s", segment)
+                        break
+                    yield segment, entry
+
+    def changes(self, directory=None):
+        """Return the net change to each file, in order of first change.
+
+        ``directory`` => only the files in this directory of records
+
+        Return list of (directory, path, previous, content), where
+        ``previous`` and ``content`` are (segment, ref) of the content before
+        the first change and after the last, or None if there was no file.
+        """
+        changes = OrderedDict()
+        for segment, entry in self.entries():
+            if directory is not None and entry["directory"] != directory:
+                continue
+            key = (entry["directory"], entry["path"])
+            content = None
+            if entry["content"] is not None:
+                content = (segment, entry["content"])
+            if key in changes:
+                changes[key][1] = content
+            else:
+                previous = None
+                if entry["previous"] is not None:
+                    previous = (segment, entry["previous"])
+                changes[key] = [previous, content]
+        return [
+            key + tuple(change)
+            for key, change in changes.items()
+            if _digest(change[0]) != _digest(change[1])
+        ]
+
+    def read(self, blob, decompress=True):
+        """Return the content of ``blob``, a (segment, ref), as bytes."""
+        segment, (digest, offset, length) = blob
+        fh = self._packs.get(segment)
+        if fh is None:
+            fh = self._packs[segment] = open(segment + ".pack", "rb")
+        fh.seek(offset)
+        data = fh.read(length)
+        if decompress:
+            return zlib.decompress(data)
+        return data
+
+    def close(self):
+        """Close the packs opened to read contents."""
+        for fh in self._packs.values():
+            fh.close()
+        self._packs.clear()
+
+    def rollback(self, directory=None, force=False):
+        """Restore every file changed by the run to its previous content.
+
+        Files whose content is no longer as the run left it, i.e. which have
+        been changed since, are skipped, unless ``force``.
+
+        Return numbers of files restored and skipped.
+        """
+        restored = skipped = 0
+        for root, path, previous, content in self.changes(directory):
+            fp = os.path.join(root, path)
+            current = read_file(fp)
+            expected = _digest(content)
+            actual = None if current is None else content_hash(current)
+            if actual != expected and not force:
+                self.logger.warning("Not rolling back %s; changed since the run", fp)
+                skipped += 1
+                continue
+            self._apply(fp, previous)
+            restored += 1
+        self.close()
+        self.save_info(rolledBack=datetime.now().isoformat())
+        self.logger.info(
+            "Rolled back %d files from run %s; skipped %d", restored, self.name, skipped
+        )
+        return restored, skipped
+
+    def replay(self, directory=None, to=None):
+        """Make every change made by the run again.
+
+        ``directory`` => only the files in this directory of records
+        ``to`` => directory of records in which to make the changes, rather
+        than the one in which the run made them
+
+        Return the number of files changed.
+        """
+        changes = self.changes(directory)
+        if to is not None and len(set(change[0] for change in changes)) > 1:
+            raise ValueError(
+                "Run {0} changed several directories; give one to "
+                "replay".format(self.name)
+            )
+        for root, path, previous, content in changes:
+            self._apply(os.path.join(to or root, path), content)
+        self.close()
+        self.logger.info("Replayed %d files from run %s", len(changes), self.name)
+        return len(changes)
+
+    def compact(self):
+        """Replace the run's segments with one of the net change to each file.
+
+        Return the number of entries kept.
+        """
+        segments = self.segments()
+        changes = self.changes()
+        number = 1
+        if segments:
+            number = int(os.path.basename(segments[-1]).split("-")[1]) + 1
+        base = self.segment_path(number)
+        with open(base + ".pack.tmp", "wb") as pack:
+            with open(base + ".jsonl.tmp", "w") as index:
+                for seq, (root, path, previous, content) in enumerate(changes):
+                    entry = OrderedDict(
+                        [
+                            ("seq", seq),
+                            ("op", "delete" if content is None else "write"),
+                            ("directory", root),
+                            ("path", path),
+                        ]
+                    )
+                    for name, blob in (("previous", previous), ("content", content)):
+                        entry[name] = None
+                        if blob is not None:
+                            data = self.read(blob, decompress=False)
+                            entry[name] = [_digest(blob), pack.tell(), len(data)]
+                            pack.write(data)
+                    index.write(json.dumps(entry) + "\n")
+        self.close()
+        # The pack must be complete before the entries that refer to it
+        os.replace(base + ".pack.tmp", base + ".pack")
+        os.replace(base + ".jsonl.tmp", base + ".jsonl")
+        for segment in segments:
+            os.remove(segment + ".jsonl")
+            os.remove(segment + ".pack")
+        self.save_info(compacted=datetime.now().isoformat(), entries=len(changes))
+        self.logger.info(
+            "Compacted run %s to %d entries in place of %d segments",
+            self.name,
+            len(changes),
+            len(segments),
+        )
+        return len(changes)
+
+    def _apply(self, fp, blob):
+        if blob is None:
+            try:
+                os.remove(fp)
+            except OSError:
+                pass
+            return
+        dirpath = os.path.dirname(fp)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        with open(fp, "wb") as fh:
+            fh.write(self.read(blob))
+
+
+def _digest(blob):
+    return None if blob is None else blob[1][0]
+
+
+def list_runs(directory):
+    """Return list of ``JournalRun``s in ``directory``, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        JournalRun(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if os.path.isfile(os.path.join(directory, name, "run.json"))
+    ]
+
+
+def main(argv):
+    """Run the journal command given in ``argv``."""
+    args = argparser.parse_args(argv)
+    configure_logging(args)
+    runs = list_runs(args.journal)
+    if args.run is not None:
+        runs = [run for run in runs if run.name == args.run]
+        if not runs:
+            argparser.error("No run {0} in {1}".format(args.run, args.journal))
+    if args.command == "list":
+        for run in runs:
+            info = run.info()
+            state = "finished" if info.get("finished") else "unfinished"
+            for key in ("compacted", "rolledBack"):
+                if info.get(key):
+                    state = key
+            print(
+                "{0}\t{1}\t{2}\t{3} entries\t{4}".format(
+                    run.name,
+                    info.get("started"),
+                    info.get("finished"),
+                    info.get("entries"),
+                    state,
+                )
+            )
+        return 0
+    if args.command == "compact":
+        for run in runs:
+            info = run.info()
+            # Unfinished runs may still be appending to their segments
+            if info.get("finished") and not info.get("compacted"):
+                run.compact()
+        return 0
+    if not runs:
+        argparser.error("No runs in {0}".format(args.journal))
+    # Latest run, unless given
+    run = runs[-1]
+    if args.command == "rollback":
+        restored, skipped = run.rollback(force=args.force)
+        return 1 if skipped else 0
+    try:
+        run.replay(to=args.to and os.path.abspath(args.to))
+    except ValueError as e:
+        argparser.error(str(e))
+    return 0
+
+
+docbits = __doc__.split("\n\n")
+
+argparser = ArgumentParser(
+    prog="oai-harvest journal",
+    description=docbits[0],
+    epilog=docbits[-1],
+)
+argparser.add_argument(
+    "--journal",
+    required=True,
+    metavar="DIR",
+    help="directory of journals, as given to harvests",
+)
+argparser.add_argument(
+    "--to",
+    metavar="DIR",
+    help="replay the changes in DIR, rather than where they were made",
+)
+argparser.add_argument(
+    "--force",
+    action="store_true",
+    default=False,
+    help="roll back files even if they have changed since the run",
+)
+add_logging_arguments(argparser)
+argparser.add_argument("command", choices=COMMANDS, help="what to do")
+argparser.add_argument(
+    "run",
+    nargs="?",
+    help="name of the run to roll back or replay (default: the latest)",
+)
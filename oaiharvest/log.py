@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""Logging for the command line tools.
+
+Logging is configured by each command when it is run, not on import, and
+only for the ``oaiharvest`` loggers. Messages logged for every record pass
+one of the ``extra`` dicts below, e.g.::
+
+    logger.debug("Writing to file %s", fp, extra=WRITE_EVENT)
+
+so that they can be sampled by a :class:`SamplingFilter`. Like any other
+debug message they cost no more than a level check unless debug logging is
+enabled. Progress of long harvests is logged instead by a
+:class:`ProgressReporter` at regular intervals, including when each list of
+records should be complete, and harvests from which no page of records has
+arrived for a while.
+"""
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+
+#: ``extra`` for messages logged for each record stored
+WRITE_EVENT = {"event": "write"}
+#: ``extra`` for messages logged for each deleted record
+DELETE_EVENT = {"event": "delete"}
+
+# Attributes of every LogRecord, i.e. not passed in ``extra``
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()
+) | frozenset(("message", "asctime"))
+
+
+class JSONFormatter(logging.Formatter):
+    """Format each message as a JSON object on a single line.
+
+    Includes any fields passed in ``extra`` alongside the time, level,
+    logger name and message.
+    """
+
+    def format(self, record):
+        obj = OrderedDict(
+            [
+                ("time", self.formatTime(record, "%Y-%m-%dT%H:%M:%S")),
+                ("level", record.levelname),
+                ("logger", record.name),
+                ("message", record.getMessage()),
+            ]
+        )
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                obj[key] = value
+        if record.exc_info:
+            obj["exception"] = self.formatException(record.exc_info)
+        return json.dumps(obj, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Pass only one in every ``every`` messages for each per-record event.
+
+    Messages without an ``event`` are always passed.
+    """
+
+    def __init__(self, every=1):
+        logging.Filter.__init__(self)
+        self.every = max(1, every)
+        self._counters = defaultdict(itertools.count)
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None or self.every == 1:
+            return True
+        return next(self._counters[record.name, event]) % self.every == 0
+
+
+class ProgressCounter(object):
+    """Progress of harvesting from one provider.
+
+    Counts the records harvested, and follows the position in the current
+    list of records from the ``completeListSize`` and ``cursor`` reported
+    with each page, so as to estimate when the list will be complete. Only
+    updated by the thread harvesting from the provider.
+
+    ``callback`` => called with the counter after each page, before any of
+    its records are stored, e.g. to display progress
+    """
+
+    def __init__(self, source, callback=None):
+        self.source = source
+        self.callback = callback
+        self.records = 0
+        self.deleted = 0
+        self.pages = 0
+        self.started = time.time()
+        #: Time at which the last page arrived
+        self.lastPage = self.started
+        #: Number of records in the current list, if reported
+        self.completeListSize = None
+        #: Number of records in the current list up to the end of the last page
+        self.position = 0
+        #: Whether a harvest is in progress, i.e. pages are expected
+        self.active = False
+        self._listEnded = False
+
+    def page(self, page):
+        """Update progress with ``page``, an ``oaiharvest.client.Page``."""
+        if self._listEnded:
+            # First page of another list
+            self.completeListSize = None
+            self.position = 0
+        if page.cursor is not None:
+            self.position = page.cursor + len(page.records)
+        else:
+            self.position += len(page.records)
+        if page.completeListSize is not None:
+            self.completeListSize = page.completeListSize
+        self._listEnded = page.token is None
+        self.pages += 1
+        self.lastPage = time.time()
+        if self.callback is not None:
+            self.callback(self)
+
+    def rate(self, now=None):
+        """Return records (including deletions) harvested per second."""
+        if now is None:
+            now = time.time()
+        return (self.records + self.deleted) / max(now - self.started, 1e-6)
+
+    def percent(self):
+        """Return how much of the current list has arrived, or None."""
+        if not self.completeListSize:
+            return None
+        return min(100.0, 100.0 * self.position / self.completeListSize)
+
+    def eta(self, now=None):
+        """Return seconds until the current list is complete, or None.
+
+        Estimated from the rate so far; None if the provider does not report
+        ``completeListSize`` or no records have been harvested yet.
+        """
+        rate = self.rate(now)
+        if self.completeListSize is None or not rate:
+            return None
+        return max(self.completeListSize - self.position, 0) / rate
+
+    def stalled(self, timeout, now=None):
+        """Return whether no page has arrived for ``timeout`` seconds."""
+        if now is None:
+            now = time.time()
+        return self.active and now - self.lastPage > timeout
+
+
+class ProgressReporter(object):
+    """Log the progress of harvests every ``interval`` seconds.
+
+    Progress is logged from a background thread between ``start()`` and
+    ``stop()``, so that harvests only need to update a ``ProgressCounter``.
+    Harvests from which no page has arrived for ``stallTimeout`` seconds are
+    reported with a warning.
+    """
+
+    def __init__(self, interval=60, logger=None, stallTimeout=None):
+        self.interval = interval
+        self.stallTimeout = stallTimeout
+        self.logger = logger or logging.getLogger(__name__).getChild("progress")
+        self._counters = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def counter(self, source, callback=None):
+        """Return a new ``ProgressCounter`` to report on for ``source``."""
+        counter = ProgressCounter(source, callback)
+        with self._lock:
+            self._counters.append(counter)
+        return counter
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="progress")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report()
+
+    def report(self):
+        """Log progress of each harvest since it started."""
+        now = time.time()
+        with self._lock:
+            counters = list(self._counters)
+        for counter in counters:
+            rate = counter.rate(now)
+            percent = counter.percent()
+            eta = counter.eta(now)
+            message = "%s: %d records, %d deletions (%.1f records/s)"
+            args = [counter.source, counter.records, counter.deleted, rate]
+            if percent is not None:
+                message += ", %.0f%% of %d"
+                args += [percent, counter.completeListSize]
+            if eta is not None and counter.active:
+                message += ", ETA %s"
+                args.append(timedelta(seconds=int(eta)))
+            self.logger.info(
+                message,
+                *args,
+                extra={
+                    "source": counter.source,
+                    "records": counter.records,
+                    "deleted": counter.deleted,
+                    "rate": round(rate, 1),
+                    "completeListSize": counter.completeListSize,
+                    "position": counter.position,
+                    "eta": None if eta is None else round(eta),
+                }
+            )
+            if self.stallTimeout and counter.stalled(self.stallTimeout, now):
+                self.logger.warning(
+                    "%s: no records received for %d seconds",
+                    counter.source,
+                    now - counter.lastPage,
+                    extra={"source": counter.source, "stalled": True},
+                )
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+
+def add_logging_arguments(argparser):
+    """Add options for ``configure_logging`` to ``argparser``."""
+    group = argparser.add_mutually_exclusive_group()
+    group.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        dest="verbosity",
+        const=1,
+        default=0,
+        help="log debug messages",
+    )
+    group.add_argument(
+        "-q",
+        "--quiet",
+        action="store_const",
+        dest="verbosity",
+        const=-1,
+        help="only log warnings and errors",
+    )
+    argparser.add_argument(
+        "--log-file",
+        dest="logFile",
+        metavar="PATH",
+        help="also write log messages to PATH",
+    )
+    argparser.add_argument(
+        "--log-json",
+        action="store_true",
+        dest="logJSON",
+        default=False,
+        help="log messages as JSON objects, one per line",
+    )
+    argparser.add_argument(
+        "--log-sample",
+        dest="logSample",
+        type=int,
+        default=1,
+        metavar="N",
+        help="log only one in every N debug messages about single records",
+    )
+
+
+#: Handlers added by the last call to ``configure_logging``
+_handlers = []
+
+#: Loggers configured by ``configure_logging``; commands run with
+#: ``python -m`` log as __main__
+_configured = ("oaiharvest", "__main__")
+
+
+def configure_logging(args):
+    """Configure the ``oaiharvest`` loggers from command line ``args``.
+
+    Handlers added by any previous call are removed first, so that messages
+    are not logged twice when commands are run repeatedly in one process.
+
+    Return the handlers added, so that they can be removed again.
+    """
+    level = {-1: logging.WARNING, 0: logging.INFO}.get(args.verbosity, logging.DEBUG)
+    if args.logJSON:
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter("%(levelname)-8s %(message)s")
+    handlers = [logging.StreamHandler()]
+    if args.logFile:
+        handlers.append(logging.FileHandler(os.path.expanduser(args.logFile)))
+        if not args.logJSON:
+            handlers[-1].setFormatter(
+                logging.Formatter(
+                    "%(asctime)s %(name)-16s %(levelname)-8s %(message)s",
+                    datefmt="[%Y-%m-%d %H:%M:%S]",
+                )
+            )
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(formatter)
+        handler.addFilter(SamplingFilter(args.logSample))
+    for name in _configured:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        for handler in _handlers:
+            logger.removeHandler(handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+    for handler in _handlers:
+        handler.close()
+    _handlers[:] = handlers
+    return handlers
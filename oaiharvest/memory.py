@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""Bound the memory used by harvests.
+
+Pages of records may be fetched ahead of being stored, in a background
+thread. The number of pages, records and bytes buffered in this way is
+limited for each harvest, and a :class:`MemoryBudget` can limit the bytes
+buffered by all harvests in the process. When a limit is reached, fetching
+waits for buffered pages to be stored rather than growing memory use.
+"""
+import logging
+import sys
+import threading
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """Return peak resident set size of this process in bytes, or None."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss
+    # Linux reports kilobytes
+    return maxrss * 1024
+
+
+class MemoryBudget(object):
+    """Limit on the bytes buffered by all harvests in the process.
+
+    ``maxBytes`` => maximum bytes that may be buffered at once. A request for
+    more than this is granted when nothing else is buffered.
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.used = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size, cancelled=lambda: False):
+        """Wait until ``size`` bytes are available, then use them.
+
+        Return False without using them if ``cancelled()`` becomes true.
+        """
+        with self._cond:
+            while self.used and self.used + size > self.maxBytes:
+                if cancelled():
+                    return False
+                self._cond.wait(0.1)
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, size):
+        """Make ``size`` bytes available again."""
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class BufferLimits(object):
+    """Limits on buffering pages of records fetched ahead of being stored.
+
+    ``maxPages`` => maximum number of pages to fetch ahead; 0 to fetch each
+    page only when the previous one has been stored
+    ``maxRecords`` => maximum number of records to buffer, or None
+    ``maxBytes`` => maximum bytes of responses to buffer, or None
+    ``budget`` => ``MemoryBudget`` shared between harvests, or None
+    """
+
+    def __init__(self, maxPages=0, maxRecords=None, maxBytes=None, budget=None):
+        self.maxPages = maxPages
+        self.maxRecords = maxRecords
+        self.maxBytes = maxBytes
+        self.budget = budget
+
+
+class PageBuffer(object):
+    """Buffer between a thread fetching pages and one storing their records.
+
+    Pages must have ``records`` and ``size`` attributes. At least one page
+    may always be buffered so that a single page larger than the limits
+    does not stop the harvest.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._pages = deque()
+        self._records = 0
+        self._bytes = 0
+        self._current = None
+        self._finished = False
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, page):
+        """Add ``page``, waiting for room. Return False if buffer closed."""
+        limits = self.limits
+        with self._cond:
+            while not self._closed and not self._has_room(page):
+                self._cond.wait()
+            if self._closed:
+                return False
+        if limits.budget is not None:
+            if not limits.budget.acquire(page.size, lambda: self._closed):
+                return False
+        with self._cond:
+            if self._closed:
+                self._release(page)
+                return False
+            self._pages.append(page)
+            self._records += len(page.records)
+            self._bytes += page.size
+            self._cond.notify_all()
+        return True
+
+    def finish(self, error=None):
+        """No more pages will be added, optionally because of ``error``."""
+        with self._cond:
+            self._finished = True
+            self._error = error
+            self._cond.notify_all()
+
+    def get(self):
+        """Return the next page, or None when there are no more.
+
+        The previous page returned is considered stored and its memory
+        available again.
+        """
+        with self._cond:
+            self._done_with_current()
+            while not self._pages and not self._finished:
+                self._cond.wait()
+            if self._pages:
+                self._current = self._pages.popleft()
+                self._cond.notify_all()
+                return self._current
+            if self._error is not None:
+                raise self._error
+            return None
+
+    def close(self):
+        """Stop buffering, e.g. because the harvest was stopped early."""
+        with self._cond:
+            self._closed = True
+            self._done_with_current()
+            while self._pages:
+                self._current = self._pages.popleft()
+                self._done_with_current()
+            self._cond.notify_all()
+
+    def _has_room(self, page):
+        if not self._pages:
+            return True
+        limits = self.limits
+        if len(self._pages) >= limits.maxPages:
+            return False
+        if limits.maxRecords and (
+            self._records + len(page.records) > limits.maxRecords
+        ):
+            return False
+        if limits.maxBytes and self._bytes + page.size > limits.maxBytes:
+            return False
+        return True
+
+    def _done_with_current(self):
+        page, self._current = self._current, None
+        if page is not None:
+            self._records -= len(page.records)
+            self._bytes -= page.size
+            self._release(page)
+
+    def _release(self, page):
+        if self.limits.budget is not None:
+            self.limits.budget.release(page.size)
+
+
+def prefetch(pages, limits):
+    """Generate ``pages``, fetching them ahead in a background thread."""
+    logger = logging.getLogger(__name__).getChild("prefetch")
+    buffer = PageBuffer(limits)
+
+    def fill():
+        try:
+            for page in pages:
+                if not buffer.put(page):
+                    logger.debug("Harvest stopped; no longer fetching pages")
+                    return
+        except Exception as e:
+            buffer.finish(e)
+        else:
+            buffer.finish()
+        finally:
+            if hasattr(pages, "close"):
+                pages.close()
+
+    thread = threading.Thread(target=fill, name="prefetch")
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            page = buffer.get()
+            if page is None:
+                return
+            yield page
+    finally:
+        buffer.close()
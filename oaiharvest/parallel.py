@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Parse pages of records in a pool of processes.
+
+Parsing responses and reading the metadata of each record can use all of a
+single core. :class:`ParallelPageParser` sends the raw bytes of each page to
+a pool of processes to be parsed, and returns the records in compact form.
+The resumptionToken needed to request the next page is found without parsing
+the page, so that several pages can be parsed at once, while records are
+still returned in the order in which they were listed.
+"""
+import re
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import unescape
+
+from lxml import etree
+from oaipmh import client
+from oaipmh.common import Header, Metadata
+
+_TOKEN_RE = re.compile(
+    rb"<(?:[\w.-]+:)?resumptionToken\b([^>]*?)"
+    rb"(?:/>|>(.*?)</(?:[\w.-]+:)?resumptionToken>)",
+    re.DOTALL,
+)
+
+_ATTRIBUTE_RE = re.compile(rb"""(completeListSize|cursor)\s*=\s*["']\s*(\d+)""")
+
+_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+
+_TOKEN_TAG = "{http://www.openarchives.org/OAI/2.0/}resumptionToken"
+
+
+def find_resumption_token(xml):
+    """Return the resumptionToken in the response ``xml``, or None."""
+    matches = list(_TOKEN_RE.finditer(xml))
+    if not matches or matches[-1].group(2) is None:
+        return None
+    text = matches[-1].group(2)
+    if b"&#" in text or b"<![CDATA[" in text:
+        # Rare enough to leave character references and CDATA to lxml
+        tokens = etree.fromstring(xml).iter(_TOKEN_TAG)
+        token = "".join(list(tokens)[-1].itertext()).strip()
+    else:
+        token = unescape(text.decode("utf-8"), _ENTITIES).strip()
+    return token or None
+
+
+def find_list_position(xml):
+    """Return completeListSize and cursor of the resumptionToken in ``xml``.
+
+    Either may be None if the provider does not report it.
+    """
+    matches = list(_TOKEN_RE.finditer(xml))
+    if not matches:
+        return None, None
+    attributes = dict(_ATTRIBUTE_RE.findall(matches[-1].group(1)))
+    completeListSize = attributes.get(b"completeListSize")
+    cursor = attributes.get(b"cursor")
+    return (
+        int(completeListSize) if completeListSize is not None else None,
+        int(cursor) if cursor is not None else None,
+    )
+
+
+class _PageClient(client.BaseClient):
+    """Client that parses responses it is given rather than requesting them."""
+
+    def makeRequest(self, **kw):
+        return self._xml
+
+    def parsePage(self, xml, metadataPrefix):
+        self._xml = xml
+        tree = self.makeRequestErrorHandling(verb="ListRecords")
+        records, token = self.buildRecords(
+            metadataPrefix, self.getNamespaces(), self._metadata_registry, tree
+        )
+        return [_compact(record) for record in records]
+
+
+def _compact(record):
+    """Return ``record`` as a tuple of values that can be pickled."""
+    header, metadata, about = record
+    if isinstance(metadata, Metadata):
+        # The element can't be pickled, the map of fields can
+        metadata = Metadata(None, metadata.getMap())
+    return (
+        header.identifier(),
+        header.datestamp(),
+        header.setSpec(),
+        header.isDeleted(),
+        metadata,
+        about,
+    )
+
+
+def _expand(compact):
+    """Return record from the tuple returned by ``_compact``."""
+    identifier, datestamp, setspec, deleted, metadata, about = compact
+    return (Header(None, identifier, datestamp, setspec, deleted), metadata, about)
+
+
+# Client for parsing pages in each worker process
+_client = None
+
+
+def _init_worker(mdRegistry):
+    global _client
+    _client = _PageClient(mdRegistry)
+
+
+def _parse_page(xml, metadataPrefix):
+    return _client.parsePage(xml, metadataPrefix)
+
+
+class ParallelPageParser(object):
+    """Parse pages of records in a pool of processes.
+
+    ``mdRegistry`` => metadata registry with which to read records; must be
+    possible to pickle
+    ``processes`` => number of worker processes
+    ``maxPending`` => maximum number of pages to request ahead of the page
+    being returned; defaults to twice the number of processes
+
+    Headers of records parsed in this way have no ``element()``.
+    """
+
+    def __init__(self, mdRegistry, processes, maxPending=None):
+        self.processes = processes
+        self.maxPending = maxPending or 2 * processes
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=(mdRegistry,)
+        )
+
+    def parse(self, xml, metadataPrefix):
+        """Start parsing page ``xml``, return a future for its records."""
+        return self._executor.submit(_parse_page, xml, metadataPrefix)
+
+    def records(self, future):
+        """Return the list of records parsed by ``future``."""
+        return [_expand(compact) for compact in future.result()]
+
+    def close(self):
+        self._executor.shutdown()
@@ -1,19 +1,30 @@
 # encoding: utf-8
 """Manage registry of OAI-PMH providers.
 
-usage: oai-reg [-h] [-d DATABASEPATH] {add,rm,list} ...
+usage: oai-reg [-h] [-d DATABASEPATH] [-v | -q] [--log-file PATH] [--log-json]
+               [--log-sample N]
+               {add,rm,list,import,export} ...
 
 positional arguments:
-  {add,rm,list}         Actions
+  {add,rm,list,import,export}
+                        Actions
     add                 Add a new OAI-PMH provider
     rm                  Remove a registered OAI-PMH provider
     list                List registered OAI-PMH provider
+    import              Add OAI-PMH providers listed in a CSV file
+    export              Write registered OAI-PMH providers to a CSV file
 
 optional arguments:
   -h, --help            show this help message and exit
   -d DATABASEPATH, --database DATABASEPATH
                         Path to provider registry database. Currently supports
                         sqlite3 only.
+  -v, --verbose         log debug messages
+  -q, --quiet           only log warnings and errors
+  --log-file PATH       also write log messages to PATH
+  --log-json            log messages as JSON objects, one per line
+  --log-sample N        log only one in every N debug messages about single
+                        records
 
 Copyright © 2013, the University of Liverpool <http://www.liv.ac.uk>. All
 rights reserved.
@@ -22,26 +33,45 @@ Distributed under the terms of the BSD 3-clause License
 <http://opensource.org/licenses/BSD-3-Clause>.
 """
 
+import csv
 import logging
 import os
 import sqlite3
 import sys
+import time
 
 # Python3 compatibility
 from six.moves import input
 
 from argparse import ArgumentParser
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 
 # Import oaipmh for validation purposes
-from oaipmh.client import Client
 from oaipmh.metadata import MetadataRegistry, oai_dc_reader
 from oaipmh.error import XMLSyntaxError
 from six.moves.urllib.error import HTTPError
 
+from oaiharvest.cache import ResponseCache
+from oaiharvest.client import Client
+from oaiharvest.log import add_logging_arguments, configure_logging
+
 
 MAX_NAME_LENGTH = 15
 
+#: Subcommands of oai-harvest, which may not be names of providers
+SUBCOMMANDS = ("worker", "enqueue", "search", "journal")
+
+#: Columns of CSV files of providers, for import and export
+CSV_COLUMNS = (
+    "name",
+    "url",
+    "destination",
+    "metadataPrefix",
+    "harvestWindow",
+    "lastHarvest",
+)
+
 
 def add_provider(cxn, args):
     """Add a new provider to the registry database.
@@ -52,26 +82,18 @@ def add_provider(cxn, args):
     ``cxn`` => instance of ``sqlite3.Connection``
     ``args`` => instance of ``argparse.Namespace``
     """
-    global logger, MAX_NAME_LENGTH
+    global logger
     addlogger = logger.getChild("add")
     # Validate name
-    if len(args.name) > MAX_NAME_LENGTH:
-        addlogger.critical(
-            "Short name for new provider must be no more than "
-            "{0} characters long".format(MAX_NAME_LENGTH)
-        )
-        return 1
-    elif args.name.startswith(("http://", "https://")) or args.name == "all":
-        addlogger.critical(
-            'Short name for new provider may not be "all" nor '
-            'may it begin "http://" or "https://"'
-        )
+    error = check_name(args.name)
+    if error is not None:
+        addlogger.critical(error)
         return 1
     # Try to create row now to avoid unnecessary validation if duplicate
     try:
         cxn.execute(
             "INSERT INTO providers(name, lastHarvest) values " "(?, ?)",
-            (args.name, datetime.fromtimestamp(0)),
+            (args.name, datetime.utcfromtimestamp(0)),
         )
     except sqlite3.IntegrityError:
         addlogger.critical(
@@ -92,7 +114,10 @@ def add_provider(cxn, args):
     # Set up an OAI-PMH client for validating providers
     md_registry = MetadataRegistry()
     md_registry.registerReader("oai_dc", oai_dc_reader)
-    client = Client(args.url, md_registry)
+    cache = ResponseCache(
+        cxn, ttl=timedelta(hours=args.cacheTTL), refresh=args.refreshCache
+    )
+    client = Client(args.url, md_registry, responseCache=cache)
     # Validate Base URL by fetching Identify
     try:
         client.identify()
@@ -133,15 +158,22 @@ def add_provider(cxn, args):
         "UPDATE providers SET "
         "url=?, "
         "destination=?, "
-        "metadataPrefix=? "
+        "metadataPrefix=?, "
+        "harvestWindow=? "
         "WHERE name=?",
-        (args.url, args.dest, args.metadataPrefix, args.name),
+        (
+            args.url,
+            args.dest,
+            args.metadataPrefix,
+            format_window(args.between),
+            args.name,
+        ),
     )
     addlogger.info(
         "URL for next harvest: {0}?verb=ListRecords"
         "&metadataPrefix={1}"
         "&from={2:%Y-%m-%dT%H:%M:%SZ%z}"
-        "".format(args.url, args.metadataPrefix, datetime.fromtimestamp(0))
+        "".format(args.url, args.metadataPrefix, datetime.utcfromtimestamp(0))
     )
     # All done, commit database
     cxn.commit()
@@ -192,6 +224,32 @@ def list_providers(cxn, args):
     elif args.lastHarvest:
         sql = "SELECT name, lastHarvest FROM providers"
         label = "Last Completed Harvest Time"
+    elif args.between:
+        sql = "SELECT name, harvestWindow FROM providers"
+        label = "Harvest Window"
+    elif args.health:
+        sql = (
+            "SELECT name, coalesce(failures, 0) || ' consecutive failures; ' || "
+            "coalesce('latency ' || round(latency, 2) || 's', 'latency unknown') "
+            "|| coalesce('; skipped until ' || retryAt, '') "
+            "|| coalesce('; last error: ' || lastError, '') "
+            "FROM providers LEFT JOIN health ON health.provider=providers.name"
+        )
+        label = "Health"
+    elif args.tuning:
+        sql = (
+            "SELECT name, coalesce(strategy, 'sequential') || "
+            "coalesce(' (' || nullif(partitions, 1) || ' lists)', '') "
+            "|| coalesce('; ' || reason, '') "
+            "|| coalesce('; ' || round(perPage, 1) || ' records in ' "
+            "|| round(latency, 2) || 's per page', '') "
+            "FROM providers "
+            "LEFT JOIN tuning ON tuning.provider=providers.name "
+            "LEFT JOIN (SELECT provider, avg(records) AS perPage, "
+            "avg(seconds) AS latency FROM pages GROUP BY provider) AS history "
+            "ON history.provider=providers.name"
+        )
+        label = "Harvest Strategy"
     else:
         # Default is smart URL for next harvest request
         sql = (
@@ -211,13 +269,258 @@ def list_providers(cxn, args):
         sys.stdout.flush()
 
 
+def import_providers(cxn, args):
+    """Add providers listed in a CSV file to the registry database.
+
+    Providers are validated concurrently, and those that are valid are added
+    in a single transaction. Providers that are not valid are reported
+    together, and, optionally, written to a CSV file of their own, with the
+    reason, so that they can be corrected and imported again. Return 0 if all
+    providers were added, 1 otherwise.
+
+    ``cxn`` => instance of ``sqlite3.Connection``
+    ``args`` => instance of ``argparse.Namespace``
+    """
+    global logger
+    importlogger = logger.getChild("import")
+    if args.path == "-":
+        rows = list(csv.DictReader(sys.stdin))
+    else:
+        with open(args.path, newline="") as fh:
+            rows = list(csv.DictReader(fh))
+    existing = set(row[0] for row in cxn.execute("SELECT name FROM providers"))
+    providers = []
+    # (name, row, reason) for each provider that cannot be added
+    errors = []
+    seen = set()
+    for row in rows:
+        provider = dict(
+            (column, (row.get(column) or "").strip() or None) for column in CSV_COLUMNS
+        )
+        provider["destination"] = os.path.expanduser(
+            provider["destination"] or args.dest
+        )
+        provider["metadataPrefix"] = provider["metadataPrefix"] or "oai_dc"
+        name = provider["name"] or ""
+        error = check_name(name)
+        if error is None and name in seen:
+            error = "Provider listed more than once"
+        elif error is None and name in existing and not args.replace:
+            error = "Provider with this name already exists"
+        elif error is None and not provider["url"]:
+            error = "Base URL not supplied"
+        if error is None:
+            try:
+                provider["harvestWindow"] = format_window(
+                    parse_window(provider["harvestWindow"])
+                )
+                if provider["lastHarvest"] is not None:
+                    provider["lastHarvest"] = parse_timestamp(provider["lastHarvest"])
+            except ValueError as e:
+                error = str(e)
+        seen.add(name)
+        if error is not None:
+            errors.append((name, row, error))
+            continue
+        providers.append((provider, row))
+    if args.validate and providers:
+        importlogger.info(
+            "Validating {0} providers, {1} at a time".format(
+                len(providers), args.workers
+            )
+        )
+        failures = validate_providers(
+            [provider for provider, row in providers], args.timeout, args.workers
+        )
+        errors.extend(
+            (provider["name"], row, failures[provider["name"]])
+            for provider, row in providers
+            if provider["name"] in failures
+        )
+        providers = [
+            (provider, row)
+            for provider, row in providers
+            if provider["name"] not in failures
+        ]
+    # All or nothing, so that a failed import can simply be run again
+    with cxn:
+        for provider, row in providers:
+            values = (
+                provider["url"],
+                provider["destination"],
+                provider["metadataPrefix"],
+                provider["harvestWindow"],
+                provider["name"],
+            )
+            if provider["name"] in existing:
+                cxn.execute(
+                    "UPDATE providers SET "
+                    "url=?, destination=?, metadataPrefix=?, harvestWindow=? "
+                    "WHERE name=?",
+                    values,
+                )
+                if provider["lastHarvest"] is not None:
+                    cxn.execute(
+                        "UPDATE providers SET lastHarvest=? WHERE name=?",
+                        (provider["lastHarvest"], provider["name"]),
+                    )
+            else:
+                cxn.execute(
+                    "INSERT INTO providers"
+                    "(url, destination, metadataPrefix, harvestWindow, name, "
+                    "lastHarvest) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    values + (provider["lastHarvest"] or datetime.utcfromtimestamp(0),),
+                )
+    errors.sort(key=lambda error: error[0])
+    for name, row, error in errors:
+        importlogger.error('Unable to import provider "{0}": {1}'.format(name, error))
+    if args.rejects is not None and errors:
+        with open(args.rejects, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, CSV_COLUMNS + ("error",), extrasaction="ignore")
+            writer.writeheader()
+            for name, row, error in errors:
+                writer.writerow(dict(row, error=error))
+    importlogger.info(
+        "Imported {0} providers, {1} failed".format(len(providers), len(errors))
+    )
+    return 1 if errors else 0
+
+
+def export_providers(cxn, args):
+    """Write providers in the registry database to a CSV file.
+
+    The file may be imported again, e.g. into another registry. Return 0.
+
+    ``cxn`` => instance of ``sqlite3.Connection``
+    ``args`` => instance of ``argparse.Namespace``
+    """
+    cursor = cxn.execute(
+        "SELECT name, url, destination, metadataPrefix, harvestWindow, "
+        "lastHarvest [timestamp] FROM providers ORDER BY name"
+    )
+    if args.output == "-":
+        fh = sys.stdout
+    else:
+        fh = open(args.output, "w", newline="")
+    try:
+        writer = csv.writer(fh)
+        writer.writerow(CSV_COLUMNS)
+        for row in cursor:
+            row = list(row)
+            if isinstance(row[-1], datetime):
+                row[-1] = "{0:%Y-%m-%dT%H:%M:%S}".format(row[-1])
+            writer.writerow(row)
+    finally:
+        if fh is not sys.stdout:
+            fh.close()
+    return 0
+
+
+def check_name(name):
+    """Return why ``name`` may not be used for a provider, or None."""
+    if not name:
+        return "Short name for new provider not supplied"
+    if len(name) > MAX_NAME_LENGTH:
+        return (
+            "Short name for new provider must be no more than "
+            "{0} characters long".format(MAX_NAME_LENGTH)
+        )
+    if name.startswith(("http://", "https://")) or name == "all":
+        return (
+            'Short name for new provider may not be "all" nor '
+            'may it begin "http://" or "https://"'
+        )
+    if name in SUBCOMMANDS:
+        return (
+            'Short name for new provider may not be "{0}", which is a '
+            "subcommand of oai-harvest".format(name)
+        )
+    return None
+
+
+def validate_provider(provider, timeout=None):
+    """Return why ``provider`` cannot be harvested, or None if it can.
+
+    ``provider`` => dict with the ``url`` and ``metadataPrefix`` to validate
+    ``timeout`` => seconds to wait for each response
+    """
+    md_registry = MetadataRegistry()
+    md_registry.registerReader("oai_dc", oai_dc_reader)
+    client = Client(provider["url"], md_registry, stallTimeout=timeout)
+    try:
+        client.identify()
+    except Exception as e:
+        return (
+            "Base URL does not return a valid response to an `Identify` "
+            "request ({0})".format(e)
+        )
+    try:
+        prefixes = [mdpinfo[0] for mdpinfo in client.listMetadataFormats()]
+    except Exception as e:
+        return "Unable to list metadata formats ({0})".format(e)
+    if provider["metadataPrefix"] not in prefixes:
+        return "metadataPrefix {0} not available; choose from {1}".format(
+            provider["metadataPrefix"], ", ".join(sorted(prefixes))
+        )
+    return None
+
+
+def validate_providers(providers, timeout=30, workers=16):
+    """Validate ``providers`` concurrently.
+
+    Return a dict of the reason why each provider that is not valid cannot
+    be harvested, keyed by name. Providers that have not been validated
+    within ``timeout`` seconds of starting are not valid.
+    """
+    errors = {}
+    started = {}
+
+    def validate(provider):
+        started[provider["name"]] = time.time()
+        return validate_provider(provider, timeout)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    futures = dict(
+        (executor.submit(validate, provider), provider["name"])
+        for provider in providers
+    )
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=min(timeout, 1), return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    error = future.result()
+                except Exception as e:
+                    error = str(e)
+                if error is not None:
+                    errors[futures[future]] = error
+            now = time.time()
+            for future in list(pending):
+                name = futures[future]
+                if name in started and now - started[name] > timeout:
+                    # Give up waiting; the request will time out by itself
+                    errors[name] = "No valid response within {0}s".format(timeout)
+                    pending.discard(future)
+    finally:
+        executor.shutdown(wait=False)
+    return errors
+
+
 def verify_database(path):
     """Verify that a suitable database exists, create it if not."""
     global logger
     var_logger = logger.getChild("verify")
     try:
+        # Connections may be shared by threads that serialize their use of
+        # it, e.g. by a ResponseCache used for harvests in several threads
         cxn = sqlite3.connect(
-            path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+            path,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=False,
         )
     except sqlite3.OperationalError:
         var_logger.critical(
@@ -239,13 +542,180 @@ def verify_database(path):
             "metadataPrefix varchar, "
             "lastHarvest timestamp)".format(MAX_NAME_LENGTH)
         )
+    # Cache of Identify and ListMetadataFormats responses
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS responses("
+        "url varchar, "
+        "request varchar, "
+        "body blob, "
+        "fetched timestamp, "
+        "etag varchar, "
+        "lastModified varchar, "
+        "PRIMARY KEY (url, request))"
+    )
+    # Wall clock times between which to harvest from each provider
+    add_column(cxn, "providers", "harvestWindow", "varchar")
+    # Where to resume harvests paused outside of their harvestWindow
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS checkpoints("
+        "provider varchar primary key, "
+        "resumptionToken varchar, "
+        "watermark timestamp)"
+    )
+    # History of harvests, used to schedule the longest first
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS harvests("
+        "id integer primary key, "
+        "provider varchar, "
+        "started timestamp, "
+        "duration real)"
+    )
+    # Queue of harvests leased to workers (see oaiharvest.workqueue)
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS tasks("
+        "id integer primary key, "
+        "provider varchar, "
+        "fromTime timestamp, "
+        "untilTime timestamp, "
+        "batch varchar, "
+        "state varchar, "
+        "worker varchar, "
+        "leaseExpires timestamp, "
+        "notBefore timestamp, "
+        "attempts integer default 0, "
+        "lastError varchar, "
+        "resumptionToken varchar, "
+        "watermark timestamp, "
+        "enqueued timestamp)"
+    )
+    # Health of providers, for circuit breakers (see oaiharvest.health)
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS health("
+        "provider varchar primary key, "
+        "failures integer, "
+        "lastError varchar, "
+        "lastFailure timestamp, "
+        "lastSuccess timestamp, "
+        "latency real, "
+        "requests integer, "
+        "retryAt timestamp)"
+    )
+    # Recent pages of records from providers (see oaiharvest.tuning)
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS pages("
+        "id integer primary key, "
+        "provider varchar, "
+        "received timestamp, "
+        "records integer, "
+        "bytes integer, "
+        "seconds real)"
+    )
+    cxn.execute("CREATE INDEX IF NOT EXISTS pagesProvider ON pages(provider)")
+    # How to divide harvests from providers, tuned from their pages
+    cxn.execute(
+        "CREATE TABLE IF NOT EXISTS tuning("
+        "provider varchar primary key, "
+        "strategy varchar, "
+        "partitions integer, "
+        "reason varchar, "
+        "listSize integer, "
+        "skew real, "
+        "setsCover integer, "
+        "updated timestamp)"
+    )
+    if cxn.execute("PRAGMA user_version").fetchone()[0] < 1:
+        utc_last_harvests(cxn)
     return cxn
 
 
+def add_column(cxn, table, column, declaration):
+    """Add ``column`` to ``table`` if a database from before it lacks it."""
+    columns = [row[1] for row in cxn.execute("PRAGMA table_info({0})".format(table))]
+    if column not in columns:
+        cxn.execute(
+            "ALTER TABLE {0} ADD COLUMN {1} {2}".format(table, column, declaration)
+        )
+
+
+def utc_last_harvests(cxn):
+    """Convert lastHarvest times recorded in local time to UTC.
+
+    lastHarvest was the local time of the harvest before it was taken from
+    the server's responseDate, which is UTC. Only times with fractions of a
+    second were local times, from the clock; others, e.g. from ``--until``,
+    are left as they were. Each time converted is logged. Version 1 of the
+    registry (``PRAGMA user_version``) has only UTC times.
+    """
+    verifylogger = logger.getChild("verify")
+    cxn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have converted them meanwhile
+        if cxn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            rows = cxn.execute(
+                "SELECT name, CAST(lastHarvest AS TEXT) FROM providers "
+                "WHERE lastHarvest IS NOT NULL"
+            ).fetchall()
+            for name, value in rows:
+                local = parse_timestamp(value)
+                if not local.microsecond:
+                    continue
+                utc = local.astimezone(timezone.utc).replace(tzinfo=None)
+                cxn.execute(
+                    "UPDATE providers SET lastHarvest=? WHERE name=?", (utc, name)
+                )
+                verifylogger.warning(
+                    "Converted lastHarvest of {0} from local time {1} to UTC "
+                    "{2}".format(name, local, utc)
+                )
+            cxn.execute("PRAGMA user_version=1")
+    except Exception:
+        cxn.execute("ROLLBACK")
+        raise
+    cxn.execute("COMMIT")
+
+
+def parse_time(argument):
+    """Time parser to be used as type argument for argparser options."""
+    return datetime.strptime(argument, "%H:%M")
+
+
+def format_window(between):
+    """Return ``between`` (start, stop) times as stored in the registry."""
+    if between is None:
+        return None
+    return " ".join("{0:%H:%M}".format(t) for t in between)
+
+
+def parse_window(value):
+    """Return (start, stop) times from the registry value, or None."""
+    if not value:
+        return None
+    times = tuple(parse_time(t) for t in value.split())
+    if len(times) != 2:
+        raise ValueError("Harvest window must be given as HH:MM HH:MM")
+    return times
+
+
+def parse_timestamp(value):
+    """Return ``datetime`` from an exported lastHarvest timestamp."""
+    for fmt in (
+        "%Y-%m-%dT%H:%M:%S",
+        "%Y-%m-%d %H:%M:%S.%f",
+        "%Y-%m-%d %H:%M:%S",
+        "%Y-%m-%d",
+    ):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Unable to parse lastHarvest time {0}".format(value))
+
+
 def main(argv=None):
     """Process command line options, hand off to appropriate function."""
     global argparser, connection, logger
     args = argparser.parse_args() if argv is None else argparser.parse_args(argv)
+    configure_logging(args)
     cxn = verify_database(args.databasePath)
     if not isinstance(cxn, sqlite3.Connection):
         return cxn
@@ -265,6 +735,7 @@ argparser.add_argument(
     default=os.path.expanduser("~/.oai-harvest/registry.db"),
     help=("Path to provider registry database. Currently " "supports sqlite3 only."),
 )
+add_logging_arguments(argparser)
 subparsers = argparser.add_subparsers(help="Actions")
 # Create the parser for the "add" command
 parser_add = subparsers.add_parser("add", help="Add a new OAI-PMH provider")
@@ -301,6 +772,36 @@ group.add_argument(
         "information"
     ),
 )
+parser_add.add_argument(
+    "-b",
+    "--between",
+    type=parse_time,
+    nargs=2,
+    metavar="HH:MM",
+    help=(
+        "harvest from this provider only between the first and the second "
+        "wall clock time; paused harvests resume in the next window"
+    ),
+)
+parser_add.add_argument(
+    "--cache-ttl",
+    action="store",
+    dest="cacheTTL",
+    type=float,
+    default=24,
+    metavar="HOURS",
+    help=(
+        "re-use cached Identify and ListMetadataFormats responses "
+        "for this many hours (default: 24)"
+    ),
+)
+parser_add.add_argument(
+    "--refresh",
+    action="store_true",
+    dest="refreshCache",
+    default=False,
+    help="ignore cached responses; revalidate with the provider",
+)
 parser_add.set_defaults(func=add_provider)
 # Create the parser for the "remove" command
 parser_rm = subparsers.add_parser("rm", help="Remove a registered OAI-PMH provider")
@@ -345,27 +846,118 @@ group.add_argument(
     default=False,
     help=("list providers with the time and date of their " "last completed harvest"),
 )
+group.add_argument(
+    "-b",
+    "--between",
+    action="store_true",
+    dest="between",
+    default=False,
+    help="list providers with the wall clock times between which to harvest",
+)
+group.add_argument(
+    "--health",
+    action="store_true",
+    dest="health",
+    default=False,
+    help=(
+        "list providers with their consecutive failed harvests, average "
+        "latency and last error"
+    ),
+)
+group.add_argument(
+    "--tuning",
+    action="store_true",
+    dest="tuning",
+    default=False,
+    help=(
+        "list providers with the strategy by which to divide their harvests, "
+        "the reason for it, and the size and response time of their pages"
+    ),
+)
 parser_list.set_defaults(func=list_providers)
+# Create the parser for the "import" command
+parser_import = subparsers.add_parser(
+    "import", help="Add OAI-PMH providers listed in a CSV file"
+)
+parser_import.add_argument(
+    "path",
+    action="store",
+    help=(
+        "CSV file with a header row naming some of the columns: "
+        + ", ".join(CSV_COLUMNS)
+        + "; name and url are required. - for stdin"
+    ),
+)
+parser_import.add_argument(
+    "-d",
+    "--dir",
+    action="store",
+    dest="dest",
+    default=os.getcwd(),
+    help="destination for providers without one (default: current directory)",
+)
+parser_import.add_argument(
+    "-w",
+    "--workers",
+    action="store",
+    dest="workers",
+    type=int,
+    default=16,
+    metavar="N",
+    help="number of providers to validate concurrently (default: 16)",
+)
+parser_import.add_argument(
+    "--timeout",
+    action="store",
+    dest="timeout",
+    type=float,
+    default=30,
+    metavar="SECONDS",
+    help="time allowed to validate each provider (default: 30)",
+)
+parser_import.add_argument(
+    "--no-validate",
+    action="store_false",
+    dest="validate",
+    default=True,
+    help="add providers without requesting Identify and ListMetadataFormats",
+)
+parser_import.add_argument(
+    "--replace",
+    action="store_true",
+    dest="replace",
+    default=False,
+    help="update providers that are already registered rather than failing",
+)
+parser_import.add_argument(
+    "--rejects",
+    action="store",
+    dest="rejects",
+    metavar="PATH",
+    help="write providers that could not be added, with the reason, to PATH",
+)
+parser_import.set_defaults(func=import_providers)
+# Create the parser for the "export" command
+parser_export = subparsers.add_parser(
+    "export", help="Write registered OAI-PMH providers to a CSV file"
+)
+parser_export.add_argument(
+    "-o",
+    "--output",
+    action="store",
+    dest="output",
+    default="-",
+    metavar="PATH",
+    help="file to write to (default: - for stdout)",
+)
+parser_export.set_defaults(func=export_providers)
 
 # Check for existence of directory for persistent db, logs etc.
 appdir = os.path.expanduser("~/.oai-harvest")
 if not os.path.exists(appdir):
     os.mkdir(appdir)
 
-# Set up logger
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s %(name)-16s %(levelname)-8s %(message)s",
-    datefmt="[%Y-%m-%d %H:%M:%S]",
-    filename=os.path.join(appdir, "registry.log"),
-)
 logger = logging.getLogger(__name__)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(levelname)-8s %(message)s")
-ch.setFormatter(formatter)
-logger.addHandler(ch)
-
 
 if __name__ == "__main__":
     sys.exit(main())
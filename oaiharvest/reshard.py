@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""Move harvested records in a directory into a different layout.
+
+usage: oai-reshard [-h] [--from-depth N] [--from-width N]
+                   [--from-create-subdirs | --from-subdirs-on SUBDIRS]
+                   [--depth N] [--width N] [-v | -q] [--log-file PATH]
+                   [--log-json] [--log-sample N]
+                   dir
+
+positional arguments:
+  dir                   directory containing harvested records
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --from-depth N        current number of levels of shard directories
+                        (default: 0)
+  --from-width N        current number of hex digits in shard directory names
+                        (default: 2)
+  --from-create-subdirs
+                        records are currently in subdirs based on / characters
+                        in identifiers, as harvested with --create-subdirs
+  --from-subdirs-on SUBDIRS
+                        records are currently in subdirs based on occurrences
+                        of the given character in identifiers
+  --depth N             number of levels of shard directories (default: 2)
+  --width N             number of hex digits in shard directory names
+                        (default: 2)
+  -v, --verbose         log debug messages
+  -q, --quiet           only log warnings and errors
+  --log-file PATH       also write log messages to PATH
+  --log-json            log messages as JSON objects, one per line
+  --log-sample N        log only one in every N debug messages about single
+                        records
+
+Records are moved in place; the directory must not be harvested into while
+they are being moved.
+
+Distributed under the terms of the BSD 3-clause License
+<http://opensource.org/licenses/BSD-3-Clause>.
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+from oaiharvest.log import add_logging_arguments, configure_logging
+from oaiharvest.stores.directory_store import DirectoryRecordStore
+
+
+def main(argv=None):
+    """Process command line arguments, move records accordingly."""
+    global argparser
+    args = argparser.parse_args() if argv is None else argparser.parse_args(argv)
+    configure_logging(args)
+    directory = os.path.abspath(args.dir)
+    source = DirectoryRecordStore(
+        directory,
+        createSubDirs=args.fromSubdirs,
+        shardDepth=args.fromDepth,
+        shardWidth=args.fromWidth,
+    )
+    target = DirectoryRecordStore(
+        directory, shardDepth=args.depth, shardWidth=args.width
+    )
+    target.reshard(source)
+    return 0
+
+
+# Set up argument parser
+docbits = __doc__.split("\n\n")
+
+argparser = ArgumentParser(description=docbits[0], epilog="\n\n".join(docbits[-2:]))
+argparser.add_argument("dir", help="directory containing harvested records")
+argparser.add_argument(
+    "--from-depth",
+    dest="fromDepth",
+    type=int,
+    default=0,
+    metavar="N",
+    help="current number of levels of shard directories (default: 0)",
+)
+argparser.add_argument(
+    "--from-width",
+    dest="fromWidth",
+    type=int,
+    default=2,
+    metavar="N",
+    help="current number of hex digits in shard directory names (default: 2)",
+)
+group = argparser.add_mutually_exclusive_group()
+group.set_defaults(fromSubdirs=False)
+group.add_argument(
+    "--from-create-subdirs",
+    action="store_true",
+    dest="fromSubdirs",
+    help=(
+        "records are currently in subdirs based on / characters in "
+        "identifiers, as harvested with --create-subdirs"
+    ),
+)
+group.add_argument(
+    "--from-subdirs-on",
+    dest="fromSubdirs",
+    metavar="SUBDIRS",
+    help=(
+        "records are currently in subdirs based on occurrences of the given "
+        "character in identifiers"
+    ),
+)
+argparser.add_argument(
+    "--depth",
+    dest="depth",
+    type=int,
+    default=2,
+    metavar="N",
+    help="number of levels of shard directories (default: 2)",
+)
+argparser.add_argument(
+    "--width",
+    dest="width",
+    type=int,
+    default=2,
+    metavar="N",
+    help="number of hex digits in shard directory names (default: 2)",
+)
+
+add_logging_arguments(argparser)
+
+if __name__ == "__main__":
+    sys.exit(main())
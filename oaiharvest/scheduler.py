@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Schedule harvests from several providers concurrently.
+
+Providers are grouped by host so that many providers served from the same
+platform do not overload it while other hosts sit idle. Within the limits on
+concurrency, the harvests expected to take longest are started first
+(Longest Processing Time first) to minimise the time until all are complete.
+
+Harvests paused outside of their harvest window free their worker for other
+providers, and are started again when their next window opens.
+"""
+import logging
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from six.moves.urllib.parse import urlparse
+
+from oaiharvest.exceptions import HarvestPausedException
+
+
+class HarvestJob(object):
+    """A harvest from a single provider waiting to be scheduled.
+
+    ``name`` => provider name (or base URL for unregistered providers)
+    ``url`` => base URL of the provider
+    ``expectedDuration`` => expected duration in seconds, or None if unknown
+    ``failures`` => number of consecutive failed harvests from the provider
+    """
+
+    def __init__(self, name, url, expectedDuration=None, failures=0):
+        self.name = name
+        self.url = url
+        self.host = urlparse(url).hostname or url
+        self.expectedDuration = expectedDuration
+        self.failures = failures
+        #: Local time before which a paused harvest may not be started again
+        self.notBefore = None
+
+    def ready(self, now):
+        """Return whether the job may be started at ``now``."""
+        return self.notBefore is None or self.notBefore <= now
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} {0.name} ({0.host})>".format(self)
+
+
+class HarvestScheduler(object):
+    """Run harvest jobs subject to global and per-host concurrency limits.
+
+    ``maxWorkers`` => maximum number of concurrent harvests
+    ``maxPerHost`` => maximum number of concurrent harvests from any one host
+    """
+
+    def __init__(self, maxWorkers=1, maxPerHost=1):
+        self.maxWorkers = max(1, maxWorkers)
+        self.maxPerHost = max(1, maxPerHost)
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def order(self, jobs):
+        """Return ``jobs`` in the order in which they should be started.
+
+        Longest expected first. Jobs without any history are assumed to be
+        first harvests, which are usually the longest of all. Jobs for
+        providers that have failed recently are started after all others,
+        so that they do not hold up healthy providers.
+        """
+        return sorted(
+            jobs,
+            key=lambda job: (
+                job.failures > 0,
+                job.expectedDuration is not None,
+                -(job.expectedDuration or 0),
+            ),
+        )
+
+    def run(self, jobs, func):
+        """Call ``func(job)`` for each of ``jobs``, return dict of results.
+
+        Results are keyed by job name. The result for a job that raised an
+        exception is None. A job that raises ``HarvestPausedException`` is
+        called again once its ``resumeAt`` time has passed.
+        """
+        pending = self.order(jobs)
+        running = {}
+        perHost = Counter()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            while pending or running:
+                now = datetime.now()
+                for job in list(pending):
+                    if len(running) >= self.maxWorkers:
+                        break
+                    if perHost[job.host] >= self.maxPerHost or not job.ready(now):
+                        continue
+                    pending.remove(job)
+                    perHost[job.host] += 1
+                    self.logger.debug("Starting %r", job)
+                    running[executor.submit(func, job)] = job
+                resumeAt = min(
+                    (job.notBefore for job in pending if not job.ready(now)),
+                    default=None,
+                )
+                if not running:
+                    # Only paused jobs left; nothing to do until one resumes
+                    self.logger.info("All harvests paused until %s", resumeAt)
+                    time.sleep(max(0, (resumeAt - datetime.now()).total_seconds()))
+                    continue
+                timeout = None
+                if resumeAt is not None:
+                    timeout = max(0, (resumeAt - datetime.now()).total_seconds())
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    perHost[job.host] -= 1
+                    try:
+                        results[job.name] = future.result()
+                    except HarvestPausedException as e:
+                        self.logger.debug("Deferring %r until %s", job, e.resumeAt)
+                        job.notBefore = e.resumeAt
+                        pending.append(job)
+                    except Exception as e:
+                        self.logger.error(str(e), exc_info=True)
+                        results[job.name] = None
+        return results
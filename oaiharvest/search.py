@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Search the full text of harvested records.
+
+usage: oai-harvest search [-h] --index PATH [--provider PROVIDER]
+                          [-p METADATAPREFIX] [-l LIMIT] [--json] [-v | -q]
+                          [--log-file PATH] [--log-json] [--log-sample N]
+                          query
+
+Harvests given ``--index PATH`` keep a full-text index of the records that
+they write and delete in a SQLite database at PATH, updated after each page
+of records, so that it is always as current as the harvested records. The
+query is in the syntax of SQLite FTS5, e.g. "dark matter", dark AND matter,
+dark NOT matter or dark*. Results are listed best first, with the provider,
+identifier, metadataPrefix and datestamp of each record, and a snippet of
+its text.
+"""
+import json
+import logging
+import os
+import sqlite3
+from argparse import ArgumentParser
+
+from lxml import etree
+
+from oaiharvest.log import add_logging_arguments, configure_logging
+
+#: Words either side of matches in snippets
+SNIPPET_WORDS = 12
+
+
+class SearchResult(object):
+    """A record found in a ``SearchIndex``.
+
+    ``provider``, ``identifier``, ``metadataPrefix``, ``datestamp`` => of
+    the record
+    ``snippet`` => text of the record around the matched words, which are in
+    [brackets]
+    """
+
+    def __init__(self, provider, identifier, metadataPrefix, datestamp, snippet):
+        self.provider = provider
+        self.identifier = identifier
+        self.metadataPrefix = metadataPrefix
+        self.datestamp = datestamp
+        self.snippet = snippet
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class SearchIndex(object):
+    """Full-text index of harvested records in a SQLite database.
+
+    Records are identified by provider, identifier and metadataPrefix; the
+    text of each is the text of all elements of its metadata. Several
+    harvests may update the same index, each with a connection of its own.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.cxn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        # Let concurrent harvests read while one is updating
+        self.cxn.execute("PRAGMA journal_mode=WAL")
+        with self.cxn:
+            self.cxn.execute(
+                "CREATE TABLE IF NOT EXISTS documents("
+                "id INTEGER PRIMARY KEY, "
+                "provider TEXT NOT NULL, "
+                "identifier TEXT NOT NULL, "
+                "metadataPrefix TEXT NOT NULL, "
+                "datestamp TEXT, "
+                "UNIQUE (provider, identifier, metadataPrefix))"
+            )
+            # rowid of each text is the id of its document
+            self.cxn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5("
+                "text, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def update(self, provider, changes):
+        """Apply ``changes`` to records from ``provider`` in one transaction.
+
+        ``changes`` => sequence of (identifier, metadataPrefix, datestamp,
+        text) of records written, with ``text`` None for records deleted
+        """
+        with self.cxn:
+            for identifier, metadataPrefix, datestamp, text in changes:
+                row = self.cxn.execute(
+                    "SELECT id FROM documents WHERE provider=? AND identifier=? "
+                    "AND metadataPrefix=?",
+                    (provider, identifier, metadataPrefix),
+                ).fetchone()
+                if row is not None:
+                    self.cxn.execute("DELETE FROM texts WHERE rowid=?", row)
+                    if text is None:
+                        self.cxn.execute("DELETE FROM documents WHERE id=?", row)
+                        continue
+                    self.cxn.execute(
+                        "UPDATE documents SET datestamp=? WHERE id=?",
+                        (datestamp, row[0]),
+                    )
+                    docid = row[0]
+                elif text is None:
+                    continue
+                else:
+                    docid = self.cxn.execute(
+                        "INSERT INTO documents(provider, identifier, "
+                        "metadataPrefix, datestamp) VALUES (?, ?, ?, ?)",
+                        (provider, identifier, metadataPrefix, datestamp),
+                    ).lastrowid
+                self.cxn.execute(
+                    "INSERT INTO texts(rowid, text) VALUES (?, ?)", (docid, text)
+                )
+
+    def search(self, query, provider=None, metadataPrefix=None, limit=20):
+        """Return list of ``SearchResult``s matching ``query``, best first.
+
+        ``query`` => full-text query in the syntax of SQLite FTS5
+        """
+        sql = (
+            "SELECT d.provider, d.identifier, d.metadataPrefix, d.datestamp, "
+            "snippet(texts, 0, '[', ']', '...', ?) "
+            "FROM texts JOIN documents d ON d.id=texts.rowid WHERE texts MATCH ?"
+        )
+        params = [SNIPPET_WORDS, query]
+        if provider is not None:
+            sql += " AND d.provider=?"
+            params.append(provider)
+        if metadataPrefix is not None:
+            sql += " AND d.metadataPrefix=?"
+            params.append(metadataPrefix)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        return [SearchResult(*row) for row in self.cxn.execute(sql, params)]
+
+    def count(self, provider=None):
+        """Return number of records in the index, from ``provider`` if given."""
+        if provider is None:
+            return self.cxn.execute("SELECT count(*) FROM documents").fetchone()[0]
+        return self.cxn.execute(
+            "SELECT count(*) FROM documents WHERE provider=?", (provider,)
+        ).fetchone()[0]
+
+    def close(self):
+        self.cxn.close()
+
+
+def record_text(metadata):
+    """Return the text of all elements of the XML ``metadata`` of a record."""
+    if not metadata:
+        return ""
+    if not isinstance(metadata, bytes):
+        metadata = metadata.encode("utf-8")
+    try:
+        tree = etree.fromstring(metadata)
+    except etree.XMLSyntaxError:
+        # Index what there is, markup and all
+        return metadata.decode("utf-8")
+    return " ".join(text.strip() for text in tree.itertext() if text.strip())
+
+
+def main(argv):
+    """Search the index given in ``argv``, printing the results."""
+    args = argparser.parse_args(argv)
+    configure_logging(args)
+    if not os.path.exists(args.index):
+        argparser.error("No index at {0}".format(args.index))
+    index = SearchIndex(args.index)
+    try:
+        try:
+            results = index.search(
+                args.query,
+                provider=args.provider,
+                metadataPrefix=args.metadataPrefix,
+                limit=args.limit,
+            )
+        except sqlite3.OperationalError as e:
+            argparser.error("Invalid query {0!r}: {1}".format(args.query, e))
+        for result in results:
+            if args.json:
+                print(json.dumps(result.as_dict()))
+            else:
+                print(
+                    "{0.provider}\t{0.identifier}\t{0.metadataPrefix}\t"
+                    "{0.datestamp}\n    {0.snippet}".format(result)
+                )
+    finally:
+        index.close()
+    return 0 if results else 1
+
+
+docbits = __doc__.split("\n\n")
+
+argparser = ArgumentParser(
+    prog="oai-harvest search",
+    description=docbits[0],
+    epilog=docbits[-1],
+)
+argparser.add_argument(
+    "--index",
+    required=True,
+    metavar="PATH",
+    help="SQLite database of the index, as given to harvests",
+)
+argparser.add_argument(
+    "--provider",
+    help="search only records from this provider",
+)
+argparser.add_argument(
+    "-p",
+    "--metadataPrefix",
+    dest="metadataPrefix",
+    help="search only records in this format",
+)
+argparser.add_argument(
+    "-l",
+    "--limit",
+    dest="limit",
+    type=int,
+    default=20,
+    help="maximum number of results (default: 20)",
+)
+argparser.add_argument(
+    "--json",
+    action="store_true",
+    default=False,
+    help="print each result as a line of JSON",
+)
+add_logging_arguments(argparser)
+argparser.add_argument("query", help="full-text query")
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Harvest records from within other programs.
+
+A :class:`HarvestSession` holds the settings for harvesting, and harvests
+records into a store, returning :class:`HarvestStats`, or iterates over
+them, e.g.::
+
+    session = HarvestSession(stallTimeout=300)
+    stats = session.harvest("https://oai.example.com", "/data/example")
+    for record in session.records("https://oai.example.com", set="theses"):
+        ...
+
+Sessions share no mutable state with each other or with the command line
+tools: each harvest has its own client, harvester and progress counter, so
+a session may be used for many harvests at once, sharing only its
+``responseCache``, which serializes their use of its database, in threads
+or, through
+:meth:`HarvestSession.harvest_async` and :meth:`HarvestSession.arecords`,
+from ``asyncio`` code.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import NamedTuple, Optional
+
+from oaiharvest.harvesters.base import OAIRecordGetter
+from oaiharvest.harvesters.store_harvester import RecordStoreOAIHarvester
+from oaiharvest.log import ProgressCounter
+from oaiharvest.metadata import DefaultingMetadataRegistry, XMLMetadataReader
+from oaiharvest.stores.directory_store import DirectoryRecordStore
+
+
+class HarvestStats(NamedTuple):
+    """Outcome of a harvest from one provider."""
+
+    #: Base URL of the provider
+    baseUrl: str
+    metadataPrefix: str
+    #: Whether all available records were stored, i.e. no limit was reached
+    completed: bool
+    #: Number of records stored
+    records: int
+    #: Number of records deleted by the provider
+    deleted: int
+    #: Number of pages of records received
+    pages: int
+    #: Time up to which all records have been harvested, e.g. to harvest
+    #: from next time
+    watermark: Optional[datetime]
+    #: UTC time at which the harvest started, as for ``watermark``
+    started: datetime
+    #: Duration of the harvest in seconds
+    duration: float
+
+
+class HarvestSession(object):
+    """Settings for harvesting, and methods to harvest with them.
+
+    ``metadataRegistry`` => ``oaipmh.metadata.MetadataRegistry`` with which
+    to read metadata; default: serialize metadata as XML
+    ``responseCache``, ``bufferLimits``, ``pageParser``, ``archive``,
+    ``stallTimeout``, ``window``, ``respectDeletions`` and ``nRecs`` => as
+    for ``RecordStoreOAIHarvester``
+    ``maxWorkers`` => number of threads in which to run async harvests
+    """
+
+    def __init__(
+        self,
+        metadataRegistry=None,
+        responseCache=None,
+        bufferLimits=None,
+        pageParser=None,
+        archive=None,
+        stallTimeout=None,
+        window=None,
+        respectDeletions=True,
+        nRecs=0,
+        maxWorkers=4,
+    ):
+        if metadataRegistry is None:
+            metadataRegistry = DefaultingMetadataRegistry(
+                defaultReader=XMLMetadataReader()
+            )
+        self.metadataRegistry = metadataRegistry
+        self.responseCache = responseCache
+        self.bufferLimits = bufferLimits
+        self.pageParser = pageParser
+        self.archive = archive
+        self.stallTimeout = stallTimeout
+        self.window = window
+        self.respectDeletions = respectDeletions
+        self.nRecs = nRecs
+        self.maxWorkers = maxWorkers
+        self._executor = None
+
+    def records(self, baseUrl, metadataPrefix="oai_dc", **kwargs):
+        """Generate ``oaiharvest.record.Record``s from ``baseUrl``.
+
+        Deleted records are included, i.e. check ``record.header.isDeleted()``.
+        Keyword args are as for ``get_records``, e.g. ``from_``, ``until``,
+        ``set``, ``resumptionToken`` or ``onPage``.
+        """
+        getter = OAIRecordGetter(
+            self.metadataRegistry,
+            self.responseCache,
+            self.bufferLimits,
+            self.pageParser,
+            self.archive,
+            self.stallTimeout,
+        )
+        return getter.get_records(baseUrl, metadataPrefix, **kwargs)
+
+    def harvest(
+        self,
+        baseUrl,
+        store,
+        metadataPrefix="oai_dc",
+        onCommit=None,
+        callback=None,
+        **kwargs
+    ):
+        """Harvest records from ``baseUrl`` into ``store``, return stats.
+
+        ``store`` => ``oaiharvest.stores.base.RecordStore``, or the path of a
+        directory in which to store records in a ``DirectoryRecordStore``
+        ``onCommit`` => as for ``RecordStoreOAIHarvester.harvest``
+        ``callback`` => called with an ``oaiharvest.log.ProgressCounter``
+        after each page of records
+
+        Other keyword args are as for ``RecordStoreOAIHarvester.harvest``.
+        Exceptions raised while harvesting are not caught, but records that
+        were stored before one was raised are flushed to the store.
+        """
+        ownStore = not hasattr(store, "write")
+        if ownStore:
+            store = DirectoryRecordStore(store)
+        progress = ProgressCounter(baseUrl, callback)
+        harvester = RecordStoreOAIHarvester(
+            self.metadataRegistry,
+            store,
+            respectDeletions=self.respectDeletions,
+            nRecs=self.nRecs,
+            responseCache=self.responseCache,
+            bufferLimits=self.bufferLimits,
+            pageParser=self.pageParser,
+            window=self.window,
+            progress=progress,
+            archive=self.archive,
+            stallTimeout=self.stallTimeout,
+        )
+        started = datetime.utcnow()
+        try:
+            completed = harvester.harvest(
+                baseUrl, metadataPrefix, onCommit=onCommit, **kwargs
+            )
+        finally:
+            if ownStore:
+                store.close()
+        return HarvestStats(
+            baseUrl=baseUrl,
+            metadataPrefix=metadataPrefix,
+            completed=completed,
+            records=progress.records,
+            deleted=progress.deleted,
+            pages=progress.pages,
+            watermark=harvester.watermark,
+            started=started,
+            duration=time.time() - progress.started,
+        )
+
+    async def harvest_async(self, baseUrl, store, metadataPrefix="oai_dc", **kwargs):
+        """Harvest as ``harvest`` in a thread; return stats when complete.
+
+        ``onCommit`` and ``callback`` are called in that thread.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(),
+            lambda: self.harvest(baseUrl, store, metadataPrefix, **kwargs),
+        )
+
+    async def arecords(self, baseUrl, metadataPrefix="oai_dc", batchSize=100, **kwargs):
+        """Generate records as ``records``, fetching them in a thread.
+
+        Records are fetched ``batchSize`` at a time.
+        """
+        loop = asyncio.get_running_loop()
+        records = self.records(baseUrl, metadataPrefix, **kwargs)
+        while True:
+            batch = await loop.run_in_executor(
+                self._get_executor(), lambda: list(islice(records, batchSize))
+            )
+            if not batch:
+                return
+            for record in batch:
+                yield record
+
+    def close(self):
+        """Release the threads used for async harvests."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.maxWorkers)
+        return self._executor
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Document base here."""
+from abc import ABCMeta
+
+import six
+
+from oaiharvest.record import Record
+
+
+@six.add_metaclass(ABCMeta)
+class RecordStore(object):
+    """Abstract Base Class for a store of harvested records.
+
+    Should be sub-classed in order to put records somewhere useful (e.g. files
+    in a directory, a stream read by another process etc.)
+    """
+
+    def write(self, record: Record, metadataPrefix: str):
+        "Store record"
+        raise NotImplementedError(
+            "{0.__class__.__name__} must be sub-classed".format(self)
+        )
+
+    def delete(self, record: Record, metadataPrefix: str):
+        "Remove record"
+        raise NotImplementedError(
+            "{0.__class__.__name__} must be sub-classed".format(self)
+        )
+
+    def end_page(self):
+        "Called once all records of a page have been written or deleted"
+        pass
+
+    def flush(self):
+        "Complete any buffered writes and deletions"
+        pass
+
+    def close(self):
+        "Complete any buffered writes and deletions, release resources"
+        self.flush()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Store record headers and selected metadata fields in columnar files.
+
+Rather than one file per record, each batch of records becomes one Parquet
+or Arrow IPC file in a directory, which may be queried as a dataset, e.g.
+with ``pyarrow.dataset``, DuckDB or Spark, without parsing any XML. Each row
+holds the header of a record (identifier, datestamp, setSpecs and whether
+it was deleted), its metadataPrefix and source, and the values of fields
+extracted from its metadata by XPath. Deleted records are stored as rows
+without fields, so that the latest state of a record is the row with the
+latest datestamp.
+
+Values are collected into a list for each column and converted to Arrow
+arrays a column at a time when each batch is written. Requires ``pyarrow``.
+"""
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from lxml import etree
+
+from oaiharvest.log import DELETE_EVENT, WRITE_EVENT
+from oaiharvest.record import Record
+from oaiharvest.stores.base import RecordStore
+
+#: Namespace prefixes that may be used in field XPaths
+NAMESPACES = {
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "dcterms": "http://purl.org/dc/terms/",
+    "oai_dc": "http://www.openarchives.org/OAI/2.0/oai_dc/",
+}
+
+#: Columns for the header of each record
+HEADER_COLUMNS = (
+    "identifier",
+    "datestamp",
+    "setSpec",
+    "deleted",
+    "metadataPrefix",
+    "source",
+)
+
+#: Fields extracted by default, from Dublin Core metadata
+DC_FIELDS = OrderedDict(
+    ("dc_{0}".format(name), "//dc:{0}".format(name))
+    for name in ("title", "creator", "subject", "date", "type", "identifier")
+)
+
+
+def parse_field(argument):
+    """Parse NAME=XPATH into a tuple, e.g. for argparser options."""
+    name, sep, xpath = argument.partition("=")
+    if not sep or not name or not xpath:
+        raise ValueError("Field must be given as NAME=XPATH")
+    return name, xpath
+
+
+class ColumnarRecordStore(RecordStore):
+    """Store records as rows in batches of Parquet or Arrow IPC files.
+
+    ``directory`` => directory in which to write files; created if necessary
+    ``fields`` => mapping of column names to XPaths of the values to extract
+    from each record's metadata, e.g. ``{"title": "//dc:title"}``; each
+    column holds the list of values found. Names must differ from
+    ``HEADER_COLUMNS``
+    ``format`` => "parquet", or "arrow" for Arrow IPC (Feather) files
+    ``source`` => name of the provider to include with each record, or None
+    ``batchSize`` => number of rows in each file; a smaller file is written
+    whenever the store is flushed
+    ``namespaces`` => namespace prefixes for ``fields``; default
+    ``NAMESPACES``
+    """
+
+    FORMATS = ("parquet", "arrow")
+
+    def __init__(
+        self,
+        directory,
+        fields=DC_FIELDS,
+        format="parquet",
+        source=None,
+        batchSize=100000,
+        namespaces=None,
+    ):
+        if format not in self.FORMATS:
+            raise ValueError("Unsupported columnar format {0!r}".format(format))
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("pyarrow is required to store records in columns")
+        self._pa = pyarrow
+        self.directory = directory
+        self.fields = OrderedDict(fields or ())
+        clashes = set(self.fields) & set(HEADER_COLUMNS)
+        if clashes:
+            raise ValueError(
+                "Field names {0} are used for headers".format(
+                    ", ".join(sorted(clashes))
+                )
+            )
+        self.format = format
+        self.source = source
+        self.batchSize = max(1, batchSize)
+        # Compile XPaths once rather than for every record
+        self._xpaths = [
+            etree.XPath(xpath, namespaces=namespaces or NAMESPACES)
+            for xpath in self.fields.values()
+        ]
+        types = (
+            pyarrow.string(),
+            pyarrow.timestamp("s"),
+            pyarrow.list_(pyarrow.string()),
+            pyarrow.bool_(),
+            pyarrow.string(),
+            pyarrow.string(),
+        )
+        self.schema = pyarrow.schema(
+            list(zip(HEADER_COLUMNS, types))
+            + [(name, pyarrow.list_(pyarrow.string())) for name in self.fields]
+        )
+        self._columns = [[] for name in self.schema.names]
+        # Files from stores of other harvests must not clash
+        self._run = "{0}-{1}".format(
+            datetime.utcnow().strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:8]
+        )
+        self._files = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def write(self, record: Record, metadataPrefix: str):
+        self.logger.debug(
+            "Adding row for %s", record.header.identifier(), extra=WRITE_EVENT
+        )
+        self._append(record, metadataPrefix, self._extract(record.metadata))
+
+    def delete(self, record: Record, metadataPrefix: str):
+        self.logger.debug(
+            "Adding deleted row for %s", record.header.identifier(), extra=DELETE_EVENT
+        )
+        self._append(record, metadataPrefix, [None] * len(self.fields))
+
+    def flush(self):
+        if not self._columns[0]:
+            return
+        pa = self._pa
+        arrays = [
+            pa.array(values, type=field.type)
+            for values, field in zip(self._columns, self.schema)
+        ]
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+        self._columns = [[] for name in self.schema.names]
+        fp = os.path.join(
+            self.directory,
+            "part-{0}-{1:05d}.{2}".format(self._run, self._files, self.format),
+        )
+        # Files appear whole or not at all, for readers of the directory
+        tmp = fp + ".tmp"
+        if self.format == "parquet":
+            import pyarrow.parquet
+
+            pyarrow.parquet.write_table(table, tmp)
+        else:
+            import pyarrow.feather
+
+            pyarrow.feather.write_feather(table, tmp)
+        os.rename(tmp, fp)
+        self._files += 1
+        self.logger.debug("Wrote %d rows to %s", table.num_rows, fp)
+
+    def _append(self, record, metadataPrefix, values):
+        header = record.header
+        row = [
+            header.identifier(),
+            header.datestamp(),
+            list(header.setSpec()),
+            header.isDeleted(),
+            metadataPrefix,
+            self.source,
+        ] + values
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if len(self._columns[0]) >= self.batchSize:
+            self.flush()
+
+    def _extract(self, metadata):
+        """Return list of values of each field in ``metadata``."""
+        if not self._xpaths:
+            return []
+        try:
+            # Metadata may be serialized as several sibling elements
+            root = etree.fromstring(
+                "<metadata>{0}</metadata>".format(metadata).encode("utf-8")
+            )
+        except (etree.XMLSyntaxError, ValueError):
+            self.logger.warning("Unable to parse metadata to extract fields")
+            return [None] * len(self._xpaths)
+        values = []
+        for xpath in self._xpaths:
+            result = xpath(root)
+            if not isinstance(result, list):
+                result = [result]
+            values.append(
+                [value if isinstance(value, str) else _text(value) for value in result]
+            )
+        return values
+
+
+def _text(node):
+    """Return the text content of ``node``, e.g. an element."""
+    if isinstance(node, (bool, float, int)):
+        return str(node)
+    return "".join(node.itertext()).strip()
@@ -1,61 +1,310 @@
 # -*- coding: utf-8 -*-
 """Document directory_store here."""
 import codecs
+import hashlib
 import logging
 import os
 import platform
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from six import string_types
 from six.moves.urllib import parse as urllib
 
+from oaiharvest.log import WRITE_EVENT
 from oaiharvest.record import Record
+from oaiharvest.stores.base import RecordStore
 
 
-class DirectoryRecordStore(object):
-    def __init__(self, directory, createSubDirs=False):
+#: Colons are not allowed in filenames on Windows
+IS_WINDOWS = platform.system() == "Windows"
+
+
+class FilenameQuoter(object):
+    """Percent-encode filenames as ``urllib.quote`` would, but faster.
+
+    ``safe`` => characters not to encode, in addition to letters, digits and
+    ``_.-~``
+
+    The encoding of every ASCII character is looked up once, so that only
+    the few characters in a typical identifier that need encoding are
+    replaced. Filenames with other characters are passed to ``urllib.quote``.
+    """
+
+    def __init__(self, safe=""):
+        self.safe = safe
+        self._table = {}
+        for code in range(128):
+            quoted = urllib.quote(chr(code), safe)
+            if quoted != chr(code):
+                self._table[chr(code)] = quoted
+        self._unsafe = re.compile(
+            "[{0}]".format("".join(re.escape(c) for c in self._table))
+        )
+
+    def __call__(self, filename):
+        try:
+            filename.encode("ascii")
+        except UnicodeEncodeError:
+            return urllib.quote(filename, self.safe)
+        return self._unsafe.sub(self._replace, filename)
+
+    def _replace(self, match):
+        return self._table[match.group()]
+
+
+class DirectoryRecordStore(RecordStore):
+    """Store records as files in a directory.
+
+    ``createSubDirs`` => if True create sub-directories based on / characters
+    in identifiers, if a string then based on occurrences of that string
+    ``shardDepth`` => number of levels of sub-directories, named from a hash
+    of the identifier, in which to spread files (0 for none)
+    ``shardWidth`` => number of hex digits in the name of each shard
+    directory, i.e. each level has at most 16 ** ``shardWidth`` entries
+    ``deleteBatchSize`` => number of deletions to collect before removing
+    the files together; 1 to remove each file as soon as it is deleted
+    ``deleteWorkers`` => number of threads with which to remove a batch
+    ``cacheEntries`` => if True keep a listing of each directory, read when
+    it is first needed, so that deleting a record that was never stored
+    does not touch the filesystem. Only safe while nothing else adds files
+    to the directory.
+    ``journal`` => ``oaiharvest.journal.HarvestJournal`` in which to record
+    every file written or removed, with its previous content, or None
+    """
+
+    def __init__(
+        self,
+        directory,
+        createSubDirs=False,
+        shardDepth=0,
+        shardWidth=2,
+        deleteBatchSize=1,
+        deleteWorkers=1,
+        cacheEntries=False,
+        journal=None,
+    ):
         self.directory = directory
         self.createSubDirs = createSubDirs
+        self.shardDepth = shardDepth
+        self.shardWidth = shardWidth
+        self.deleteBatchSize = max(1, deleteBatchSize)
+        self.deleteWorkers = max(1, deleteWorkers)
+        self.cacheEntries = cacheEntries
+        self.journal = journal
+        # Paths of files to remove in the next batch, in order of deletion
+        self._deletions = OrderedDict()
+        # Names of the entries in each directory listed so far
+        self._entries = {}
+        # Threads removing files, started with the first batch to need them
+        self._executor = None
+        #: Number of files removed and of deletions with no file to remove
+        self.deleted = 0
+        self.missing = 0
         self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        # Work out how to map identifiers to paths once, not for every record
+        protected = []
+        if not IS_WINDOWS:
+            protected.append(":")
+        self._subdirSeparator = None
+        if createSubDirs and not shardDepth:
+            if isinstance(createSubDirs, string_types):
+                # Replace specified character with platform path separator
+                self._subdirSeparator = createSubDirs
+            # Do not escape path separators, so that sub-directories
+            # can be created
+            protected.append(os.path.sep)
+        self._quote = FilenameQuoter("".join(protected))
+        # Directory with trailing separator, so that paths can be concatenated
+        self._prefix = os.path.join(directory, "")
+        self._shardSlices = [
+            slice(i * shardWidth, (i + 1) * shardWidth) for i in range(shardDepth)
+        ]
 
     def write(self, record: Record, metadataPrefix: str):
         fp = self._get_output_filepath(record.header, metadataPrefix)
+        # Record was deleted and stored again since the last batch
+        self._deletions.pop(fp, None)
         self._ensure_dir_exists(fp)
-        self.logger.debug("Writing to file {0}".format(fp))
+        if self.journal is not None:
+            self.journal.write(self.directory, fp[len(self._prefix) :], record.metadata)
+        self.logger.debug("Writing to file %s", fp, extra=WRITE_EVENT)
         with codecs.open(fp, "w", encoding="utf-8") as fh:
             fh.write(record.metadata)
+        if self.cacheEntries:
+            dirpath, filename = os.path.split(fp)
+            if dirpath in self._entries:
+                self._entries[dirpath].add(filename)
 
     def delete(self, record: Record, metadataPrefix: str):
         fp = self._get_output_filepath(record.header, metadataPrefix)
+        self._deletions[fp] = None
+        if len(self._deletions) >= self.deleteBatchSize:
+            self._delete_batch()
+
+    def flush(self):
+        "Remove the files of any deletions collected for the next batch"
+        if self._deletions:
+            self._delete_batch()
+        if self.journal is not None:
+            self.journal.flush()
+        if self.deleted or self.missing:
+            self.logger.info(
+                "Deleted %d files; %d deleted records had no file",
+                self.deleted,
+                self.missing,
+            )
+            self.deleted = self.missing = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _delete_batch(self):
+        """Remove the files of the deletions collected so far."""
+        filepaths = list(self._deletions)
+        self._deletions.clear()
+        if self.cacheEntries:
+            present = [fp for fp in filepaths if self._is_listed(fp)]
+            self.missing += len(filepaths) - len(present)
+            filepaths = present
+            if not filepaths:
+                return
+        if self.journal is not None:
+            for fp in filepaths:
+                self.journal.delete(self.directory, fp[len(self._prefix) :])
+        if self.deleteWorkers > 1 and len(filepaths) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.deleteWorkers)
+            removed = list(self._executor.map(self._remove, filepaths))
+        else:
+            removed = [self._remove(fp) for fp in filepaths]
+        for fp, ok in zip(filepaths, removed):
+            if ok:
+                self.deleted += 1
+            else:
+                self.missing += 1
+            if self.cacheEntries:
+                dirpath, filename = os.path.split(fp)
+                self._entries[dirpath].discard(filename)
+        self.logger.debug(
+            "Removed %d of %d files in batch", removed.count(True), len(removed)
+        )
+
+    def _remove(self, fp):
+        """Remove file ``fp``, return whether it existed."""
         try:
             os.remove(fp)
         except OSError:
-            # File probably does't exist in destination directory
+            # File probably doesn't exist in destination directory
             # No further action needed
-            self.logger.debug("")
-            pass
+            return False
+        return True
 
-    def _get_output_filepath(self, header, metadataPrefix):
-        filename = "{0}.{1}.xml".format(header.identifier(), metadataPrefix)
+    def _is_listed(self, fp):
+        """Return whether ``fp`` is in the cached listing of its directory."""
+        dirpath, filename = os.path.split(fp)
+        entries = self._entries.get(dirpath)
+        if entries is None:
+            try:
+                entries = set(os.listdir(dirpath))
+            except OSError:
+                # Directory doesn't exist (yet)
+                entries = set()
+            self._entries[dirpath] = entries
+        return filename in entries
 
-        protected = []
-        if platform.system() != "Windows":
-            protected.append(":")
+    def reshard(self, source):
+        """Move records stored in the layout of ``source`` into this layout.
 
-        if self.createSubDirs:
-            if isinstance(self.createSubDirs, string_types):
-                # Replace specified character with platform path separator
-                filename = filename.replace(self.createSubDirs, os.path.sep)
+        ``source`` => ``DirectoryRecordStore`` describing the current layout of
+        files in the same directory, e.g. without sharding
 
-            # Do not escape path separators, so that sub-directories
-            # can be created
-            protected.append(os.path.sep)
+        Return the number of files moved.
+        """
+        # List files before moving any, so that none are visited twice
+        filepaths = list(source.iter_filepaths())
+        moved = 0
+        # Directories that files were moved out of
+        vacated = set()
+        for fp in filepaths:
+            identifier, metadataPrefix = source.parse_filepath(fp)
+            newfp = self.get_filepath(identifier, metadataPrefix)
+            if newfp == fp:
+                continue
+            self._ensure_dir_exists(newfp)
+            os.rename(fp, newfp)
+            vacated.add(os.path.dirname(fp))
+            moved += 1
+        # Remove those directories, and their parents, emptied by moving files
+        for dirpath in sorted(vacated, key=len, reverse=True):
+            while dirpath.startswith(self._prefix) and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+                dirpath = os.path.dirname(dirpath)
+        self.logger.info("Moved {0} of {1} files".format(moved, len(filepaths)))
+        return moved
 
-        filename = urllib.quote(filename, "".join(protected))
-        fp = os.path.join(self.directory, filename)
-        return fp
+    def iter_filepaths(self):
+        """Generate paths of all record files in the store."""
+        if not (self.createSubDirs or self.shardDepth):
+            for filename in os.listdir(self.directory):
+                if filename.endswith(".xml"):
+                    yield os.path.join(self.directory, filename)
+            return
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".xml"):
+                    yield os.path.join(dirpath, filename)
+
+    def _get_output_filepath(self, header, metadataPrefix):
+        return self.get_filepath(header.identifier(), metadataPrefix)
+
+    def get_filepath(self, identifier, metadataPrefix):
+        """Return the path of the file for a record in this layout."""
+        filename = "{0}.{1}.xml".format(identifier, metadataPrefix)
+        if self._subdirSeparator is not None:
+            filename = filename.replace(self._subdirSeparator, os.path.sep)
+        filename = self._quote(filename)
+        if not self._shardSlices:
+            return self._prefix + filename
+        shards = self._get_shards(identifier)
+        return self._prefix + os.path.sep.join(shards) + os.path.sep + filename
+
+    def _get_shards(self, identifier):
+        """Return list of shard directory names for ``identifier``."""
+        if not self._shardSlices:
+            return []
+        digest = hashlib.md5(identifier.encode("utf-8")).hexdigest()
+        return [digest[s] for s in self._shardSlices]
+
+    def parse_filepath(self, fp):
+        """Return the identifier and metadataPrefix stored at ``fp``."""
+        parts = os.path.relpath(fp, self.directory).split(os.path.sep)
+        parts = parts[self.shardDepth :]
+        if self.createSubDirs and not self.shardDepth:
+            if isinstance(self.createSubDirs, string_types):
+                separator = self.createSubDirs
+            else:
+                separator = "/"
+            filename = separator.join(urllib.unquote(part) for part in parts)
+        else:
+            filename = urllib.unquote(os.path.sep.join(parts))
+        identifier, metadataPrefix, ext = filename.rsplit(".", 2)
+        return identifier, metadataPrefix
 
     def _ensure_dir_exists(self, fp):
         if not os.path.isdir(os.path.dirname(fp)):
             # Missing base directory or sub-directory
-            self.logger.debug("Creating target directory {0}".format(self.directory))
-            os.makedirs(os.path.dirname(fp))
+            self.logger.debug("Creating target directory %s", self.directory)
+            try:
+                os.makedirs(os.path.dirname(fp))
+            except OSError:
+                # Created by another harvest of the same provider
+                if not os.path.isdir(os.path.dirname(fp)):
+                    raise
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Keep a full-text index of the records written to another store."""
+from oaipmh.datestamp import datetime_to_datestamp
+
+from oaiharvest.record import Record
+from oaiharvest.search import SearchIndex, record_text
+from oaiharvest.stores.base import RecordStore
+
+
+class IndexedRecordStore(RecordStore):
+    """Write records to ``store``, and update a full-text index of them.
+
+    ``store`` => ``RecordStore`` to which to write and delete records
+    ``index`` => ``oaiharvest.search.SearchIndex``, or the path of one,
+    which is closed with this store
+    ``provider`` => name of the provider of the records
+
+    Changes to the index are collected for each page of records, and made
+    in a single transaction at the end of the page, or when flushed.
+    """
+
+    def __init__(self, store, index, provider):
+        self.store = store
+        if not isinstance(index, SearchIndex):
+            index = SearchIndex(index)
+        self.index = index
+        self.provider = provider
+        self._changes = []
+
+    def write(self, record: Record, metadataPrefix: str):
+        self.store.write(record, metadataPrefix)
+        datestamp = record.header.datestamp()
+        if datestamp is not None:
+            datestamp = datetime_to_datestamp(datestamp)
+        self._changes.append(
+            (
+                record.header.identifier(),
+                metadataPrefix,
+                datestamp,
+                record_text(record.metadata),
+            )
+        )
+
+    def delete(self, record: Record, metadataPrefix: str):
+        self.store.delete(record, metadataPrefix)
+        self._changes.append((record.header.identifier(), metadataPrefix, None, None))
+
+    def end_page(self):
+        self.store.end_page()
+        self._commit()
+
+    def flush(self):
+        self.store.flush()
+        self._commit()
+
+    def close(self):
+        try:
+            try:
+                self.store.close()
+            finally:
+                # Records already written are indexed even if closing fails
+                self._commit()
+        finally:
+            self.index.close()
+
+    def _commit(self):
+        if self._changes:
+            changes, self._changes = self._changes, []
+            self.index.update(self.provider, changes)
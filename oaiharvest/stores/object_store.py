@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Store records as objects in S3 compatible object storage.
+
+Records are uploaded by a pool of threads so that the harvest only waits
+when the limit on requests in flight is reached. Deletions are collected
+into batches and sent as multi-object delete requests. Failed requests are
+retried with exponential back-off; a request that still fails is reported
+when the store is flushed, so that a harvest window is not committed with
+records missing.
+
+The store talks to object storage through a small client interface,
+implemented by :class:`Boto3ObjectClient` for S3 and compatible services
+such as MinIO (requires ``boto3``), and by :class:`LocalObjectClient`, which
+keeps objects as files in a local directory, e.g. for testing.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from six.moves.urllib.parse import urlparse
+
+from oaiharvest.log import DELETE_EVENT, WRITE_EVENT
+from oaiharvest.record import Record
+from oaiharvest.stores.base import RecordStore
+from oaiharvest.stores.directory_store import FilenameQuoter
+
+#: Maximum number of keys in an S3 multi-object delete request
+MAX_DELETE_BATCH = 1000
+
+#: Characters not encoded in object keys, whatever the harvesting platform
+KEY_SAFE = ":"
+
+
+class Boto3ObjectClient(object):
+    """Client for a bucket in S3 or a compatible service, using ``boto3``.
+
+    ``bucket`` => name of the bucket
+    ``endpointUrl`` => URL of an S3 compatible service, or None for AWS
+    ``maxConnections`` => size of the pool of connections shared by threads
+    """
+
+    def __init__(self, bucket, endpointUrl=None, maxConnections=10):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImportError("boto3 is required to store records in S3")
+        self.bucket = bucket
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpointUrl,
+            config=Config(max_pool_connections=maxConnections),
+        )
+
+    def put_object(self, key, body):
+        self._client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType="application/xml; charset=utf-8",
+        )
+
+    def delete_objects(self, keys):
+        response = self._client.delete_objects(
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+        errors = response.get("Errors")
+        if errors:
+            raise IOError(
+                "Failed to delete {0} objects, e.g. {1[Key]}: {1[Message]}".format(
+                    len(errors), errors[0]
+                )
+            )
+
+    def get_object(self, key):
+        """Return the body of object ``key``, or None if there is none."""
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=key)
+        except self._client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def list_keys(self, prefix=""):
+        """Generate the keys of all objects starting with ``prefix``."""
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", ()):
+                yield obj["Key"]
+
+
+class LocalObjectClient(object):
+    """Stand-in for object storage, keeping objects as files in a directory.
+
+    Keys containing / are stored in sub-directories, as S3 compatible
+    gateways to filesystems do.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put_object(self, key, body):
+        fp = self._path(key)
+        if not os.path.isdir(os.path.dirname(fp)):
+            try:
+                os.makedirs(os.path.dirname(fp))
+            except OSError:
+                # Created by another thread
+                if not os.path.isdir(os.path.dirname(fp)):
+                    raise
+        # Objects appear whole or not at all
+        tmp = "{0}.{1}.tmp".format(fp, threading.current_thread().ident)
+        with open(tmp, "wb") as fh:
+            fh.write(body)
+        os.rename(tmp, fp)
+
+    def delete_objects(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                # Deleting a missing object is not an error
+                pass
+
+    def get_object(self, key):
+        try:
+            with open(self._path(key), "rb") as fh:
+                return fh.read()
+        except (IOError, OSError):
+            return None
+
+    def list_keys(self, prefix=""):
+        # Only the directory of the prefix can hold matching keys
+        top = os.path.join(self.directory, *prefix.split("/")[:-1])
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            relpath = os.path.relpath(dirpath, self.directory)
+            parts = [] if relpath == os.curdir else relpath.split(os.path.sep)
+            for filename in sorted(filenames):
+                if filename.endswith(".tmp"):
+                    # Object still being written
+                    continue
+                key = "/".join(parts + [filename])
+                if key.startswith(prefix):
+                    yield key
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split("/"))
+
+
+def object_client(url, endpointUrl=None, maxConnections=10):
+    """Return client and key prefix for the object storage at ``url``.
+
+    ``url`` => s3://bucket/prefix for S3 or a compatible service at
+    ``endpointUrl``, or file:///prefix for a ``LocalObjectClient``, whose
+    keys then start with the path of the directory of the objects. As for a
+    bucket, file://directory/prefix names a directory of objects relative
+    to the working directory.
+    """
+    parsed = urlparse(url)
+    prefix = parsed.path.lstrip("/")
+    if parsed.scheme == "s3":
+        client = Boto3ObjectClient(parsed.netloc, endpointUrl, maxConnections)
+    elif parsed.scheme == "file":
+        client = LocalObjectClient(os.path.abspath(parsed.netloc or os.sep))
+    else:
+        raise ValueError("Unsupported object store URL {0}".format(url))
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    return client, prefix
+
+
+class ObjectRecordStore(RecordStore):
+    """Store records as objects, named as ``DirectoryRecordStore`` files are.
+
+    ``client`` => object storage client, e.g. ``Boto3ObjectClient``
+    ``prefix`` => prefix for the keys of all objects, e.g. "provider/"
+    ``maxInFlight`` => maximum number of requests sent or waiting to be sent
+    at once; writing waits when this is reached
+    ``maxRetries`` => number of times to retry a failed request
+    ``deleteBatchSize`` => number of deletions to send in each request
+    ``backoff`` => seconds to wait before the first retry, doubled for each
+    subsequent one
+    """
+
+    def __init__(
+        self,
+        client,
+        prefix="",
+        maxInFlight=16,
+        maxRetries=3,
+        deleteBatchSize=MAX_DELETE_BATCH,
+        backoff=0.5,
+    ):
+        self.client = client
+        self.prefix = prefix
+        self.maxInFlight = max(1, maxInFlight)
+        self.maxRetries = maxRetries
+        self.deleteBatchSize = max(1, min(deleteBatchSize, MAX_DELETE_BATCH))
+        self.backoff = backoff
+        self._quote = FilenameQuoter(KEY_SAFE)
+        self._executor = ThreadPoolExecutor(max_workers=self.maxInFlight)
+        self._slots = threading.BoundedSemaphore(self.maxInFlight)
+        # Latest request for each key, so requests for a key stay in order
+        self._pending = {}
+        # Keys to delete in the next batch, in order of deletion
+        self._deletions = OrderedDict()
+        self._errors = []
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def write(self, record: Record, metadataPrefix: str):
+        key = self._get_key(record.header, metadataPrefix)
+        # Stored again before the deletion was sent
+        self._deletions.pop(key, None)
+        body = record.metadata.encode("utf-8")
+        self.logger.debug("Uploading object %s", key, extra=WRITE_EVENT)
+        self._submit([key], self.client.put_object, key, body)
+
+    def delete(self, record: Record, metadataPrefix: str):
+        key = self._get_key(record.header, metadataPrefix)
+        self.logger.debug("Deleting object %s", key, extra=DELETE_EVENT)
+        self._deletions[key] = None
+        if len(self._deletions) >= self.deleteBatchSize:
+            self._send_deletions()
+
+    def flush(self):
+        """Wait for all requests to complete, raise if any failed."""
+        if self._deletions:
+            self._send_deletions()
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception()
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise IOError(
+                "{0} object storage requests failed, e.g. {1}".format(
+                    len(errors), errors[0]
+                )
+            )
+
+    def close(self):
+        """Complete outstanding requests and release the pool of threads."""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+    def _get_key(self, header, metadataPrefix):
+        return "{0}{1}".format(
+            self.prefix,
+            self._quote("{0}.{1}.xml".format(header.identifier(), metadataPrefix)),
+        )
+
+    def _send_deletions(self):
+        keys = list(self._deletions)
+        self._deletions.clear()
+        self._submit(keys, self.client.delete_objects, keys)
+
+    def _submit(self, keys, func, *args):
+        """Send request ``func(*args)`` affecting ``keys`` from the pool."""
+        # Wait for a free slot so that memory and connections stay bounded
+        self._slots.acquire()
+        with self._lock:
+            previous = set(self._pending[key] for key in keys if key in self._pending)
+            future = self._executor.submit(self._request, previous, func, *args)
+            for key in keys:
+                self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(keys, f))
+
+    def _request(self, previous, func, *args):
+        # Earlier requests for the same keys were submitted first, so are
+        # already running; wait for them rather than overtake them
+        for future in previous:
+            future.exception()
+        for attempt in range(self.maxRetries + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == self.maxRetries:
+                    raise
+                delay = self.backoff * 2**attempt
+                self.logger.warning(
+                    "Object storage request failed (%s); retrying in %.1fs", e, delay
+                )
+                time.sleep(delay)
+
+    def _done(self, keys, future):
+        with self._lock:
+            for key in keys:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+            error = future.exception()
+            if error is not None:
+                self._errors.append(error)
+        self._slots.release()
@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""Read harvested records back from any of the stores that they are written to.
+
+Each backend is read through the same ``RecordReader`` interface: iterate
+over the stored records, optionally only those with datestamps in a range
+or in a set, one at a time or in batches, or look one up by identifier.
+``open_reader`` returns the reader for a directory, stream file, directory
+of columnar files or object storage URL.
+
+Records are returned as ``StoredRecord`` objects, with a pyoai header like
+harvested records. Their metadata is only read and decoded when it is
+used. Stream files are memory-mapped, and the ``raw`` bytes of each record
+are a ``memoryview`` of the map, so that scanning, filtering and looking up
+records does not copy them; views are valid until the reader is closed.
+Arrow IPC files are memory-mapped too, and Parquet files are read through a
+memory map.
+
+Streams and columnar files are logs of writes and deletions, so their
+readers return only the latest version of each record, skipping records
+that were deleted. Directories and object storage only hold current
+records, and do not keep datestamps or sets, so they cannot be filtered by
+them.
+"""
+import json
+import mmap
+import os
+import re
+from abc import ABCMeta
+from datetime import datetime
+from xml.sax.saxutils import unescape
+
+import six
+from oaipmh.common import Header
+from oaipmh.datestamp import datestamp_to_datetime
+from six.moves.urllib import parse as urllib
+
+from oaiharvest.record import Record
+from oaiharvest.stores.columnar_store import HEADER_COLUMNS
+from oaiharvest.stores.directory_store import DirectoryRecordStore, FilenameQuoter
+from oaiharvest.stores.object_store import KEY_SAFE, object_client
+
+#: Attributes of the start tag of a record in an XML stream
+_ATTRIBUTE_RE = re.compile(rb"""([\w:]+)=(?:"([^"]*)"|'([^']*)')""")
+
+#: Entities escaped by ``xml.sax.saxutils.quoteattr`` beyond the usual
+_ATTRIBUTE_ENTITIES = {"&quot;": '"', "&#10;": "\n", "&#13;": "\r", "&#9;": "\t"}
+
+#: Separator before the metadata of a record in a JSON stream, written last
+_JSON_METADATA = b', "metadata": '
+
+_RECORD_END = b"</record>"
+
+
+class StoredRecord(Record):
+    """A record read from a store.
+
+    ``header`` => pyoai ``Header``; its datestamp is None, and setSpec
+    empty, for stores that do not keep them
+    ``metadataPrefix`` => metadataPrefix in which the record was harvested
+    ``raw`` => bytes or ``memoryview`` of the record as stored, or a
+    callable that returns them, to read them only when needed
+    ``decode`` => callable that returns the metadata from ``raw``; default
+    decode ``raw`` as UTF-8
+    ``source`` => name of the provider, if stored
+    ``fields`` => dictionary of fields extracted from the metadata, for
+    columnar stores
+    """
+
+    def __init__(
+        self, header, metadataPrefix, raw=None, decode=None, source=None, fields=None
+    ):
+        self.header = header
+        self.about = None
+        self.metadataPrefix = metadataPrefix
+        self.source = source
+        self.fields = fields
+        self._raw = raw
+        self._decode = decode
+        self._metadata = None
+
+    @property
+    def raw(self):
+        if callable(self._raw):
+            self._raw = self._raw()
+        return self._raw
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            raw = self.raw
+            if raw is None:
+                return None
+            if self._decode is not None:
+                self._metadata = self._decode(raw)
+            else:
+                self._metadata = bytes(raw).decode("utf-8")
+        return self._metadata
+
+    def __repr__(self):
+        return "<{0} {1} {2}>".format(
+            self.__class__.__name__, self.header.identifier(), self.metadataPrefix
+        )
+
+
+@six.add_metaclass(ABCMeta)
+class RecordReader(object):
+    """Abstract Base Class for reading records from a store.
+
+    Should be sub-classed for each kind of store, implementing ``_records``
+    and ``get``.
+    """
+
+    #: Whether the store keeps datestamps and sets, to filter records by
+    filterable = True
+
+    def iter_records(self, from_=None, until=None, set=None):
+        """Generate records, optionally filtered.
+
+        ``from_``, ``until`` => only records with datestamps from and/or
+        until these ``datetime`` objects, inclusive
+        ``set`` => only records in this set, or any set below it in the
+        hierarchy of sets
+        """
+        if not self.filterable and (from_, until, set) != (None, None, None):
+            raise ValueError(
+                "{0.__class__.__name__} cannot filter records; the store does "
+                "not keep datestamps or sets".format(self)
+            )
+        for record in self._records():
+            if _matches(record.header, from_, until, set):
+                yield record
+
+    def iter_batches(self, batchSize=1000, from_=None, until=None, set=None):
+        """Generate lists of up to ``batchSize`` records, optionally filtered.
+
+        Filters are as for ``iter_records``.
+        """
+        batch = []
+        for record in self.iter_records(from_, until, set):
+            batch.append(record)
+            if len(batch) >= batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get(self, identifier, metadataPrefix="oai_dc"):
+        """Return the record with ``identifier``, or None if not stored."""
+        raise NotImplementedError(
+            "{0.__class__.__name__} must be sub-classed".format(self)
+        )
+
+    def close(self):
+        "Release resources, e.g. memory maps"
+        pass
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _records(self):
+        "Generate all current records"
+        raise NotImplementedError(
+            "{0.__class__.__name__} must be sub-classed".format(self)
+        )
+
+
+class DirectoryRecordReader(RecordReader):
+    """Read records from files in a directory, as written by
+    ``DirectoryRecordStore`` with the same layout arguments.
+    """
+
+    filterable = False
+
+    def __init__(self, directory, createSubDirs=False, shardDepth=0, shardWidth=2):
+        self.directory = directory
+        self._layout = DirectoryRecordStore(
+            directory,
+            createSubDirs=createSubDirs,
+            shardDepth=shardDepth,
+            shardWidth=shardWidth,
+        )
+
+    def get(self, identifier, metadataPrefix="oai_dc"):
+        fp = self._layout.get_filepath(identifier, metadataPrefix)
+        if not os.path.isfile(fp):
+            return None
+        return self._record(fp, identifier, metadataPrefix)
+
+    def _records(self):
+        for fp in self._layout.iter_filepaths():
+            identifier, metadataPrefix = self._layout.parse_filepath(fp)
+            yield self._record(fp, identifier, metadataPrefix)
+
+    def _record(self, fp, identifier, metadataPrefix):
+        return StoredRecord(
+            Header(None, identifier, None, [], False),
+            metadataPrefix,
+            raw=lambda: _read_file(fp),
+        )
+
+
+class ObjectRecordReader(RecordReader):
+    """Read records from object storage, as written by ``ObjectRecordStore``.
+
+    ``client`` => object storage client, e.g. ``Boto3ObjectClient``
+    ``prefix`` => prefix of the keys of the objects
+    """
+
+    filterable = False
+
+    def __init__(self, client, prefix=""):
+        self.client = client
+        self.prefix = prefix
+        self._quote = FilenameQuoter(KEY_SAFE)
+
+    def get(self, identifier, metadataPrefix="oai_dc"):
+        key = "{0}{1}".format(
+            self.prefix, self._quote("{0}.{1}.xml".format(identifier, metadataPrefix))
+        )
+        body = self.client.get_object(key)
+        if body is None:
+            return None
+        return StoredRecord(
+            Header(None, identifier, None, [], False), metadataPrefix, raw=body
+        )
+
+    def _records(self):
+        for key in self.client.list_keys(self.prefix):
+            name = key[len(self.prefix) :]
+            if "/" in name or not name.endswith(".xml"):
+                # Not a record stored under this prefix
+                continue
+            identifier, metadataPrefix, ext = urllib.unquote(name).rsplit(".", 2)
+            yield StoredRecord(
+                Header(None, identifier, None, [], False),
+                metadataPrefix,
+                raw=lambda key=key: self.client.get_object(key),
+            )
+
+
+class StreamRecordReader(RecordReader):
+    """Read records from a file written by ``StreamRecordStore``.
+
+    The file is memory-mapped, and indexed by identifier and metadataPrefix
+    the first time that records are read. The format, JSON or XML, is
+    detected from the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._map = b""
+        self._view = memoryview(self._map)
+        self.format = "json" if self._map[:1] == b"{" else "xml"
+        self._index = None
+
+    def get(self, identifier, metadataPrefix="oai_dc"):
+        record = self._get_index().get((identifier, metadataPrefix))
+        if record is None or record.header.isDeleted():
+            return None
+        return record
+
+    def close(self):
+        self._index = None
+        try:
+            self._view.release()
+            if not isinstance(self._map, bytes):
+                self._map.close()
+        except BufferError:
+            # Records still refer to the map; closed when they are released
+            pass
+        self._file.close()
+
+    def _records(self):
+        for record in self._get_index().values():
+            if not record.header.isDeleted():
+                yield record
+
+    def _get_index(self):
+        """Return dictionary of the latest version of each record.
+
+        Keyed by identifier and metadataPrefix, in the order in which the
+        latest versions were written.
+        """
+        if self._index is None:
+            scan = self._scan_json if self.format == "json" else self._scan_xml
+            index = {}
+            for record in scan():
+                key = (record.header.identifier(), record.metadataPrefix)
+                # Move to the end, with its latest version
+                index.pop(key, None)
+                index[key] = record
+            self._index = index
+        return self._index
+
+    def _scan_json(self):
+        data = self._map
+        pos, end = 0, len(data)
+        while pos < end:
+            eol = data.find(b"\n", pos)
+            if eol < 0:
+                eol = end
+            # Parse the header without the metadata, which is written last
+            split = data.find(_JSON_METADATA, pos, eol)
+            if split < 0:
+                obj = json.loads(data[pos:eol])
+            else:
+                obj = json.loads(data[pos:split] + b"}")
+            deleted = obj["event"] == "delete"
+            yield StoredRecord(
+                _header(obj["identifier"], obj["datestamp"], obj["setSpec"], deleted),
+                obj["metadataPrefix"],
+                raw=None if deleted else self._view[pos:eol],
+                decode=_json_metadata,
+                source=obj.get("source"),
+            )
+            pos = eol + 1
+
+    def _scan_xml(self):
+        data = self._map
+        pos, end = 0, len(data)
+        while pos < end:
+            eol = data.find(b"\n", pos)
+            start = eol + 1
+            stop = start + int(data[pos:eol])
+            # Attribute values are escaped, so the first > ends the start tag
+            tagEnd = data.find(b">", start, stop)
+            attrs = dict(
+                (
+                    name.decode("utf-8"),
+                    unescape((a or b).decode("utf-8"), _ATTRIBUTE_ENTITIES),
+                )
+                for name, a, b in _ATTRIBUTE_RE.findall(data[start:tagEnd])
+            )
+            deleted = attrs.get("status") == "deleted"
+            yield StoredRecord(
+                _header(
+                    attrs["identifier"],
+                    attrs.get("datestamp"),
+                    attrs.get("setSpec", "").split(),
+                    deleted,
+                ),
+                attrs.get("metadataPrefix"),
+                raw=None
+                if deleted
+                else self._view[tagEnd + 1 : stop - len(_RECORD_END)],
+                source=attrs.get("source"),
+            )
+            # Each record is followed by a newline
+            pos = stop + 1
+
+
+class ColumnarRecordReader(RecordReader):
+    """Read records from files written by ``ColumnarRecordStore``.
+
+    Records have the extracted ``fields`` but no metadata. Files are read in
+    the order in which they were written, a batch of ``batchSize`` rows at a
+    time. Requires ``pyarrow``.
+    """
+
+    def __init__(self, directory, batchSize=10000):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("pyarrow is required to read records from columns")
+        self._pa = pyarrow
+        self.directory = directory
+        self.batchSize = batchSize
+        # Names of files start with the time of their run, then a sequence
+        self.paths = [
+            os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory))
+            if filename.startswith("part-")
+            and filename.endswith((".parquet", ".arrow"))
+        ]
+        self._index = None
+
+    def get(self, identifier, metadataPrefix="oai_dc"):
+        position = self._get_index().get((identifier, metadataPrefix))
+        if position is None:
+            return None
+        n, m, row = position
+        for i, batch in enumerate(self._batches(self.paths[n])):
+            if i == m:
+                record = self._record(batch.slice(row, 1).to_pylist()[0])
+                return None if record.header.isDeleted() else record
+
+    def _records(self):
+        latest = self._get_index()
+        for n, path in enumerate(self.paths):
+            for m, batch in enumerate(self._batches(path)):
+                for row, values in enumerate(batch.to_pylist()):
+                    key = (values["identifier"], values["metadataPrefix"])
+                    if latest[key] == (n, m, row) and not values["deleted"]:
+                        yield self._record(values)
+
+    def _get_index(self):
+        """Return dictionary of the position of the latest version of each record.
+
+        Keyed by identifier and metadataPrefix. Positions are the numbers of
+        the file, of the batch in the file and of the row in the batch. Only
+        the identifier and metadataPrefix columns are read to build it, the
+        first time that records are read.
+        """
+        if self._index is None:
+            index = {}
+            for n, path in enumerate(self.paths):
+                batches = self._batches(path, ["identifier", "metadataPrefix"])
+                for m, batch in enumerate(batches):
+                    keys = zip(batch.column(0).to_pylist(), batch.column(1).to_pylist())
+                    for row, key in enumerate(keys):
+                        index[key] = (n, m, row)
+            self._index = index
+        return self._index
+
+    def _batches(self, path, columns=None):
+        """Generate record batches of the file at ``path``."""
+        pa = self._pa
+        if path.endswith(".arrow"):
+            # Batches are views of the memory map, without copying
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i)
+                    if columns is not None:
+                        batch = batch.select(columns)
+                    yield batch
+        else:
+            import pyarrow.parquet
+
+            parquet = pyarrow.parquet.ParquetFile(path, memory_map=True)
+            for batch in parquet.iter_batches(
+                batch_size=self.batchSize, columns=columns
+            ):
+                yield batch
+
+    def _record(self, row):
+        fields = dict(
+            (name, value) for name, value in row.items() if name not in HEADER_COLUMNS
+        )
+        return StoredRecord(
+            Header(
+                None,
+                row["identifier"],
+                row["datestamp"],
+                row["setSpec"],
+                row["deleted"],
+            ),
+            row["metadataPrefix"],
+            source=row["source"],
+            fields=fields,
+        )
+
+
+def open_reader(location, **kwargs):
+    """Return a ``RecordReader`` for the store at ``location``.
+
+    ``location`` => s3://bucket/prefix or file:///path for object storage,
+    a directory of files or of columnar files, or a stream file
+    ``kwargs`` => further arguments for the reader, e.g. the layout of a
+    directory; ``endpointUrl`` for object storage
+    """
+    scheme = urllib.urlparse(location).scheme
+    if scheme in ("s3", "file"):
+        client, prefix = object_client(location, kwargs.pop("endpointUrl", None))
+        return ObjectRecordReader(client, prefix, **kwargs)
+    if os.path.isdir(location):
+        if any(
+            filename.startswith("part-") and filename.endswith((".parquet", ".arrow"))
+            for filename in os.listdir(location)
+        ):
+            return ColumnarRecordReader(location, **kwargs)
+        return DirectoryRecordReader(location, **kwargs)
+    return StreamRecordReader(location, **kwargs)
+
+
+def _header(identifier, datestamp, setSpec, deleted):
+    if datestamp is not None and not isinstance(datestamp, datetime):
+        datestamp = datestamp_to_datetime(datestamp)
+    return Header(None, identifier, datestamp, list(setSpec or ()), deleted)
+
+
+def _matches(header, from_, until, set):
+    """Return whether ``header`` passes the given filters."""
+    if from_ is not None or until is not None:
+        datestamp = header.datestamp()
+        if datestamp is None:
+            return False
+        if from_ is not None and datestamp < from_:
+            return False
+        if until is not None and datestamp > until:
+            return False
+    if set is not None:
+        return any(
+            spec == set or spec.startswith(set + ":") for spec in header.setSpec()
+        )
+    return True
+
+
+def _json_metadata(raw):
+    return json.loads(bytes(raw))["metadata"]
+
+
+def _read_file(fp):
+    with open(fp, "rb") as fh:
+        return fh.read()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Document stream_store here."""
+import json
+import logging
+import threading
+from datetime import datetime
+from xml.sax.saxutils import quoteattr
+
+from oaipmh.datestamp import datetime_to_datestamp
+
+from oaiharvest.record import Record
+from oaiharvest.stores.base import RecordStore
+
+
+class StreamRecordStore(RecordStore):
+    """Write records and deletions to a binary stream, e.g. stdout or a FIFO.
+
+    ``stream`` => binary file-like object to write to; may be shared by
+    several stores, each of which only ever writes whole records
+    ``format`` => "json" for newline-delimited JSON objects, or "xml" for
+    ``<record>`` elements, each preceded by its length in bytes on a line
+    of its own
+    ``source`` => name of the provider to include with each record, or None
+    ``bufferSize`` => number of bytes to collect before writing them to the
+    stream in bulk
+    """
+
+    FORMATS = ("json", "xml")
+
+    # Serialize writes from stores sharing a stream
+    _lock = threading.Lock()
+
+    def __init__(self, stream, format="json", source=None, bufferSize=1 << 20):
+        if format not in self.FORMATS:
+            raise ValueError("Unsupported stream format {0!r}".format(format))
+        self.stream = stream
+        self.format = format
+        self.source = source
+        self.bufferSize = bufferSize
+        self._buffer = []
+        self._buffered = 0
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def write(self, record: Record, metadataPrefix: str):
+        self._append(self._serialize(record, metadataPrefix, deleted=False))
+
+    def delete(self, record: Record, metadataPrefix: str):
+        self._append(self._serialize(record, metadataPrefix, deleted=True))
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with self._lock:
+            self.stream.write(b"".join(self._buffer))
+            self.stream.flush()
+        self.logger.debug("Wrote {0} bytes to stream".format(self._buffered))
+        self._buffer = []
+        self._buffered = 0
+
+    def _append(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.bufferSize:
+            self.flush()
+
+    def _serialize(self, record, metadataPrefix, deleted):
+        header = record.header
+        datestamp = header.datestamp()
+        if isinstance(datestamp, datetime):
+            datestamp = datetime_to_datestamp(datestamp)
+        if self.format == "json":
+            obj = {
+                "event": "delete" if deleted else "write",
+                "identifier": header.identifier(),
+                "metadataPrefix": metadataPrefix,
+                "datestamp": datestamp,
+                "setSpec": list(header.setSpec()),
+            }
+            if self.source is not None:
+                obj["source"] = self.source
+            if not deleted:
+                obj["metadata"] = record.metadata
+            return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+        attrs = [
+            ("identifier", header.identifier()),
+            ("metadataPrefix", metadataPrefix),
+            ("datestamp", datestamp),
+            ("setSpec", " ".join(header.setSpec()) or None),
+            ("source", self.source),
+            ("status", "deleted" if deleted else None),
+        ]
+        start = "<record {0}".format(
+            " ".join(
+                "{0}={1}".format(name, quoteattr(value))
+                for name, value in attrs
+                if value is not None
+            )
+        )
+        if deleted:
+            element = start + "/>"
+        else:
+            element = "{0}>{1}</record>".format(start, record.metadata)
+        element = element.encode("utf-8")
+        return b"%d\n%s\n" % (len(element), element)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from mock import patch
+
+from oaiharvest.archive import ResponseArchive
+
+
+class ResponseArchiveTestCase(unittest.TestCase):
+    url = "https://oai.example.com/oai"
+
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.archive = ResponseArchive(self.dir_path)
+
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_put_get(self):
+        request = "metadataPrefix=oai_dc&verb=ListRecords"
+        self.assertIsNone(self.archive.get(self.url, request))
+        self.archive.put(self.url, request, b"<OAI-PMH/>")
+        self.assertEqual(self.archive.get(self.url, request), b"<OAI-PMH/>")
+        self.assertIsNone(self.archive.get(self.url + "2", request))
+
+    def test_lists(self):
+        first = "from=2020-01-01&metadataPrefix=oai_dc&verb=ListRecords"
+        self.archive.put(self.url, "verb=Identify", b"<Identify/>")
+        self.archive.put(self.url, first, b"<page1/>")
+        self.archive.put(self.url, "resumptionToken=1&verb=ListRecords", b"", first)
+        self.archive.put(self.url, "metadataPrefix=mods&verb=ListRecords", b"")
+        self.assertEqual(
+            self.archive.lists(self.url, "oai_dc"),
+            [{"from": "2020-01-01", "metadataPrefix": "oai_dc", "verb": "ListRecords"}],
+        )
+
+    def test_resumed_list(self):
+        # Started from a resumptionToken, e.g. with -r TOKEN
+        start = "metadataPrefix=oai_dc&resumptionToken=5&verb=ListRecords"
+        self.archive.start_list(self.url, start)
+        self.archive.put(self.url, "resumptionToken=5&verb=ListRecords", b"", start)
+        self.archive.put(self.url, "resumptionToken=6&verb=ListRecords", b"", start)
+        self.assertEqual(
+            self.archive.lists(self.url, "oai_dc"),
+            [
+                {
+                    "metadataPrefix": "oai_dc",
+                    "resumptionToken": "5",
+                    "verb": "ListRecords",
+                }
+            ],
+        )
+        self.assertEqual(self.archive.lists(self.url, "mods"), [])
+
+    def test_evict_over_limit(self):
+        self.archive.put(self.url, "verb=Identify", b"<Identify/>")
+        self.archive.maxBytes = self.archive.size() * 2
+        with patch.object(self.archive, "evict") as evict:
+            # Replaced by a response of the same size
+            self.archive.put(self.url, "verb=Identify", b"<Identify/>")
+            self.archive.put(self.url, "verb=ListSets", b"<ListSets/>")
+            self.assertFalse(evict.called)
+            self.archive.put(self.url, "verb=ListMetadataFormats", b"<Formats/>")
+            self.assertEqual(evict.call_count, 1)
+
+    def test_evict_whole_lists(self):
+        body = bytes(bytearray(range(256))) * 64
+        for i in range(3):
+            first = "metadataPrefix=oai_dc&set={0}&verb=ListRecords".format(i)
+            self.archive.put(self.url, first, body)
+            token = "resumptionToken={0}&verb=ListRecords".format(i)
+            self.archive.put(self.url, token, body, first)
+        # Use the first list again
+        self.archive.get(self.url, "resumptionToken=0&verb=ListRecords")
+        listSize = self.archive.size() / 3
+        self.archive.evict(listSize * 2)
+        self.assertEqual(
+            [params["set"] for params in self.archive.lists(self.url, "oai_dc")],
+            ["0", "2"],
+        )
+        self.assertIsNone(
+            self.archive.get(self.url, "resumptionToken=1&verb=ListRecords")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
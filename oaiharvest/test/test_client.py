@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import shutil
+import socket
+import unittest
+from datetime import timedelta
+from tempfile import mkdtemp
+
+from mock import Mock, patch
+from six.moves.urllib.error import HTTPError, URLError
+
+from oaiharvest.archive import ResponseArchive
+from oaiharvest.cache import ResponseCache
+from oaiharvest.client import STALL_RETRIES, Client
+from oaiharvest.exceptions import NotArchivedException
+from oaiharvest.registry import verify_database
+
+IDENTIFY = b"""<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2020-01-01T00:00:00Z</responseDate>
+  <request verb="Identify">https://oai.example.com</request>
+  <Identify>
+    <repositoryName>Example</repositoryName>
+    <baseURL>https://oai.example.com</baseURL>
+    <protocolVersion>2.0</protocolVersion>
+    <adminEmail>admin@example.com</adminEmail>
+    <earliestDatestamp>2000-01-01</earliestDatestamp>
+    <deletedRecord>persistent</deletedRecord>
+    <granularity>YYYY-MM-DD</granularity>
+  </Identify>
+</OAI-PMH>"""
+
+
+def _response(body, headers=None):
+    response = Mock()
+    response.read.return_value = body
+    response.info.return_value = headers or {}
+    return response
+
+
+@patch("oaiharvest.client.urllib2.urlopen")
+class ClientCacheTestCase(unittest.TestCase):
+    url = "https://oai.example.com"
+
+    def setUp(self):
+        self.cxn = verify_database(":memory:")
+        self.cache = ResponseCache(self.cxn, ttl=timedelta(hours=1))
+
+    def test_identify_requested_once(self, urlopen):
+        urlopen.return_value = _response(IDENTIFY)
+        client = Client(self.url)
+        client.identify()
+        client.updateGranularity()
+        self.assertEqual(urlopen.call_count, 1)
+
+    def test_identify_cached(self, urlopen):
+        urlopen.return_value = _response(IDENTIFY)
+        Client(self.url, responseCache=self.cache).identify()
+        identify = Client(self.url, responseCache=self.cache).identify()
+        self.assertEqual(identify.granularity(), "YYYY-MM-DD")
+        self.assertEqual(urlopen.call_count, 1)
+
+    def test_stale_identify_revalidated(self, urlopen):
+        urlopen.return_value = _response(IDENTIFY, {"ETag": '"abc"'})
+        Client(self.url, responseCache=self.cache).identify()
+        self.cache.ttl = timedelta(0)
+        urlopen.side_effect = HTTPError(self.url, 304, "Not Modified", {}, None)
+        identify = Client(self.url, responseCache=self.cache).identify()
+        self.assertEqual(identify.repositoryName(), "Example")
+        request = urlopen.call_args[0][0]
+        self.assertEqual(request.get_header("If-none-match"), '"abc"')
+
+    def test_refresh(self, urlopen):
+        urlopen.return_value = _response(IDENTIFY, {"ETag": '"abc"'})
+        Client(self.url, responseCache=self.cache).identify()
+        self.cache.refresh = True
+        Client(self.url, responseCache=self.cache).identify()
+        self.assertEqual(urlopen.call_count, 2)
+        request = urlopen.call_args[0][0]
+        self.assertIsNone(request.get_header("If-none-match"))
+
+
+@patch("oaiharvest.client.urllib2.urlopen")
+class ClientArchiveTestCase(unittest.TestCase):
+    url = "https://oai.example.com"
+
+    def setUp(self):
+        self.dir_path = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_replay(self, urlopen):
+        urlopen.return_value = _response(IDENTIFY)
+        archive = ResponseArchive(self.dir_path)
+        Client(self.url, archive=archive).identify()
+        archive.close()
+        urlopen.side_effect = AssertionError("Requested while replaying")
+
+        archive = ResponseArchive(self.dir_path, replay=True)
+        identify = Client(self.url, archive=archive).identify()
+        self.assertEqual(identify.granularity(), "YYYY-MM-DD")
+        with self.assertRaises(NotArchivedException):
+            Client(self.url, archive=archive).listSets()
+        archive.close()
+
+
+@patch("oaiharvest.client.urllib2.urlopen")
+class ClientStallTestCase(unittest.TestCase):
+    url = "https://oai.example.com"
+
+    def test_stalled_request_retried(self, urlopen):
+        urlopen.side_effect = [
+            URLError(socket.timeout("timed out")),
+            socket.timeout("timed out"),
+            _response(IDENTIFY),
+        ]
+        client = Client(self.url, stallTimeout=5)
+        self.assertEqual(client.identify().repositoryName(), "Example")
+        self.assertEqual(urlopen.call_count, 3)
+        self.assertEqual(urlopen.call_args[1], {"timeout": 5})
+
+    def test_stalled_too_often(self, urlopen):
+        urlopen.side_effect = socket.timeout("timed out")
+        with self.assertRaises(socket.timeout):
+            Client(self.url, stallTimeout=5).identify()
+        self.assertEqual(urlopen.call_count, STALL_RETRIES + 1)
+
+    def test_other_errors_not_retried(self, urlopen):
+        urlopen.side_effect = URLError("Name or service not known")
+        with self.assertRaises(URLError):
+            Client(self.url, stallTimeout=5).identify()
+        self.assertEqual(urlopen.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
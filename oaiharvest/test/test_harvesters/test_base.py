@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 import unittest
+from datetime import datetime, timedelta
 
 from mock import Mock, patch
 from oaipmh.metadata import MetadataRegistry
 
-from oaiharvest.exceptions import NotOAIPMHBaseURLException
+from oaiharvest.exceptions import (
+    HarvestPausedException,
+    NotOAIPMHBaseURLException,
+)
 from oaiharvest.harvesters.base import OAIRecordGetter
 
 
@@ -40,6 +44,50 @@ class OAIRecordGetterTestCase(unittest.TestCase):
         with self.assertRaises(NotOAIPMHBaseURLException):
             list(self.subject.get_records(url))
 
+    def test_next_window_start(self):
+        between = (datetime(1900, 1, 1, 9), datetime(1900, 1, 1, 17))
+        day = datetime(2020, 6, 1)
+        self.assertEqual(
+            self.subject.next_window_start(between, day.replace(hour=7)),
+            day.replace(hour=9),
+        )
+        self.assertIsNone(self.subject.next_window_start(between, day.replace(hour=12)))
+        self.assertEqual(
+            self.subject.next_window_start(between, day.replace(hour=18)),
+            datetime(2020, 6, 2, 9),
+        )
+        # Window spanning midnight
+        between = (datetime(1900, 1, 1, 22), datetime(1900, 1, 1, 6))
+        self.assertIsNone(self.subject.next_window_start(between, day.replace(hour=3)))
+        self.assertEqual(
+            self.subject.next_window_start(between, day.replace(hour=12)),
+            day.replace(hour=22),
+        )
+
+    @patch("oaiharvest.harvesters.base.sleep")
+    def test_maybe_pause_if_incremental(self, sleep):
+        resumeAt = datetime.now() + timedelta(hours=1)
+        with patch.object(self.subject, "next_window_start", return_value=resumeAt):
+            with self.assertWarns(DeprecationWarning):
+                self.subject.maybe_pause_if_incremental(Mock())
+        (seconds,), kwargs = sleep.call_args
+        self.assertTrue(3500 < seconds <= 3600)
+
+    @patch("oaiharvest.harvesters.base.Client")
+    def test_get_records_paused(self, MockClient):
+        client = MockClient.return_value
+        client.listRecords.return_value = iter([(Mock(), Mock(), Mock())])
+        resumeAt = datetime(2020, 6, 2, 9)
+        with patch.object(self.subject, "next_window_start", return_value=resumeAt):
+            recs = self.subject.get_records(
+                "https://oai.example.com", resumptionToken="abc", between=Mock()
+            )
+            with self.assertRaises(HarvestPausedException) as cm:
+                list(recs)
+        self.assertEqual(cm.exception.resumeAt, resumeAt)
+        self.assertEqual(cm.exception.resumptionToken, "abc")
+        client.listRecords.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,7 @@
 import os
 import shutil
 import unittest
+from datetime import datetime, timedelta
 from tempfile import mkdtemp
 from uuid import uuid4
 
@@ -10,6 +11,7 @@ from oaipmh.common import Header
 from oaipmh.metadata import MetadataRegistry
 from six import PY3
 
+from oaiharvest.exceptions import HarvestPausedException
 from oaiharvest.harvesters.base import OAIHarvester
 from oaiharvest.harvesters.directory_harvester import DirectoryOAIHarvester
 from oaiharvest.stores.directory_store import DirectoryRecordStore
@@ -59,6 +61,73 @@ class DirectoryOAIHarvesterTestCase(unittest.TestCase):
         self.assertTrue(self.harvester.harvest(url, "oai_dc"))
         self.assertEqual(len(os.listdir(self.dir_path)), len(mock_recs))
 
+    @patch("oaiharvest.harvesters.base.Client")
+    def test_harvest_windows(self, MockClient):
+        client = MockClient.return_value
+        client.listRecords.side_effect = lambda **kwargs: iter(
+            [self._make_pyoai_record()]
+        )
+        client.responseDate = datetime(2020, 1, 25, 12)
+        harvester = DirectoryOAIHarvester(
+            self.md_registry, self.dir_path, window=timedelta(days=10)
+        )
+        commits = []
+        self.assertTrue(
+            harvester.harvest(
+                "https://oai.example.com",
+                "oai_dc",
+                onCommit=commits.append,
+                from_=datetime(2020, 1, 1),
+            )
+        )
+        calls = client.listRecords.call_args_list
+        self.assertGreater(len(calls), 2)
+        self.assertEqual(calls[0][1]["from_"], datetime(2020, 1, 1))
+        self.assertEqual(calls[0][1]["until"], datetime(2020, 1, 11))
+        self.assertEqual(calls[1][1]["from_"], datetime(2020, 1, 11))
+        self.assertNotIn("until", calls[-1][1])
+        self.assertEqual(commits[:2], [datetime(2020, 1, 11), datetime(2020, 1, 21)])
+        self.assertEqual(commits[-1], datetime(2020, 1, 25, 12))
+        self.assertEqual(len(commits), len(calls))
+
+    @patch("oaiharvest.harvesters.base.Client")
+    def test_harvest_windows_limit(self, MockClient):
+        client = MockClient.return_value
+        client.listRecords.side_effect = lambda **kwargs: iter(
+            [self._make_pyoai_record(), self._make_pyoai_record()]
+        )
+        harvester = DirectoryOAIHarvester(
+            self.md_registry, self.dir_path, nRecs=3, window=timedelta(days=10)
+        )
+        commits = []
+        self.assertFalse(
+            harvester.harvest(
+                "https://oai.example.com",
+                "oai_dc",
+                onCommit=commits.append,
+                from_=datetime(2020, 1, 1),
+                until=datetime(2020, 2, 1),
+            )
+        )
+        # Only the first window was completed
+        self.assertEqual(commits, [datetime(2020, 1, 11)])
+
+    @patch("oaiharvest.harvesters.base.Client")
+    def test_harvest_paused_flush_failed(self, MockClient):
+        paused = HarvestPausedException(datetime(2020, 1, 2))
+
+        def list_records(**kwargs):
+            yield self._make_pyoai_record()
+            raise paused
+
+        MockClient.return_value.listRecords.side_effect = list_records
+        self.harvester.store.flush = Mock(side_effect=IOError("flush failed"))
+        with self.assertRaises(HarvestPausedException) as cm:
+            self.harvester.harvest("https://oai.example.com", "oai_dc")
+        # The pause is not hidden by the failure to flush the store
+        self.assertIs(cm.exception, paused)
+        self.assertTrue(self.harvester.store.flush.called)
+
     # Helpers
 
     def _make_pyoai_record(self):
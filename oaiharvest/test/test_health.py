@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import timedelta
+from tempfile import mkdtemp
+
+from oaiharvest.health import MIN_TIMEOUT, HealthRegistry, ProviderHealth
+from oaiharvest.registry import verify_database
+
+
+class HealthRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.cxn = verify_database(os.path.join(self.dir_path, "registry.db"))
+        self.health = HealthRegistry(self.cxn, threshold=2)
+
+    def tearDown(self):
+        self.cxn.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_circuit_breaker(self):
+        state = self.health.record_failure("a", IOError("timed out"))
+        self.assertEqual(state.failures, 1)
+        self.assertFalse(self.health.get("a").is_open())
+        state = self.health.record_failure("a", IOError("timed out"))
+        self.assertTrue(self.health.get("a").is_open())
+        self.assertEqual(state.retryAt - state.lastFailure, timedelta(hours=1))
+        self.assertFalse(state.is_open(state.retryAt))
+        # Probe failed; wait twice as long
+        state = self.health.record_failure("a", ValueError())
+        self.assertEqual(state.retryAt - state.lastFailure, timedelta(hours=2))
+        self.assertEqual(self.health.get("a").lastError, "ValueError")
+        # Probe succeeded
+        self.health.record_success("a")
+        state = self.health.get("a")
+        self.assertEqual(state.failures, 0)
+        self.assertFalse(state.is_open())
+        self.assertEqual(state.lastError, "ValueError")
+        # Other providers are unaffected
+        self.assertEqual(self.health.get("b").failures, 0)
+
+    def test_latency(self):
+        self.assertIsNone(self.health.get("a").latency)
+        self.health.record_success("a", requests=4, seconds=4.0)
+        self.health.record_failure("a", "error", requests=1, seconds=2.0)
+        state = self.health.get("a")
+        self.assertAlmostEqual(state.latency, 1.3)
+        self.assertEqual(state.requests, 5)
+
+    def test_timeout(self):
+        self.assertEqual(ProviderHealth("a").timeout(300), 300)
+        self.assertEqual(ProviderHealth("a", latency=2.0).timeout(300), 20)
+        self.assertEqual(ProviderHealth("a", latency=0.1).timeout(300), MIN_TIMEOUT)
+        self.assertEqual(ProviderHealth("a", latency=60).timeout(300), 300)
+        self.assertEqual(ProviderHealth("a", latency=60).timeout(None), 600)
+
+
+if __name__ == "__main__":
+    unittest.main()
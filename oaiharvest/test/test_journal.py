@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from mock import patch
+from oaipmh.common import Header
+from six import StringIO
+
+from oaiharvest.journal import HarvestJournal, list_runs, main
+from oaiharvest.record import Record
+from oaiharvest.stores.directory_store import DirectoryRecordStore
+
+
+class HarvestJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.records = os.path.join(self.dir_path, "records")
+        self.journals = os.path.join(self.dir_path, "journals")
+        # Harvested before the run
+        os.makedirs(self.records)
+        self._write_file("oai:x:1", "<a>old</a>")
+        self._write_file("oai:x:2", "<a>two</a>")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_rollback(self):
+        journal = self._harvest(segmentEntries=2)
+        run = journal.run
+        # Compacted to the net change to each file, in a single segment
+        self.assertEqual(len(run.segments()), 1)
+        self.assertEqual(run.info()["entries"], 3)
+        self.assertEqual(
+            [(entry["op"], entry["path"]) for segment, entry in run.entries()],
+            [
+                ("write", "oai:x:1.oai_dc.xml"),
+                ("write", "oai:x:3.oai_dc.xml"),
+                ("delete", "oai:x:2.oai_dc.xml"),
+            ],
+        )
+        self.assertEqual(run.rollback(), (3, 0))
+        self.assertEqual(
+            self._read_files(),
+            {"oai:x:1.oai_dc.xml": "<a>old</a>", "oai:x:2.oai_dc.xml": "<a>two</a>"},
+        )
+
+    def test_rollback_changed(self):
+        run = self._harvest().run
+        # Changed by a later run
+        self._write_file("oai:x:3", "<a>later</a>")
+        self.assertEqual(run.rollback(), (2, 1))
+        self.assertEqual(self._read_files()["oai:x:3.oai_dc.xml"], "<a>later</a>")
+        self.assertEqual(run.rollback(force=True), (3, 0))
+        self.assertNotIn("oai:x:3.oai_dc.xml", self._read_files())
+
+    def test_replay(self):
+        run = self._harvest(compact=False).run
+        expected = self._read_files()
+        other = os.path.join(self.dir_path, "other")
+        self.assertEqual(run.replay(to=other), 3)
+        self.assertEqual(
+            sorted(os.listdir(other)), ["oai:x:1.oai_dc.xml", "oai:x:3.oai_dc.xml"]
+        )
+        run.rollback()
+        run.replay()
+        self.assertEqual(self._read_files(), expected)
+
+    def test_incomplete_entry(self):
+        run = self._harvest(compact=False).run
+        (segment,) = run.segments()
+        with open(segment + ".jsonl", "a") as fh:
+            fh.write('{"seq": 5, "op": "wri')
+        self.assertEqual(len(list(run.entries())), 4)
+
+    def test_crash(self):
+        journal = HarvestJournal(self.journals)
+        store = DirectoryRecordStore(self.records, journal=journal)
+        for i in range(5):
+            store.write(self._make_record("oai:x:1", "<a>{0}</a>".format(i)), "oai_dc")
+        # Crashed before the store was flushed or the journal closed
+        self.assertEqual(len(list(journal.run.entries())), 5)
+        self.assertEqual(journal.run.rollback(), (1, 0))
+        self.assertEqual(self._read_files()["oai:x:1.oai_dc.xml"], "<a>old</a>")
+        journal.close(compact=False)
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_main(self, stdout):
+        self._harvest(compact=False)
+        self.assertEqual(main(["--journal", self.journals, "-q", "compact"]), 0)
+        self.assertEqual(main(["--journal", self.journals, "-q", "list"]), 0)
+        (line,) = stdout.getvalue().splitlines()
+        self.assertTrue(line.endswith("\t3 entries\tcompacted"))
+        self.assertEqual(main(["--journal", self.journals, "-q", "rollback"]), 0)
+        self.assertEqual(self._read_files()["oai:x:2.oai_dc.xml"], "<a>two</a>")
+        (run,) = list_runs(self.journals)
+        self.assertIn("rolledBack", run.info())
+
+    # Helpers
+
+    def _harvest(self, compact=True, **kwargs):
+        journal = HarvestJournal(self.journals, **kwargs)
+        store = DirectoryRecordStore(self.records, journal=journal)
+        store.write(self._make_record("oai:x:1", "<a>new ü</a>"), "oai_dc")
+        store.write(self._make_record("oai:x:3", "<a>three</a>"), "oai_dc")
+        store.write(self._make_record("oai:x:3", "<a>three again</a>"), "oai_dc")
+        store.delete(self._make_record("oai:x:2", deleted=True), "oai_dc")
+        store.close()
+        journal.close(compact=compact)
+        return journal
+
+    def _make_record(self, identifier, metadata=None, deleted=False):
+        header = Header(None, identifier, datetime(2020, 1, 1), [], deleted)
+        return Record(header, metadata, None)
+
+    def _write_file(self, identifier, content):
+        fp = os.path.join(self.records, "{0}.oai_dc.xml".format(identifier))
+        with open(fp, "w") as fh:
+            fh.write(content)
+
+    def _read_files(self):
+        files = {}
+        for filename in os.listdir(self.records):
+            with open(os.path.join(self.records, filename), "rb") as fh:
+                files[filename] = fh.read().decode("utf-8")
+        return files
+
+
+if __name__ == "__main__":
+    unittest.main()
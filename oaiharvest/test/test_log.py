@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import unittest
+
+from mock import Mock
+
+from oaiharvest.log import (
+    WRITE_EVENT,
+    JSONFormatter,
+    ProgressCounter,
+    ProgressReporter,
+    SamplingFilter,
+    configure_logging,
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("oaiharvest.test.log")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_sampling_filter(self):
+        self.handler.addFilter(SamplingFilter(3))
+        for i in range(7):
+            self.logger.debug("Writing %d", i, extra=WRITE_EVENT)
+        self.logger.info("Not sampled")
+        messages = [record.getMessage() for record in self.handler.records]
+        self.assertEqual(
+            messages, ["Writing 0", "Writing 3", "Writing 6", "Not sampled"]
+        )
+
+    def test_json_formatter(self):
+        self.logger.info("Harvested %d records", 5, extra={"source": "a"})
+        obj = json.loads(JSONFormatter().format(self.handler.records[0]))
+        self.assertEqual(obj["message"], "Harvested 5 records")
+        self.assertEqual(obj["level"], "INFO")
+        self.assertEqual(obj["source"], "a")
+        self.assertNotIn("args", obj)
+
+    def test_configure_logging(self):
+        args = Mock(verbosity=0, logJSON=False, logFile=None, logSample=1)
+        first = configure_logging(args)
+        second = configure_logging(args)
+        # Handlers of the first call are replaced, not added to
+        handlers = logging.getLogger("oaiharvest").handlers
+        self.assertEqual([h for h in handlers if h in first + second], second)
+        for handler in second:
+            logging.getLogger("oaiharvest").removeHandler(handler)
+            logging.getLogger("__main__").removeHandler(handler)
+
+    def test_progress_reporter(self):
+        reporter = ProgressReporter(interval=60, logger=self.logger)
+        counter = reporter.counter("a")
+        reporter.start()
+        counter.records += 10
+        counter.deleted += 1
+        reporter.stop()
+        (record,) = self.handler.records
+        self.assertEqual((record.records, record.deleted), (10, 1))
+
+    def test_progress_counter(self):
+        callback = Mock()
+        counter = ProgressCounter("a", callback)
+        counter.started -= 10
+        counter.page(
+            Mock(records=[None] * 10, token="1", completeListSize=50, cursor=0)
+        )
+        callback.assert_called_once_with(counter)
+        counter.records += 10
+        self.assertEqual(counter.percent(), 20)
+        self.assertAlmostEqual(counter.eta(now=counter.started + 10), 40)
+        counter.page(
+            Mock(records=[None] * 10, token=None, completeListSize=None, cursor=None)
+        )
+        self.assertEqual((counter.completeListSize, counter.position), (50, 20))
+        # Next list
+        counter.page(
+            Mock(records=[None] * 5, token="1", completeListSize=None, cursor=None)
+        )
+        self.assertEqual((counter.completeListSize, counter.position), (None, 5))
+        self.assertIsNone(counter.eta())
+
+    def test_progress_stalled(self):
+        reporter = ProgressReporter(logger=self.logger, stallTimeout=30)
+        counter = reporter.counter("a")
+        counter.lastPage -= 60
+        self.assertFalse(counter.stalled(30))
+        counter.active = True
+        self.assertTrue(counter.stalled(30))
+        reporter.report()
+        self.assertEqual(
+            [record.levelno for record in self.handler.records],
+            [logging.INFO, logging.WARNING],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+
+from oaiharvest.memory import BufferLimits, MemoryBudget, PageBuffer, prefetch
+
+
+class FakePage(object):
+    def __init__(self, n, size=10):
+        self.records = [n] * 2
+        self.size = size
+
+
+class PrefetchTestCase(unittest.TestCase):
+    def test_order(self):
+        pages = [FakePage(i) for i in range(10)]
+        fetched = list(prefetch(iter(pages), BufferLimits(maxPages=3)))
+        self.assertEqual(fetched, pages)
+
+    def test_error(self):
+        def pages():
+            yield FakePage(0)
+            raise ValueError("broken")
+
+        with self.assertRaises(ValueError):
+            list(prefetch(pages(), BufferLimits(maxPages=2)))
+
+    def test_budget_released_when_stopped(self):
+        budget = MemoryBudget(25)
+        pages = prefetch(
+            (FakePage(i) for i in range(10)), BufferLimits(maxPages=5, budget=budget)
+        )
+        next(pages)
+        pages.close()
+        self.assertEqual(budget.used, 0)
+        self.assertLessEqual(budget.peak, 25)
+
+
+class PageBufferTestCase(unittest.TestCase):
+    def test_limits(self):
+        for limits in (
+            BufferLimits(maxPages=2),
+            BufferLimits(maxPages=5, maxRecords=4),
+            BufferLimits(maxPages=5, maxBytes=20),
+        ):
+            buffer = PageBuffer(limits)
+            self.assertTrue(buffer.put(FakePage(0)))
+            self.assertTrue(buffer.put(FakePage(1)))
+            blocked = threading.Thread(target=buffer.put, args=(FakePage(2),))
+            blocked.start()
+            blocked.join(0.05)
+            self.assertTrue(blocked.is_alive())
+            buffer.get()
+            buffer.get()
+            blocked.join(1)
+            self.assertFalse(blocked.is_alive())
+
+    def test_oversized_page(self):
+        buffer = PageBuffer(BufferLimits(maxPages=1, maxBytes=5))
+        self.assertTrue(buffer.put(FakePage(0, size=100)))
+        buffer.finish()
+        self.assertEqual(buffer.get().size, 100)
+        self.assertIsNone(buffer.get())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from mock import Mock, patch
+from oaipmh.error import BadResumptionTokenError
+from oaipmh.metadata import MetadataRegistry, oai_dc_reader
+
+from oaiharvest.client import Client
+from oaiharvest.exceptions import HarvestPausedException
+from oaiharvest.memory import BufferLimits
+from oaiharvest.metadata import DefaultingMetadataRegistry, XMLMetadataReader
+from oaiharvest.parallel import (
+    ParallelPageParser,
+    find_list_position,
+    find_resumption_token,
+)
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2020-01-01T00:00:00Z</responseDate>
+  <request verb="ListRecords">https://oai.example.com</request>
+  <ListRecords>{records}{token}</ListRecords>
+</OAI-PMH>"""
+
+RECORD = """<record>
+  <header{status}>
+    <identifier>oai:example.com:{n}</identifier>
+    <datestamp>2020-01-01</datestamp>
+    <setSpec>a</setSpec>
+  </header>
+  <metadata>
+    <oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
+               xmlns:dc="http://purl.org/dc/elements/1.1/">
+      <dc:title>Record {n}</dc:title>
+    </oai_dc:dc>
+  </metadata>
+</record>"""
+
+ERROR = b"""<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2020-01-01T00:00:00Z</responseDate>
+  <request verb="ListRecords">https://oai.example.com</request>
+  <error code="badResumptionToken">expired</error>
+</OAI-PMH>"""
+
+
+def make_page(start, stop, token=None):
+    records = "".join(
+        RECORD.format(n=n, status=' status="deleted"' if n % 5 == 4 else "")
+        for n in range(start, stop)
+    )
+    if token is None:
+        token = "<resumptionToken/>"
+    else:
+        token = '<resumptionToken cursor="{0}">{1}</resumptionToken>'.format(
+            start, token
+        )
+    return PAGE.format(records=records, token=token).encode("utf-8")
+
+
+class FindResumptionTokenTestCase(unittest.TestCase):
+    def test_token(self):
+        self.assertEqual(find_resumption_token(make_page(0, 2, "abc")), "abc")
+
+    def test_escaped_token(self):
+        xml = make_page(0, 2, "set=a&amp;from=2020")
+        self.assertEqual(find_resumption_token(xml), "set=a&from=2020")
+        xml = make_page(0, 2, "set=a&#38;from=2020&#x2F;01")
+        self.assertEqual(find_resumption_token(xml), "set=a&from=2020/01")
+        xml = make_page(0, 2, "<![CDATA[set=a&from=2020]]>")
+        self.assertEqual(find_resumption_token(xml), "set=a&from=2020")
+
+    def test_no_token(self):
+        self.assertIsNone(find_resumption_token(make_page(0, 2)))
+        xml = make_page(0, 2).replace(b"<resumptionToken/>", b"")
+        self.assertIsNone(find_resumption_token(xml))
+
+    def test_list_position(self):
+        xml = make_page(10, 12, "abc").replace(
+            b"<resumptionToken ", b'<resumptionToken completeListSize="25" '
+        )
+        self.assertEqual(find_list_position(xml), (25, 10))
+        self.assertEqual(find_list_position(make_page(0, 2, "abc")), (None, 0))
+        self.assertEqual(find_list_position(make_page(0, 2)), (None, None))
+
+
+class ParallelPageParserTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.md_registry = DefaultingMetadataRegistry(defaultReader=XMLMetadataReader())
+        cls.parser = ParallelPageParser(cls.md_registry, 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.parser.close()
+
+    def test_parse(self):
+        future = self.parser.parse(make_page(0, 5, "abc"), "oai_dc")
+        records = self.parser.records(future)
+        self.assertEqual(len(records), 5)
+        header, metadata, about = records[4]
+        self.assertEqual(header.identifier(), "oai:example.com:4")
+        self.assertEqual(header.setSpec(), ["a"])
+        self.assertTrue(header.isDeleted())
+        self.assertIn("Record 4", metadata)
+
+    def test_parse_metadata_map(self):
+        md_registry = MetadataRegistry()
+        md_registry.registerReader("oai_dc", oai_dc_reader)
+        parser = ParallelPageParser(md_registry, 1)
+        try:
+            records = parser.records(parser.parse(make_page(0, 1), "oai_dc"))
+        finally:
+            parser.close()
+        self.assertEqual(records[0][1]["title"], ["Record 0"])
+
+    def test_parse_error(self):
+        future = self.parser.parse(ERROR, "oai_dc")
+        with self.assertRaises(BadResumptionTokenError):
+            self.parser.records(future)
+
+    @patch.object(Client, "_retrieve")
+    def test_client_order(self, retrieve):
+        pages = {
+            None: make_page(0, 10, "1"),
+            "1": make_page(10, 20, "2"),
+            "2": make_page(20, 30, "3"),
+            "3": make_page(30, 35),
+        }
+        retrieve.side_effect = lambda kw, *args, **kwargs: (
+            pages[kw.get("resumptionToken")],
+            {},
+        )
+        client = Client(
+            "https://oai.example.com", self.md_registry, pageParser=self.parser
+        )
+        client.onPage = Mock()
+        parallel = [
+            header.identifier()
+            for header, _, _ in client.listRecords(metadataPrefix="oai_dc")
+        ]
+        cursors = [call[0][0].cursor for call in client.onPage.call_args_list]
+        client = Client("https://oai.example.com", self.md_registry)
+        client.onPage = Mock()
+        sequential = [
+            header.identifier()
+            for header, _, _ in client.listRecords(metadataPrefix="oai_dc")
+        ]
+        self.assertEqual(len(parallel), 35)
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(cursors, [0, 10, 20, None])
+        self.assertEqual(
+            [call[0][0].cursor for call in client.onPage.call_args_list], cursors
+        )
+
+    @patch.object(Client, "_retrieve")
+    def test_client_paused(self, retrieve):
+        pages = dict(
+            (str(n) if n else None, make_page(n * 10, n * 10 + 10, str(n + 1)))
+            for n in range(40)
+        )
+
+        def fetch(kw, *args, **kwargs):
+            time.sleep(0.02)
+            return pages[kw.get("resumptionToken")], {}
+
+        retrieve.side_effect = fetch
+        client = Client(
+            "https://oai.example.com",
+            self.md_registry,
+            bufferLimits=BufferLimits(maxPages=40),
+            pageParser=self.parser,
+        )
+        client.beforePage = Mock(side_effect=HarvestPausedException(None, "1"))
+        try:
+            list(client.listRecords(metadataPrefix="oai_dc"))
+        except HarvestPausedException as e:
+            # Kept, with its traceback, until the harvest is resumed
+            paused = e
+        time.sleep(0.2)
+        requested = retrieve.call_count
+        time.sleep(0.2)
+        # No more pages are requested once paused
+        self.assertEqual(retrieve.call_count, requested)
+        self.assertIsNotNone(paused.__traceback__)
+
+
+if __name__ == "__main__":
+    unittest.main()
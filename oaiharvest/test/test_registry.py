@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import shutil
+import sqlite3
+import time
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from mock import patch
+
+from oaiharvest.registry import (
+    check_name,
+    main,
+    validate_providers,
+    verify_database,
+)
+
+PROVIDERS = """name,url,metadataPrefix,harvestWindow,lastHarvest
+a,http://a.example.com/oai,,,
+b,http://b.example.com/oai,mods,22:00 06:00,2020-01-01T12:00:00
+http://c,http://c.example.com/oai,,,
+d,,,,
+a,http://a.example.com/oai,,,
+"""
+
+
+class RegistryImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.db = os.path.join(self.dir_path, "registry.db")
+        self.csv = os.path.join(self.dir_path, "providers.csv")
+        with open(self.csv, "w") as fh:
+            fh.write(PROVIDERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_check_name(self):
+        self.assertIsNone(check_name("arxiv"))
+        for name in ("", "all", "https://x", "worker", "search", "journal"):
+            self.assertIsNotNone(check_name(name), name)
+
+    @patch("oaiharvest.registry.validate_provider")
+    def test_import(self, validate_provider):
+        validate_provider.side_effect = lambda provider, timeout: (
+            "metadataPrefix mods not available"
+            if provider["metadataPrefix"] == "mods"
+            else None
+        )
+        rejects = os.path.join(self.dir_path, "rejects.csv")
+        status = self._main("import", self.csv, "-d", "/data", "--rejects", rejects)
+        self.assertEqual(status, 1)
+        cxn = verify_database(self.db)
+        rows = cxn.execute(
+            "SELECT name, destination, metadataPrefix FROM providers"
+        ).fetchall()
+        self.assertEqual(rows, [("a", "/data", "oai_dc")])
+        with open(rejects) as fh:
+            errors = [(row["name"], row["error"]) for row in csv.DictReader(fh)]
+        self.assertEqual([name for name, error in errors], ["a", "b", "d", "http://c"])
+        self.assertIn("more than once", errors[0][1])
+        self.assertIn("mods", errors[1][1])
+
+    @patch("oaiharvest.registry.validate_provider", return_value=None)
+    def test_export_import(self, validate_provider):
+        self._main("import", self.csv, "--no-validate")
+        validate_provider.assert_not_called()
+        exported = os.path.join(self.dir_path, "exported.csv")
+        self.assertEqual(self._main("export", "-o", exported), 0)
+        with open(exported) as fh:
+            rows = list(csv.DictReader(fh))
+        self.assertEqual([row["name"] for row in rows], ["a", "b"])
+        self.assertEqual(rows[1]["harvestWindow"], "22:00 06:00")
+        self.assertEqual(rows[1]["lastHarvest"], "2020-01-01T12:00:00")
+        # Import into another registry
+        self.db = os.path.join(self.dir_path, "other.db")
+        self.assertEqual(self._main("import", exported), 0)
+        cxn = verify_database(self.db)
+        self.assertEqual(
+            cxn.execute(
+                "SELECT lastHarvest [timestamp] FROM providers WHERE name='b'"
+            ).fetchone()[0],
+            datetime(2020, 1, 1, 12),
+        )
+        # Already registered, unless replacing
+        self.assertEqual(self._main("import", exported), 1)
+        self.assertEqual(self._main("import", exported, "--replace"), 0)
+
+    def test_validate_timeout(self):
+        def validate_provider(provider, timeout):
+            time.sleep(1 if provider["name"] == "slow" else 0)
+            return None
+
+        with patch("oaiharvest.registry.validate_provider", validate_provider):
+            errors = validate_providers(
+                [{"name": "slow"}, {"name": "fast"}], timeout=0.2
+            )
+        self.assertEqual(list(errors), ["slow"])
+
+    @patch.dict(os.environ, {"TZ": "Europe/Paris"})
+    def test_utc_last_harvests(self):
+        time.tzset()
+        self.addCleanup(time.tzset)
+        cxn = sqlite3.connect(self.db)
+        cxn.execute(
+            "CREATE TABLE providers(id integer primary key, name varchar unique, "
+            "url varchar, destination varchar, metadataPrefix varchar, "
+            "lastHarvest timestamp)"
+        )
+        # Recorded in local time, before lastHarvest was UTC, or from --until
+        cxn.execute(
+            "INSERT INTO providers(name, lastHarvest) VALUES "
+            "('a', '2020-06-01 12:00:00.250000'), ('b', NULL), "
+            "('c', '2020-06-01 00:00:00')"
+        )
+        cxn.commit()
+        cxn.close()
+        for i in range(2):
+            # Converted only once
+            cxn = verify_database(self.db)
+            rows = cxn.execute(
+                "SELECT name, lastHarvest FROM providers ORDER BY name"
+            ).fetchall()
+            cxn.close()
+            self.assertEqual(
+                rows,
+                [
+                    ("a", datetime(2020, 6, 1, 10, 0, 0, 250000)),
+                    ("b", None),
+                    ("c", datetime(2020, 6, 1)),
+                ],
+            )
+
+    # Helpers
+
+    def _main(self, *argv):
+        return main(["--database", self.db, "-q"] + list(argv))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+
+from oaiharvest.exceptions import HarvestPausedException
+from oaiharvest.scheduler import HarvestJob, HarvestScheduler
+
+
+class HarvestSchedulerTestCase(unittest.TestCase):
+    def test_job_host(self):
+        job = HarvestJob("foo", "https://oai.example.com:8080/oai")
+        self.assertEqual(job.host, "oai.example.com")
+
+    def test_order_longest_first(self):
+        jobs = [
+            HarvestJob("short", "https://a.example.com", 10),
+            HarvestJob("new", "https://b.example.com"),
+            HarvestJob("long", "https://c.example.com", 100),
+        ]
+        ordered = HarvestScheduler().order(jobs)
+        self.assertEqual([job.name for job in ordered], ["new", "long", "short"])
+
+    def test_order_failing_last(self):
+        jobs = [
+            HarvestJob("failing", "https://a.example.com", 100, failures=1),
+            HarvestJob("healthy", "https://b.example.com", 10),
+        ]
+        ordered = HarvestScheduler().order(jobs)
+        self.assertEqual([job.name for job in ordered], ["healthy", "failing"])
+
+    def test_run_limits(self):
+        jobs = [
+            HarvestJob("{0}{1}".format(host, i), "https://{0}.example.com".format(host))
+            for host in ("a", "b")
+            for i in range(4)
+        ]
+        lock = threading.Lock()
+        running = Counter()
+        peaks = Counter()
+
+        def func(job):
+            with lock:
+                running[job.host] += 1
+                running["all"] += 1
+                for key in (job.host, "all"):
+                    peaks[key] = max(peaks[key], running[key])
+            time.sleep(0.01)
+            with lock:
+                running[job.host] -= 1
+                running["all"] -= 1
+            return job.name
+
+        scheduler = HarvestScheduler(maxWorkers=3, maxPerHost=2)
+        results = scheduler.run(jobs, func)
+        self.assertEqual(results, dict((job.name, job.name) for job in jobs))
+        self.assertLessEqual(peaks["all"], 3)
+        self.assertLessEqual(peaks["a.example.com"], 2)
+        self.assertLessEqual(peaks["b.example.com"], 2)
+
+    def test_run_exception(self):
+        def func(job):
+            raise ValueError(job.name)
+
+        results = HarvestScheduler().run([HarvestJob("a", "https://a.org")], func)
+        self.assertEqual(results, {"a": None})
+
+    def test_run_paused(self):
+        calls = []
+
+        def func(job):
+            calls.append(job.name)
+            if job.name == "paused" and job.notBefore is None:
+                raise HarvestPausedException(
+                    datetime.now() + timedelta(milliseconds=50), "token"
+                )
+            return job.name
+
+        jobs = [HarvestJob("paused", "https://a.org"), HarvestJob("b", "https://a.org")]
+        results = HarvestScheduler().run(jobs, func)
+        self.assertEqual(results, {"paused": "paused", "b": "b"})
+        # Paused job freed the worker for the other on the same host
+        self.assertEqual(calls, ["paused", "b", "paused"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from mock import patch
+from six import StringIO
+
+from oaiharvest.search import SearchIndex, main, record_text
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.path = os.path.join(self.dir_path, "search.db")
+        self.index = SearchIndex(self.path)
+        self.index.update(
+            "p",
+            [
+                ("oai:p:1", "oai_dc", "2020-01-01", "Café society"),
+                ("oai:p:2", "oai_dc", "2020-01-02", "Society of cafes"),
+            ],
+        )
+        self.index.update("q", [("oai:q:1", "marc", None, "Cafe culture")])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_search(self):
+        # Diacritics are ignored
+        self.assertEqual(
+            sorted(
+                (result.provider, result.identifier)
+                for result in self.index.search("cafe")
+            ),
+            [("p", "oai:p:1"), ("q", "oai:q:1")],
+        )
+        self.assertEqual(len(self.index.search("caf*", provider="p")), 2)
+        (result,) = self.index.search("cafe", metadataPrefix="marc")
+        self.assertEqual(result.identifier, "oai:q:1")
+        self.assertEqual(len(self.index.search("society", limit=1)), 1)
+        self.assertEqual(self.index.count("p"), 2)
+
+    def test_record_text(self):
+        self.assertEqual(
+            record_text("<a><b> Dark </b>\n<c>matter <d>ü</d></c></a>"),
+            "Dark matter ü",
+        )
+        self.assertEqual(record_text("<a>"), "<a>")
+        self.assertEqual(record_text(None), "")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_main(self, stdout):
+        self.assertEqual(main(["--index", self.path, "-q", "--json", "culture"]), 0)
+        (line,) = stdout.getvalue().splitlines()
+        self.assertEqual(json.loads(line)["snippet"], "Cafe [culture]")
+        self.assertEqual(main(["--index", self.path, "-q", "nothing"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
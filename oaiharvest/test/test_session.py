@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+from uuid import uuid4
+
+from mock import Mock, patch
+from oaipmh.common import Header
+
+from oaiharvest.cache import ResponseCache
+from oaiharvest.registry import verify_database
+from oaiharvest.session import HarvestSession, HarvestStats
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2020-06-01T12:00:00Z</responseDate>
+  <request>https://oai.example.com</request>
+  {0}
+</OAI-PMH>"""
+
+IDENTIFY = RESPONSE.format(
+    "<Identify><repositoryName>Example</repositoryName>"
+    "<baseURL>https://oai.example.com</baseURL>"
+    "<protocolVersion>2.0</protocolVersion>"
+    "<adminEmail>admin@example.com</adminEmail>"
+    "<earliestDatestamp>2000-01-01T00:00:00Z</earliestDatestamp>"
+    "<deletedRecord>persistent</deletedRecord>"
+    "<granularity>YYYY-MM-DDThh:mm:ssZ</granularity></Identify>"
+)
+
+LIST_RECORDS = RESPONSE.format(
+    "<ListRecords><record><header><identifier>oai:x:1</identifier>"
+    "<datestamp>2020-01-01T00:00:00Z</datestamp></header>"
+    "<metadata><dc>data</dc></metadata></record></ListRecords>"
+)
+
+
+def _make_pyoai_record(deleted=False):
+    header = Mock(spec_set=Header)
+    header.identifier.return_value = str(uuid4())
+    header.isDeleted.return_value = deleted
+    return (header, "<xml>data</xml>", Mock())
+
+
+@patch("oaiharvest.harvesters.base.Client")
+class HarvestSessionTestCase(unittest.TestCase):
+    url = "https://oai.example.com"
+
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.session = HarvestSession()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_harvest(self, MockClient):
+        client = MockClient.return_value
+        client.listRecords.side_effect = lambda **kwargs: iter(
+            [_make_pyoai_record(), _make_pyoai_record(), _make_pyoai_record(True)]
+        )
+        client.responseDate = datetime(2020, 1, 1)
+        stats = self.session.harvest(self.url, self.dir_path)
+        self.assertIsInstance(stats, HarvestStats)
+        self.assertTrue(stats.completed)
+        self.assertEqual((stats.records, stats.deleted), (2, 1))
+        self.assertEqual(stats.watermark, datetime(2020, 1, 1))
+        self.assertEqual(len(os.listdir(self.dir_path)), 2)
+        # The client reports pages to a counter of this harvest only
+        self.assertIsNotNone(client.onPage)
+
+    def test_records(self, MockClient):
+        client = MockClient.return_value
+        client.listRecords.return_value = iter([_make_pyoai_record()] * 3)
+        records = list(self.session.records(self.url, set="a"))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(
+            client.listRecords.call_args[1], {"metadataPrefix": "oai_dc", "set": "a"}
+        )
+
+    def test_async(self, MockClient):
+        client = MockClient.return_value
+        client.listRecords.side_effect = lambda **kwargs: iter(
+            [_make_pyoai_record() for i in range(5)]
+        )
+        dirs = [os.path.join(self.dir_path, name) for name in ("a", "b")]
+
+        async def run():
+            stats = await asyncio.gather(
+                *(self.session.harvest_async(self.url, d) for d in dirs)
+            )
+            records = [r async for r in self.session.arecords(self.url, batchSize=2)]
+            return stats, records
+
+        stats, records = asyncio.run(run())
+        self.assertEqual([s.records for s in stats], [5, 5])
+        self.assertEqual([len(os.listdir(d)) for d in dirs], [5, 5])
+        self.assertEqual(len(records), 5)
+
+
+class HarvestSessionCacheTestCase(unittest.TestCase):
+    url = "https://oai.example.com"
+
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.cxn = verify_database(":memory:")
+        self.session = HarvestSession(responseCache=ResponseCache(self.cxn))
+
+    def tearDown(self):
+        self.session.close()
+        self.cxn.close()
+        shutil.rmtree(self.dir_path)
+
+    @patch("oaiharvest.client.Client._retrieve")
+    def test_async(self, retrieve):
+        retrieve.side_effect = lambda kw, headers=None, get=False: (
+            (IDENTIFY if kw["verb"] == "Identify" else LIST_RECORDS).encode("utf-8"),
+            {},
+        )
+        dirs = [os.path.join(self.dir_path, name) for name in ("a", "b", "c")]
+
+        async def run():
+            return await asyncio.gather(
+                *(self.session.harvest_async(self.url, d) for d in dirs)
+            )
+
+        # Harvests in other threads use the cache created in this one
+        stats = asyncio.run(run())
+        self.assertEqual([s.records for s in stats], [1, 1, 1])
+        self.assertIsNotNone(self.session.responseCache.get(self.url, "verb=Identify"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from oaipmh.common import Header
+
+from oaiharvest.record import Record
+from oaiharvest.stores.columnar_store import ColumnarRecordStore
+
+try:
+    import pyarrow.dataset
+except ImportError:
+    pyarrow = None
+
+METADATA = """<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
+           xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <dc:title>Title ü</dc:title>
+  <dc:creator>A</dc:creator>
+  <dc:creator>B</dc:creator>
+</oai_dc:dc>"""
+
+
+@unittest.skipIf(pyarrow is None, "requires pyarrow")
+class ColumnarRecordStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_parquet(self):
+        store = ColumnarRecordStore(self.dir_path, source="foo", batchSize=3)
+        for i in range(3):
+            store.write(self._make_record("oai:x:{0}".format(i)), "oai_dc")
+        store.delete(self._make_record("oai:x:0", deleted=True), "oai_dc")
+        # One full batch written so far
+        self.assertEqual(len(os.listdir(self.dir_path)), 1)
+        store.flush()
+        self.assertEqual(len(os.listdir(self.dir_path)), 2)
+        rows = pyarrow.dataset.dataset(self.dir_path).to_table().to_pylist()
+        self.assertEqual(len(rows), 4)
+        row = rows[0]
+        self.assertEqual(row["identifier"], "oai:x:0")
+        self.assertEqual(row["datestamp"], datetime(2020, 1, 1))
+        self.assertEqual(row["setSpec"], ["a"])
+        self.assertEqual(row["source"], "foo")
+        self.assertEqual(row["dc_title"], ["Title ü"])
+        self.assertEqual(row["dc_creator"], ["A", "B"])
+        self.assertEqual(row["dc_date"], [])
+        deleted = rows[-1]
+        self.assertTrue(deleted["deleted"])
+        self.assertIsNone(deleted["dc_title"])
+
+    def test_arrow_fields(self):
+        store = ColumnarRecordStore(
+            self.dir_path,
+            fields={"creators": "count(//dc:creator)", "first": "//dc:creator[1]"},
+            format="arrow",
+        )
+        store.write(self._make_record("oai:x:1"), "oai_dc")
+        store.close()
+        (filename,) = os.listdir(self.dir_path)
+        self.assertTrue(filename.endswith(".arrow"))
+        table = pyarrow.dataset.dataset(self.dir_path, format="feather").to_table()
+        self.assertEqual(table["creators"].to_pylist(), [["2.0"]])
+        self.assertEqual(table["first"].to_pylist(), [["A"]])
+
+    def test_field_clash(self):
+        with self.assertRaises(ValueError):
+            ColumnarRecordStore(self.dir_path, fields={"identifier": "//dc:title"})
+
+    # Helpers
+
+    def _make_record(self, identifier, deleted=False):
+        header = Header(None, identifier, datetime(2020, 1, 1), ["a"], deleted)
+        return Record(header, None if deleted else METADATA, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from mock import Mock, patch
+from oaipmh.common import Header
+from six.moves.urllib import parse as urllib
+
+from oaiharvest.record import Record
+from oaiharvest.stores.directory_store import DirectoryRecordStore, FilenameQuoter
+
+
+class DirectoryRecordStoreTestCase(unittest.TestCase):
+    identifiers = ["oai:example.com:1", "oai:example.com:a/b", "oai:ü/100%"]
+
+    def setUp(self):
+        self.dir_path = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_get_output_filepath(self):
+        store = DirectoryRecordStore(self.dir_path)
+        fp = store._get_output_filepath(self._make_header("oai:x:a/b"), "oai_dc")
+        self.assertEqual(fp, os.path.join(self.dir_path, "oai:x:a%2Fb.oai_dc.xml"))
+
+    def test_get_output_filepath_sharded(self):
+        store = DirectoryRecordStore(self.dir_path, shardDepth=2, shardWidth=3)
+        fp = store._get_output_filepath(self._make_header("oai:x:a/b"), "oai_dc")
+        parts = os.path.relpath(fp, self.dir_path).split(os.path.sep)
+        self.assertEqual(len(parts), 3)
+        self.assertEqual([len(part) for part in parts[:2]], [3, 3])
+        self.assertEqual(parts[2], "oai:x:a%2Fb.oai_dc.xml")
+
+    def test_filename_quoter(self):
+        filenames = self.identifiers + ["".join(chr(i) for i in range(1, 256))]
+        for safe in ("", ":", ":/"):
+            quote = FilenameQuoter(safe)
+            for filename in filenames:
+                self.assertEqual(quote(filename), urllib.quote(filename, safe))
+
+    def test_parse_filepath(self):
+        for kwargs in ({}, {"createSubDirs": True}, {"shardDepth": 2}):
+            store = DirectoryRecordStore(self.dir_path, **kwargs)
+            for identifier in self.identifiers:
+                fp = store.get_filepath(identifier, "oai_dc")
+                self.assertEqual(store.parse_filepath(fp), (identifier, "oai_dc"))
+
+    def test_reshard(self):
+        flat = DirectoryRecordStore(self.dir_path)
+        sharded = DirectoryRecordStore(self.dir_path, shardDepth=2, shardWidth=1)
+        for identifier in self.identifiers:
+            flat.write(self._make_record(identifier), "oai_dc")
+
+        self.assertEqual(sharded.reshard(flat), len(self.identifiers))
+        for identifier in self.identifiers:
+            self.assertTrue(os.path.exists(sharded.get_filepath(identifier, "oai_dc")))
+        self.assertEqual(len(list(sharded.iter_filepaths())), len(self.identifiers))
+
+        flat.reshard(sharded)
+        self.assertEqual(
+            sorted(os.listdir(self.dir_path)),
+            sorted(
+                os.path.basename(flat.get_filepath(identifier, "oai_dc"))
+                for identifier in self.identifiers
+            ),
+        )
+
+    def test_reshard_keeps_other_directories(self):
+        nested = DirectoryRecordStore(self.dir_path, createSubDirs=True)
+        for identifier in self.identifiers:
+            nested.write(self._make_record(identifier), "oai_dc")
+        empty = os.path.join(self.dir_path, "empty")
+        os.mkdir(empty)
+        sharded = DirectoryRecordStore(self.dir_path, shardDepth=1, shardWidth=1)
+        self.assertEqual(sharded.reshard(nested), len(self.identifiers))
+        # Directories emptied by moving files are removed, but no others
+        self.assertTrue(os.path.isdir(empty))
+        self.assertFalse(os.path.exists(os.path.join(self.dir_path, "oai:ü")))
+        self.assertEqual(len(list(sharded.iter_filepaths())), len(self.identifiers))
+
+    def test_delete_batch(self):
+        store = DirectoryRecordStore(
+            self.dir_path, deleteBatchSize=3, deleteWorkers=2, cacheEntries=True
+        )
+        records = [self._make_record("oai:x:{0}".format(i)) for i in range(4)]
+        for record in records:
+            store.write(record, "oai_dc")
+        store.delete(records[0], "oai_dc")
+        store.delete(self._make_record("oai:x:never"), "oai_dc")
+        self.assertEqual(len(os.listdir(self.dir_path)), 4)
+        # Stored again before the batch was removed
+        store.write(records[0], "oai_dc")
+        store.delete(records[1], "oai_dc")
+        store.delete(records[2], "oai_dc")
+        # Batch full
+        self.assertEqual(
+            sorted(os.listdir(self.dir_path)),
+            sorted(
+                os.path.basename(store.get_filepath(identifier, "oai_dc"))
+                for identifier in ("oai:x:0", "oai:x:3")
+            ),
+        )
+        self.assertEqual((store.deleted, store.missing), (2, 1))
+        # Threads are kept for the next batch
+        executor = store._executor
+        self.assertIsNotNone(executor)
+        store.delete(records[3], "oai_dc")
+        store.flush()
+        self.assertIs(store._executor, executor)
+        self.assertEqual(
+            os.listdir(self.dir_path),
+            [os.path.basename(store.get_filepath("oai:x:0", "oai_dc"))],
+        )
+        self.assertEqual((store.deleted, store.missing), (0, 0))
+        store.close()
+        self.assertIsNone(store._executor)
+
+    def test_directory_created_concurrently(self):
+        directory = os.path.join(self.dir_path, "records")
+        store = DirectoryRecordStore(directory)
+        makedirs = os.makedirs
+
+        def created_by_another(path):
+            makedirs(path)
+            raise OSError("File exists")
+
+        with patch("os.makedirs", side_effect=created_by_another):
+            store.write(self._make_record("oai:x:1"), "oai_dc")
+        store.close()
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    # Helpers
+
+    def _make_header(self, identifier):
+        header = Mock(spec_set=Header)
+        header.identifier.return_value = identifier
+        header.isDeleted.return_value = False
+        return header
+
+    def _make_record(self, identifier):
+        return Record(self._make_header(identifier), "<xml>data</xml>", None)
+
+
+if __name__ == "__main__":
+    unittest.main()
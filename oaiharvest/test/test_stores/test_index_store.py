@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from mock import patch
+from oaipmh.common import Header
+
+from oaiharvest.record import Record
+from oaiharvest.search import SearchIndex
+from oaiharvest.stores.directory_store import DirectoryRecordStore
+from oaiharvest.stores.index_store import IndexedRecordStore
+
+
+class IndexedRecordStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.index_path = os.path.join(self.dir_path, "index", "search.db")
+        self.store = IndexedRecordStore(
+            DirectoryRecordStore(os.path.join(self.dir_path, "records")),
+            self.index_path,
+            "p",
+        )
+        self.index = SearchIndex(self.index_path)
+
+    def tearDown(self):
+        self.index.close()
+        self.store.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_end_page(self):
+        self.store.write(self._make_record("oai:x:1", "Dark matter"), "oai_dc")
+        self.store.write(self._make_record("oai:x:2", "Dark energy"), "oai_dc")
+        # Not indexed until the end of the page
+        self.assertEqual(self.index.count(), 0)
+        self.store.end_page()
+        self.assertEqual(
+            [result.identifier for result in self.index.search("dark")],
+            ["oai:x:1", "oai:x:2"],
+        )
+        (result,) = self.index.search("matter")
+        self.assertEqual(result.datestamp, "2020-01-01T00:00:00Z")
+        self.assertEqual(result.snippet, "Dark [matter]")
+        # Records are written to the store too
+        self.assertEqual(len(os.listdir(os.path.join(self.dir_path, "records"))), 2)
+
+    def test_update(self):
+        self.store.write(self._make_record("oai:x:1", "Dark matter"), "oai_dc")
+        self.store.write(self._make_record("oai:x:2", "Dark energy"), "oai_dc")
+        self.store.flush()
+        self.store.write(self._make_record("oai:x:1", "Bright matter"), "oai_dc")
+        self.store.delete(self._make_record("oai:x:2", deleted=True), "oai_dc")
+        # Deleting a record that was never indexed
+        self.store.delete(self._make_record("oai:x:3", deleted=True), "oai_dc")
+        self.store.flush()
+        self.assertEqual(self.index.count(), 1)
+        self.assertEqual(self.index.search("dark"), [])
+        (result,) = self.index.search("bright")
+        self.assertEqual(result.identifier, "oai:x:1")
+
+    def test_close_failed(self):
+        self.store.write(self._make_record("oai:x:1", "Dark matter"), "oai_dc")
+        with patch.object(self.store.store, "close", side_effect=IOError):
+            self.assertRaises(IOError, self.store.close)
+        # Records written before closing failed are indexed
+        self.assertEqual(self.index.count(), 1)
+
+    # Helpers
+
+    def _make_record(self, identifier, title=None, deleted=False):
+        header = Header(None, identifier, datetime(2020, 1, 1), ["a"], deleted)
+        metadata = None
+        if not deleted:
+            metadata = (
+                '<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/'
+                'oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                "<dc:title>{0}</dc:title></oai_dc:dc>".format(title)
+            )
+        return Record(header, metadata, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
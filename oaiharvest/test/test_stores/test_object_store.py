@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+
+from mock import Mock
+from oaipmh.common import Header
+
+from oaiharvest.record import Record
+from oaiharvest.stores.object_store import (
+    LocalObjectClient,
+    ObjectRecordStore,
+    object_client,
+)
+
+
+class FlakyClient(LocalObjectClient):
+    """Fails the first request for each key, slowly."""
+
+    def __init__(self, directory):
+        LocalObjectClient.__init__(self, directory)
+        self.failed = set()
+        self.inFlight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def put_object(self, key, body):
+        with self.lock:
+            self.inFlight += 1
+            self.peak = max(self.peak, self.inFlight)
+        try:
+            time.sleep(0.005)
+            if key not in self.failed:
+                self.failed.add(key)
+                raise IOError("Service unavailable")
+            LocalObjectClient.put_object(self, key, body)
+        finally:
+            with self.lock:
+                self.inFlight -= 1
+
+
+class ObjectRecordStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_object_client(self):
+        client, prefix = object_client("file://" + self.dir_path)
+        self.assertIsInstance(client, LocalObjectClient)
+        self.assertEqual(client.directory, os.sep)
+        self.assertEqual(prefix, self.dir_path.lstrip(os.sep) + "/")
+        store = ObjectRecordStore(client, prefix)
+        store.write(self._make_record("oai:x:1"), "oai_dc")
+        store.close()
+        self.assertEqual(
+            list(client.list_keys(prefix)), [prefix + "oai:x:1.oai_dc.xml"]
+        )
+        self.assertEqual(os.listdir(self.dir_path), ["oai:x:1.oai_dc.xml"])
+        with self.assertRaises(ValueError):
+            object_client("ftp://example.com/records")
+
+    def test_write_delete(self):
+        store = ObjectRecordStore(LocalObjectClient(self.dir_path), "p/")
+        for i in range(5):
+            store.write(self._make_record("oai:x:{0}".format(i)), "oai_dc")
+        store.delete(self._make_record("oai:x:1"), "oai_dc")
+        store.delete(self._make_record("oai:x:2"), "oai_dc")
+        # Stored again before deletion was sent
+        store.write(self._make_record("oai:x:2"), "oai_dc")
+        store.close()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.dir_path, "p"))),
+            ["oai:x:{0}.oai_dc.xml".format(i) for i in (0, 2, 3, 4)],
+        )
+
+    def test_keys(self):
+        client = Mock()
+        store = ObjectRecordStore(client, "p/")
+        store.write(self._make_record("oai:x:a/b ü"), "oai_dc")
+        store.close()
+        # Keys are the same whichever platform harvested the records
+        self.assertEqual(
+            client.put_object.call_args[0][0], "p/oai:x:a%2Fb%20%C3%BC.oai_dc.xml"
+        )
+
+    def test_retries_bounded(self):
+        client = FlakyClient(self.dir_path)
+        store = ObjectRecordStore(client, maxInFlight=3, backoff=0)
+        for i in range(20):
+            store.write(self._make_record("oai:x:{0}".format(i)), "oai_dc")
+        store.close()
+        self.assertEqual(len(os.listdir(self.dir_path)), 20)
+        self.assertLessEqual(client.peak, 3)
+
+    def test_failure_reported(self):
+        client = Mock()
+        client.put_object.side_effect = IOError("Access denied")
+        store = ObjectRecordStore(client, maxRetries=1, backoff=0)
+        store.write(self._make_record("oai:x:1"), "oai_dc")
+        with self.assertRaises(IOError):
+            store.flush()
+        self.assertEqual(client.put_object.call_count, 2)
+        store.close()
+
+    # Helpers
+
+    def _make_record(self, identifier):
+        header = Mock(spec_set=Header)
+        header.identifier.return_value = identifier
+        return Record(header, "<xml>data</xml>", None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from oaipmh.common import Header
+
+from oaiharvest.record import Record
+from oaiharvest.stores.columnar_store import ColumnarRecordStore
+from oaiharvest.stores.directory_store import DirectoryRecordStore
+from oaiharvest.stores.object_store import LocalObjectClient, ObjectRecordStore
+from oaiharvest.stores.reader import (
+    ColumnarRecordReader,
+    DirectoryRecordReader,
+    ObjectRecordReader,
+    StreamRecordReader,
+    open_reader,
+)
+from oaiharvest.stores.stream_store import StreamRecordStore
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+METADATA = """<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
+           xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <dc:title>Title {0} ü</dc:title>
+</oai_dc:dc>"""
+
+
+class RecordReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_stream_json(self):
+        self._check_stream("json")
+
+    def test_stream_xml(self):
+        self._check_stream("xml")
+
+    def test_stream_empty(self):
+        path = os.path.join(self.dir_path, "records.xml")
+        open(path, "wb").close()
+        with open_reader(path) as reader:
+            self.assertEqual(list(reader), [])
+            self.assertIsNone(reader.get("oai:x:1"))
+
+    def test_directory(self):
+        store = DirectoryRecordStore(self.dir_path, shardDepth=1)
+        self._write(store)
+        reader = open_reader(self.dir_path, shardDepth=1)
+        self.assertIsInstance(reader, DirectoryRecordReader)
+        self.assertEqual(
+            sorted(record.header.identifier() for record in reader),
+            ["oai:x:2", "oai:x:3", "oai:x:<1>"],
+        )
+        record = reader.get("oai:x:3")
+        self.assertEqual(record.metadata, METADATA.format(3))
+        self.assertIsNone(reader.get("oai:x:0"))
+        # Directories do not keep datestamps
+        with self.assertRaises(ValueError):
+            list(reader.iter_records(from_=datetime(2020, 1, 1)))
+
+    def test_object(self):
+        client = LocalObjectClient(self.dir_path)
+        store = ObjectRecordStore(client, prefix="foo/")
+        self._write(store)
+        store.close()
+        client.put_object("bar/oai%3Ax%3A9.oai_dc.xml", b"<xml/>")
+        reader = ObjectRecordReader(client, "foo/")
+        self.assertEqual(
+            sorted(record.header.identifier() for record in reader),
+            ["oai:x:2", "oai:x:3", "oai:x:<1>"],
+        )
+        self.assertEqual(reader.get("oai:x:<1>").metadata, METADATA.format(1))
+        self.assertIsNone(reader.get("oai:x:0"))
+        self.assertIsNone(reader.get("oai:x:9"))
+
+    @unittest.skipIf(pyarrow is None, "requires pyarrow")
+    def test_columnar(self):
+        for format in ("parquet", "arrow"):
+            path = os.path.join(self.dir_path, format)
+            store = ColumnarRecordStore(path, format=format, batchSize=2)
+            self._write(store)
+            store.close()
+            reader = open_reader(path)
+            self.assertIsInstance(reader, ColumnarRecordReader)
+            records = list(reader.iter_records(set="a"))
+            self.assertEqual(
+                [record.header.identifier() for record in records],
+                ["oai:x:3", "oai:x:<1>"],
+            )
+            self.assertEqual(records[-1].fields["dc_title"], ["Title 1 ü"])
+            self.assertIsNone(records[-1].metadata)
+            self.assertEqual(
+                reader.get("oai:x:2").header.datestamp(), datetime(2020, 1, 2)
+            )
+            self.assertIsNone(reader.get("oai:x:0"))
+            # Files are scanned for identifiers once, not on every lookup
+            index = reader._index
+            self.assertIsNotNone(index)
+            self.assertEqual(reader.get("oai:x:3").header.identifier(), "oai:x:3")
+            self.assertIs(reader._index, index)
+
+    # Helpers
+
+    def _check_stream(self, format):
+        path = os.path.join(self.dir_path, "records." + format)
+        with open(path, "wb") as stream:
+            store = StreamRecordStore(stream, format, source="foo")
+            self._write(store)
+            store.close()
+        reader = open_reader(path)
+        self.assertIsInstance(reader, StreamRecordReader)
+        self.assertEqual(reader.format, format)
+        records = list(reader)
+        # Latest versions only, in the order written
+        self.assertEqual(
+            [record.header.identifier() for record in records],
+            ["oai:x:2", "oai:x:3", "oai:x:<1>"],
+        )
+        record = records[-1]
+        self.assertIsInstance(record.raw, memoryview)
+        self.assertEqual(record.metadata, METADATA.format(1))
+        self.assertEqual(record.header.datestamp(), datetime(2020, 1, 4))
+        self.assertEqual(record.header.setSpec(), ["a:b", "c"])
+        self.assertEqual(record.source, "foo")
+        # Filters
+        self.assertEqual(
+            [
+                [record.header.identifier() for record in batch]
+                for batch in reader.iter_batches(
+                    2, from_=datetime(2020, 1, 2), until=datetime(2020, 1, 4)
+                )
+            ],
+            [["oai:x:2", "oai:x:3"], ["oai:x:<1>"]],
+        )
+        self.assertEqual(
+            [record.header.identifier() for record in reader.iter_records(set="a")],
+            ["oai:x:3", "oai:x:<1>"],
+        )
+        self.assertEqual(list(reader.iter_records(set="a:c")), [])
+        # Look-ups
+        self.assertEqual(reader.get("oai:x:3").metadata, METADATA.format(3))
+        self.assertIsNone(reader.get("oai:x:3", "mods"))
+        self.assertIsNone(reader.get("oai:x:0"))
+        del record, records
+        reader.close()
+
+    def _write(self, store):
+        """Write records, rewriting one and deleting another."""
+        store.write(self._make_record("oai:x:0", 1, ["a"]), "oai_dc")
+        store.write(self._make_record("oai:x:<1>", 1, ["a:b", "c"]), "oai_dc")
+        store.write(self._make_record("oai:x:2", 2, []), "oai_dc")
+        store.write(self._make_record("oai:x:3", 3, ["a"]), "oai_dc")
+        store.write(self._make_record("oai:x:<1>", 4, ["a:b", "c"]), "oai_dc")
+        store.delete(self._make_record("oai:x:0", 5, ["a"], deleted=True), "oai_dc")
+
+    def _make_record(self, identifier, day, setSpec, deleted=False):
+        header = Header(None, identifier, datetime(2020, 1, day), setSpec, deleted)
+        title = identifier.rsplit(":", 1)[-1].strip("<>")
+        return Record(header, None if deleted else METADATA.format(title), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+from datetime import datetime
+from io import BytesIO
+
+from oaipmh.common import Header
+
+from oaiharvest.record import Record
+from oaiharvest.stores.stream_store import StreamRecordStore
+
+
+class StreamRecordStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stream = BytesIO()
+
+    def test_json(self):
+        store = StreamRecordStore(self.stream, "json", source="foo")
+        store.write(self._make_record("oai:x:1"), "oai_dc")
+        store.delete(self._make_record("oai:x:2", deleted=True), "oai_dc")
+        store.flush()
+        lines = self.stream.getvalue().decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 2)
+        written, deleted = [json.loads(line) for line in lines]
+        self.assertEqual(written["event"], "write")
+        self.assertEqual(written["identifier"], "oai:x:1")
+        self.assertEqual(written["datestamp"], "2020-01-01T00:00:00Z")
+        self.assertEqual(written["setSpec"], ["a"])
+        self.assertEqual(written["source"], "foo")
+        self.assertEqual(written["metadata"], "<xml>data ü</xml>")
+        self.assertEqual(deleted["event"], "delete")
+        self.assertNotIn("metadata", deleted)
+
+    def test_xml(self):
+        store = StreamRecordStore(self.stream, "xml")
+        store.write(self._make_record("oai:x:<1>"), "oai_dc")
+        store.delete(self._make_record("oai:x:2", deleted=True), "oai_dc")
+        store.flush()
+        data = BytesIO(self.stream.getvalue())
+        elements = []
+        while True:
+            length = data.readline()
+            if not length:
+                break
+            elements.append(data.read(int(length)).decode("utf-8"))
+            self.assertEqual(data.read(1), b"\n")
+        self.assertEqual(len(elements), 2)
+        self.assertTrue(elements[0].startswith('<record identifier="oai:x:&lt;1&gt;"'))
+        self.assertTrue(elements[0].endswith("><xml>data ü</xml></record>"))
+        self.assertIn('status="deleted"', elements[1])
+
+    def test_buffered(self):
+        store = StreamRecordStore(self.stream, bufferSize=1000)
+        store.write(self._make_record("oai:x:1"), "oai_dc")
+        self.assertEqual(self.stream.getvalue(), b"")
+        for i in range(10):
+            store.write(self._make_record("oai:x:1"), "oai_dc")
+        self.assertNotEqual(self.stream.getvalue(), b"")
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            StreamRecordStore(self.stream, "csv")
+
+    # Helpers
+
+    def _make_record(self, identifier, deleted=False):
+        header = Header(None, identifier, datetime(2020, 1, 1), ["a"], deleted)
+        return Record(header, None if deleted else "<xml>data ü</xml>", None)
+
+
+if __name__ == "__main__":
+    unittest.main()
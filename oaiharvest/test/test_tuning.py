@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime, timedelta
+from tempfile import mkdtemp
+
+from mock import Mock
+
+from oaiharvest.client import Page
+from oaiharvest.registry import verify_database
+from oaiharvest.tuning import (
+    PageStats,
+    TuningRegistry,
+    list_size,
+    sets_cover,
+    slices,
+)
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2020-06-01T12:00:00Z</responseDate>
+  {0}
+</OAI-PMH>"""
+
+
+class TuningRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.cxn = verify_database(os.path.join(self.dir_path, "registry.db"))
+        self.tuning = TuningRegistry(
+            self.cxn, maxPartitions=4, parallelAfter=60, history=10
+        )
+
+    def tearDown(self):
+        self.cxn.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_record_pages(self):
+        self._record_pages("a", 8, seconds=2.0, listSize=1000)
+        self._record_pages("a", 8, seconds=4.0, listSize=100)
+        self._record_pages("b", 1, seconds=1.0)
+        tuning = self.tuning.get("a")
+        # Only the latest pages are kept
+        self.assertEqual(tuning.pages, 10)
+        self.assertAlmostEqual(tuning.secondsPerPage, 3.6)
+        self.assertEqual(tuning.recordsPerPage, 10)
+        # The largest list tells how many records there are
+        self.assertEqual(tuning.listSize, 1000)
+        self.assertEqual(self.tuning.get("b").pages, 1)
+
+    def test_tune(self):
+        self._record_pages("a", 2, seconds=2.0, listSize=1000)
+        self.assertEqual(self.tuning.tune("a").strategy, "sequential")
+        self._record_pages("a", 8, seconds=2.0)
+        # 100 pages of 2s each
+        tuning = self.tuning.tune("a")
+        self.assertEqual((tuning.strategy, tuning.partitions), ("slices", 4))
+        self.assertEqual(self.tuning.get("a").reason, tuning.reason)
+        # Records are bunched in one slice
+        self.tuning.record_slices("a", [90, 5, 5, 0])
+        self.assertEqual(self.tuning.tune("a").strategy, "sets")
+        self.tuning.record_sets_cover("a", False)
+        self.assertEqual(self.tuning.tune("a").strategy, "slices")
+        # Quicker provider
+        self._record_pages("b", 10, seconds=0.1, listSize=1000)
+        tuning = self.tuning.tune("b")
+        self.assertEqual((tuning.strategy, tuning.partitions), ("sequential", 1))
+        self.assertEqual(self.tuning.partitions(tuning.expected_seconds(10000)), 2)
+
+    # Helpers
+
+    def _record_pages(self, provider, pages, seconds, listSize=None):
+        stats = PageStats()
+        for i in range(pages):
+            page = Page([None] * 10, "token", 1000, listSize, i * 10, seconds)
+            stats.add(page, complete=True)
+        self.tuning.record_pages(provider, stats)
+
+
+class TuningFunctionsTestCase(unittest.TestCase):
+    def test_slices(self):
+        start = datetime(2020, 1, 1)
+        self.assertEqual(
+            slices(start, datetime(2020, 1, 3), 4),
+            [
+                (start, start + timedelta(hours=12)),
+                (start + timedelta(hours=12), start + timedelta(hours=24)),
+                (start + timedelta(hours=24), start + timedelta(hours=36)),
+                (start + timedelta(hours=36), start + timedelta(hours=48)),
+            ],
+        )
+        # Whole days
+        self.assertEqual(
+            slices(start, datetime(2020, 1, 3), 4, dayGranularity=True),
+            [
+                (start, datetime(2020, 1, 2)),
+                (datetime(2020, 1, 2), datetime(2020, 1, 3)),
+            ],
+        )
+
+    def test_list_size(self):
+        client = Mock(_day_granularity=False)
+        client.makeRequest.return_value = RESPONSE.format(
+            "<ListIdentifiers><header/>"
+            '<resumptionToken completeListSize="42" cursor="0">1</resumptionToken>'
+            "</ListIdentifiers>"
+        ).encode("utf-8")
+        self.assertEqual(
+            list_size(client, "oai_dc", from_=datetime(2020, 1, 1), set="a"), 42
+        )
+        self.assertEqual(
+            client.makeRequest.call_args[1],
+            {
+                "verb": "ListIdentifiers",
+                "metadataPrefix": "oai_dc",
+                "from": "2020-01-01T00:00:00Z",
+                "set": "a",
+            },
+        )
+        # Whole list in one response
+        client.makeRequest.return_value = RESPONSE.format(
+            "<ListIdentifiers><header/><header/></ListIdentifiers>"
+        ).encode("utf-8")
+        self.assertEqual(list_size(client, "oai_dc"), 2)
+        client.makeRequest.return_value = RESPONSE.format(
+            '<error code="noRecordsMatch">None</error>'
+        ).encode("utf-8")
+        self.assertEqual(list_size(client, "oai_dc"), 0)
+        # Size not reported
+        client.makeRequest.return_value = RESPONSE.format(
+            "<ListIdentifiers><header/><resumptionToken>1</resumptionToken></ListIdentifiers>"
+        ).encode("utf-8")
+        self.assertIsNone(list_size(client, "oai_dc"))
+
+    def test_sets_cover(self):
+        client = Mock(_day_granularity=False)
+        pages = [
+            "<ListIdentifiers><header><setSpec>a</setSpec></header>"
+            "<header><setSpec>c</setSpec><setSpec>b:x</setSpec></header>"
+            "<resumptionToken>1</resumptionToken></ListIdentifiers>",
+            "<ListIdentifiers><header><setSpec>a</setSpec></header>"
+            "<header><setSpec>b</setSpec></header></ListIdentifiers>",
+        ]
+        client.makeRequest.side_effect = lambda **kwargs: RESPONSE.format(
+            pages[1 if "resumptionToken" in kwargs else 0]
+        ).encode("utf-8")
+        self.assertEqual(
+            sets_cover(client, "oai_dc", ["a", "b"], until=datetime(2020, 1, 1)),
+            datetime(2020, 6, 1, 12),
+        )
+        self.assertEqual(
+            client.makeRequest.call_args_list[0][1]["until"], "2020-01-01T00:00:00Z"
+        )
+        self.assertEqual(
+            client.makeRequest.call_args[1],
+            {"verb": "ListIdentifiers", "resumptionToken": "1"},
+        )
+        # A record in no set, although sets overlap so that sizes add up
+        pages[1] = (
+            "<ListIdentifiers><header><setSpec>a</setSpec><setSpec>b</setSpec>"
+            "</header><header/></ListIdentifiers>"
+        )
+        self.assertIsNone(sets_cover(client, "oai_dc", ["a", "b"]))
+        client.makeRequest.side_effect = None
+        client.makeRequest.return_value = RESPONSE.format(
+            '<error code="noRecordsMatch">None</error>'
+        ).encode("utf-8")
+        self.assertEqual(sets_cover(client, "oai_dc", ["a"]), datetime(2020, 6, 1, 12))
+
+
+if __name__ == "__main__":
+    unittest.main()
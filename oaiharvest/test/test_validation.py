@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+from mock import Mock, patch
+from oaipmh.common import Header
+from oaipmh.metadata import MetadataRegistry
+
+from oaiharvest.client import Page
+from oaiharvest.harvesters.directory_harvester import DirectoryOAIHarvester
+from oaiharvest.record import Record
+from oaiharvest.validation import RecordValidator, ValidationStats, parse_schema
+
+SCHEMA = """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="http://example.com/ns"
+           elementFormDefault="qualified">
+  <xs:element name="item">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="title" type="xs:string"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+
+VALID = '<item xmlns="http://example.com/ns"><title>ü</title></item>'
+INVALID = '<item xmlns="http://example.com/ns"><name>x</name></item>'
+
+
+class RecordValidatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.schema = os.path.join(self.dir_path, "item.xsd")
+        with open(self.schema, "w") as fh:
+            fh.write(SCHEMA)
+        self.quarantine = os.path.join(self.dir_path, "quarantine")
+        self.validator = RecordValidator(
+            {"item": self.schema}, workers=2, quarantine=self.quarantine
+        )
+
+    def tearDown(self):
+        self.validator.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_submit(self):
+        self.assertEqual(self.validator.submit(self.schema, VALID).result(), [])
+        (error,) = self.validator.submit(self.schema, INVALID).result()
+        self.assertTrue(error.startswith("line 1: "))
+        self.assertIn("name", error)
+        (error,) = self.validator.submit(self.schema, "<item>").result()
+        self.assertNotIn("line 1: ", error)
+        self.assertEqual(
+            self.validator.submit(self.schema, None).result(),
+            ["Record has no metadata"],
+        )
+
+    def test_record(self):
+        validator = self.validator.for_provider("a/b")
+        self.assertEqual(validator.schema_location("item", Mock()), self.schema)
+        valid, invalid = _record(VALID), _record(INVALID)
+        self.assertFalse(validator.record(valid, "item", []))
+        self.assertTrue(validator.record(invalid, "item", ["line 1: Bad"]))
+        self.assertFalse(validator.record(valid, "item", None))
+        stats = self.validator.stats()["a/b"]
+        self.assertEqual(
+            (stats.valid, stats.invalid, stats.quarantined, stats.unvalidated),
+            (1, 1, 1, 1),
+        )
+        self.validator.close()
+        # Quarantined in a directory of the provider's own, with its errors
+        (directory,) = os.listdir(self.quarantine)
+        directory = os.path.join(self.quarantine, directory)
+        self.assertEqual(
+            sorted(os.listdir(directory)), ["errors.jsonl", "invalid.item.xml"]
+        )
+        with open(os.path.join(directory, "errors.jsonl")) as fh:
+            (line,) = fh.readlines()
+        entry = json.loads(line)
+        self.assertEqual(entry["identifier"], "invalid")
+        self.assertEqual(entry["errors"], ["line 1: Bad"])
+
+    @patch("oaiharvest.validation.urlopen")
+    def test_slow_schema(self, urlopen):
+        fetching, release = threading.Event(), threading.Event()
+
+        def hang(location, timeout=None):
+            fetching.set()
+            release.wait(5)
+            raise IOError("timed out")
+
+        urlopen.side_effect = hang
+        validator = RecordValidator(timeout=30)
+        thread = threading.Thread(
+            target=self.assertRaises,
+            args=(IOError, validator.compile, "http://example.com/a.xsd"),
+        )
+        thread.start()
+        self.assertTrue(fetching.wait(5))
+        # Records from other providers are counted while the schema is fetched
+        validator.for_provider("p").record(_record(VALID), "item", [])
+        self.assertEqual(validator.stats()["p"].valid, 1)
+        release.set()
+        thread.join()
+        self.assertEqual(urlopen.call_args[1], {"timeout": 30})
+        validator.close()
+
+    def test_schema_location(self):
+        client = Mock()
+        client.listMetadataFormats.return_value = [
+            ("oai_dc", os.path.join(self.dir_path, "missing.xsd"), "ns"),
+            ("other", self.schema, "ns"),
+        ]
+        validator = self.validator.for_provider("p")
+        self.assertEqual(validator.schema_location("other", client), self.schema)
+        # Schema cannot be loaded
+        self.assertIsNone(validator.schema_location("oai_dc", client))
+        # Format not listed
+        self.assertIsNone(validator.schema_location("marc", client))
+
+    def test_stats(self):
+        stats = ValidationStats()
+        stats.valid, stats.invalid, stats.quarantined = 8, 2, 2
+        stats.errors.update(["Bad", "Bad", "Worse"])
+        self.assertEqual(
+            str(stats),
+            "8 valid, 2 invalid (2 quarantined); most common errors: "
+            "Bad (2); Worse (1)",
+        )
+
+    def test_parse_schema(self):
+        self.assertEqual(
+            parse_schema("oai_dc=http://example.com/oai_dc.xsd"),
+            ("oai_dc", "http://example.com/oai_dc.xsd"),
+        )
+        self.assertRaises(ValueError, parse_schema, "oai_dc")
+
+
+class ValidatingHarvesterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.schema = os.path.join(self.dir_path, "item.xsd")
+        with open(self.schema, "w") as fh:
+            fh.write(SCHEMA)
+        self.quarantine = mkdtemp()
+        self.validator = RecordValidator(quarantine=self.quarantine, maxPending=2)
+
+    def tearDown(self):
+        self.validator.close()
+        shutil.rmtree(self.dir_path)
+        shutil.rmtree(self.quarantine)
+
+    @patch("oaiharvest.harvesters.base.Client")
+    def test_harvest(self, MockClient):
+        client = MockClient.return_value
+        client.listMetadataFormats.return_value = [("item", self.schema, "ns")]
+        client.listRecords.return_value = iter(
+            [_pyoai_record(VALID, "r{0}".format(i)) for i in range(5)]
+            + [_pyoai_record(INVALID), _pyoai_record(None, "gone", deleted=True)]
+        )
+        output = os.path.join(self.dir_path, "output")
+        harvester = DirectoryOAIHarvester(
+            Mock(spec_set=MetadataRegistry),
+            output,
+            validator=self.validator.for_provider("p"),
+        )
+        self.assertTrue(harvester.harvest("https://oai.example.com", "item"))
+        self.assertEqual(
+            sorted(os.listdir(output)), ["r{0}.item.xml".format(i) for i in range(5)]
+        )
+        stats = self.validator.stats()["p"]
+        self.assertEqual((stats.valid, stats.invalid), (5, 1))
+        self.assertEqual(os.listdir(self.quarantine), ["p"])
+
+    @patch("oaiharvest.harvesters.base.Client")
+    def test_end_page(self, MockClient):
+        client = MockClient.return_value
+        client.listMetadataFormats.return_value = [("item", self.schema, "ns")]
+
+        def list_records(**kwargs):
+            for i in range(3):
+                yield _pyoai_record(VALID, "r{0}".format(i))
+            client.onPage(Page([], None))
+            yield _pyoai_record(VALID, "r3")
+
+        client.listRecords.side_effect = list_records
+        validator = RecordValidator(maxPending=10)
+        self.addCleanup(validator.close)
+        # Validation of every record is still pending when each page ends
+        pending = Mock(**{"done.return_value": False, "result.return_value": []})
+        output = os.path.join(self.dir_path, "output")
+        harvester = DirectoryOAIHarvester(
+            Mock(spec_set=MetadataRegistry),
+            output,
+            validator=validator.for_provider("p"),
+        )
+        stored = []
+        harvester.store.end_page = lambda: stored.append(len(os.listdir(output)))
+        with patch.object(validator, "submit", return_value=pending):
+            self.assertTrue(harvester.harvest("https://oai.example.com", "item"))
+        # Records of the previous page were stored before it ended
+        self.assertEqual(stored, [3])
+        self.assertEqual(len(os.listdir(output)), 4)
+
+
+def _record(metadata, identifier="invalid", deleted=False):
+    return Record(*_pyoai_record(metadata, identifier, deleted))
+
+
+def _pyoai_record(metadata, identifier="invalid", deleted=False):
+    header = Mock(spec_set=Header)
+    header.identifier.return_value = identifier
+    header.isDeleted.return_value = deleted
+    return (header, metadata, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
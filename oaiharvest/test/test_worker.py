@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from mock import patch
+
+from oaiharvest.harvest import main
+from oaiharvest.health import HealthRegistry
+from oaiharvest.registry import verify_database
+from oaiharvest.tuning import PageStats
+from oaiharvest.workqueue import WorkQueue
+
+
+@patch("oaiharvest.worker.make_harvester")
+class WorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.db = os.path.join(self.dir_path, "registry.db")
+        cxn = verify_database(self.db)
+        with cxn:
+            cxn.execute(
+                "INSERT INTO providers(name, url, destination, metadataPrefix, "
+                "lastHarvest) VALUES (?, ?, ?, ?, ?)",
+                (
+                    "p",
+                    "http://oai.example.com/oai",
+                    self.dir_path,
+                    "oai_dc",
+                    datetime.utcfromtimestamp(0),
+                ),
+            )
+        cxn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_slices(self, make_harvester):
+        harvester = make_harvester.return_value
+        harvester.record_getter.request_stats.return_value = (0, 0.0)
+        harvester.record_getter.pageStats = PageStats()
+        harvester.harvest.return_value = True
+        self._main(
+            "enqueue", "-f", "2020-01-01", "-u", "2020-01-07", "--slice", "3", "p"
+        )
+        self.assertEqual(self._main("worker", "--exit-when-idle"), 0)
+        self.assertEqual(
+            [
+                (call[1]["from_"], call[1]["until"])
+                for call in harvester.harvest.call_args_list
+            ],
+            [
+                (datetime(2020, 1, 1), datetime(2020, 1, 4)),
+                (datetime(2020, 1, 4), datetime(2020, 1, 7)),
+            ],
+        )
+        # lastHarvest is updated once the slices are done
+        self.assertEqual(self._last_harvest(), datetime(2020, 1, 7))
+        queue = WorkQueue(self.db)
+        self.assertEqual(queue.counts(), {"done": 2})
+        queue.close()
+
+    def test_resume(self, make_harvester):
+        harvester = make_harvester.return_value
+        harvester.record_getter.request_stats.return_value = (0, 0.0)
+        harvester.record_getter.pageStats = PageStats()
+        harvester.harvest.return_value = True
+        harvester.watermark = datetime(2020, 1, 2)
+        self._main("enqueue", "p")
+        # Worker crashed, having recorded where to continue
+        queue = WorkQueue(self.db)
+        task = queue.claim("crashed", lease=-1)
+        queue.checkpoint(task, "token", datetime(2020, 1, 2))
+        self._main("worker", "--exit-when-idle")
+        first, second = harvester.harvest.call_args_list
+        self.assertEqual(first[1]["resumptionToken"], "token")
+        self.assertEqual(first[1]["until"], datetime(2020, 1, 2))
+        self.assertEqual(second[1]["from_"], datetime(2020, 1, 2))
+        self.assertEqual(queue.counts(), {"done": 1})
+        queue.close()
+
+    def test_failure(self, make_harvester):
+        harvester = make_harvester.return_value
+        harvester.record_getter.request_stats.return_value = (0, 0.0)
+        harvester.record_getter.pageStats = PageStats()
+        harvester.harvest.side_effect = IOError("unreachable")
+        self._main("enqueue", "p")
+        self._main("worker", "--exit-when-idle", "--max-attempts", "1")
+        queue = WorkQueue(self.db)
+        (lastError,) = queue.cxn.execute("SELECT lastError FROM tasks").fetchone()
+        self.assertEqual(queue.counts(), {"failed": 1})
+        self.assertEqual(lastError, "unreachable")
+        queue.close()
+        cxn = verify_database(self.db)
+        self.assertEqual(HealthRegistry(cxn).get("p").failures, 1)
+        cxn.close()
+
+    def test_removed_provider(self, make_harvester):
+        self._main("enqueue", "p")
+        cxn = verify_database(self.db)
+        with cxn:
+            cxn.execute("DELETE FROM providers WHERE name='p'")
+        cxn.close()
+        self._main("worker", "--exit-when-idle", "--max-attempts", "3")
+        queue = WorkQueue(self.db)
+        # Failed at once, rather than retried
+        (attempts, lastError) = queue.cxn.execute(
+            "SELECT attempts, lastError FROM tasks"
+        ).fetchone()
+        self.assertEqual(queue.counts(), {"failed": 1})
+        self.assertEqual(attempts, 1)
+        self.assertIn("does not exists", lastError)
+        queue.close()
+        self.assertFalse(make_harvester.called)
+
+    # Helpers
+
+    def _main(self, command, *argv):
+        return main([command, "--db", self.db, "-q"] + list(argv))
+
+    def _last_harvest(self):
+        cxn = verify_database(self.db)
+        try:
+            return cxn.execute(
+                "SELECT lastHarvest [timestamp] FROM providers WHERE name='p'"
+            ).fetchone()[0]
+        finally:
+            cxn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime, timedelta
+from tempfile import mkdtemp
+
+from mock import patch
+
+from oaiharvest.workqueue import WorkQueue
+
+
+class WorkQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = mkdtemp()
+        self.db = os.path.join(self.dir_path, "registry.db")
+        self.queue = WorkQueue(self.db)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.dir_path)
+
+    def test_claim(self):
+        self.assertIsNotNone(self.queue.enqueue("a"))
+        self.assertIsNotNone(self.queue.enqueue("b"))
+        # Already queued
+        self.assertIsNone(self.queue.enqueue("a"))
+        first = self.queue.claim("w1")
+        second = self.queue.claim("w2")
+        self.assertEqual((first.provider, second.provider), ("a", "b"))
+        self.assertIsNone(self.queue.claim("w3"))
+        self.assertTrue(self.queue.heartbeat(first))
+        self.assertTrue(self.queue.complete(first))
+        self.assertEqual(self.queue.counts(), {"done": 1, "leased": 1})
+
+    def test_expired_lease(self):
+        self.queue.enqueue("a")
+        task = self.queue.claim("w1", lease=-1)
+        self.assertTrue(self.queue.checkpoint(task, "token", datetime(2020, 1, 1)))
+        # Another worker continues from the checkpoint
+        taken = self.queue.claim("w2")
+        self.assertEqual(taken.id, task.id)
+        self.assertEqual(taken.attempts, 2)
+        self.assertEqual(taken.resumptionToken, "token")
+        self.assertEqual(taken.watermark, datetime(2020, 1, 1))
+        # The first worker has lost the lease
+        self.assertFalse(self.queue.heartbeat(task))
+        self.assertFalse(self.queue.checkpoint(task, "other"))
+        self.assertFalse(self.queue.complete(task))
+
+    def test_release(self):
+        self.queue.enqueue("a")
+        task = self.queue.claim("w1")
+        later = datetime.utcnow() + timedelta(hours=1)
+        self.assertTrue(self.queue.release(task, "failed", notBefore=later))
+        self.assertIsNone(self.queue.claim("w1"))
+        with self._patch_now(later):
+            task = self.queue.claim("w1")
+        # Interruptions are not failures
+        self.queue.release(task)
+        task = self.queue.claim("w1")
+        self.assertEqual(task.attempts, 2)
+        self.queue.release(task, "failed", maxAttempts=2)
+        self.assertIsNone(self.queue.claim("w1"))
+        self.assertEqual(self.queue.counts(), {"failed": 1})
+
+    def test_completed_until(self):
+        days = [datetime(2020, 1, day) for day in (1, 2, 3, 4)]
+        for start, stop in zip(days, days[1:]):
+            self.queue.enqueue("a", start, stop, "batch")
+        tasks = [self.queue.claim("w1") for day in days[1:]]
+        self.assertEqual([task.fromTime for task in tasks], days[:-1])
+        self.queue.complete(tasks[0])
+        self.queue.complete(tasks[2])
+        self.assertEqual(self.queue.completed_until("a", "batch"), days[1])
+        self.queue.complete(tasks[1])
+        self.assertEqual(self.queue.completed_until("a", "batch"), days[3])
+        self.assertIsNone(self.queue.completed_until("b", "batch"))
+
+    # Helpers
+
+    def _patch_now(self, now):
+        class FakeDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return now
+
+        return patch("oaiharvest.workqueue.datetime", FakeDatetime)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""How to divide harvests from each provider, tuned from the history of its pages.
+
+OAI-PMH providers decide how many records to return in each page of a list,
+and a harvester cannot ask for larger or smaller pages. What a harvester can
+decide is how to divide a harvest into lists: a large harvest from a slow
+provider is quicker if several lists are requested at once.
+
+The number of records, size and response time of the recent pages from
+each provider are kept in the registry, with the size of the largest list
+of records harvested from it. After each harvest, one of these strategies
+is chosen for the provider and recorded, with the reason for choosing it,
+for its next harvest:
+
+``sequential``
+    a single list; chosen until enough pages have been received to tune
+    from, and for providers from which a complete harvest is expected to
+    take less than ``parallelAfter`` seconds
+``slices``
+    consecutive slices of datestamps, requested concurrently
+``sets``
+    the provider's top-level sets, requested concurrently; chosen instead of
+    slices when most records turned out to be in a single slice, i.e. when
+    their datestamps are bunched together. As records need not be in any
+    set, and may be in several, sets are only harvested if the header of
+    every record in the list of all records names one of them, and the
+    harvest then ends when that was checked
+
+Each harvest is only divided if it is itself expected to take longer than
+``parallelAfter`` seconds, into as many lists as would take that long, up to
+``maxPartitions``.
+"""
+import logging
+import math
+from collections import deque
+from datetime import datetime, timedelta
+
+from lxml import etree
+from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp
+from oaipmh.error import DatestampError
+
+from oaiharvest.parallel import find_list_position, find_resumption_token
+
+#: Ways of dividing a harvest into lists of records
+STRATEGIES = ("sequential", "slices", "sets")
+
+#: Number of recent pages from each provider to keep
+PAGE_HISTORY = 100
+
+#: Number of pages needed before tuning
+MIN_PAGES = 5
+
+#: Seconds that a harvest is expected to take before dividing it
+PARALLEL_AFTER = 600
+
+#: Fraction of the records of a harvest in one slice above which to try sets
+SKEW = 0.6
+
+_OAI_NS = "{http://www.openarchives.org/OAI/2.0/}"
+
+
+class PageStats(object):
+    """Sizes and response times of pages of records, collected in a harvest.
+
+    ``recent`` => (records, bytes, seconds) of each of the last ``history``
+    pages
+    ``pages``, ``records`` => total pages and records received
+    ``listSize`` => size of the largest list of records in any set, if
+    reported, i.e. at least how many records the provider has
+    """
+
+    def __init__(self, history=PAGE_HISTORY):
+        self.recent = deque(maxlen=history)
+        self.pages = 0
+        self.records = 0
+        self.listSize = None
+
+    def add(self, page, complete=False):
+        """Add an ``oaiharvest.client.Page``.
+
+        ``complete`` => whether the page is in a list of records in any set,
+        rather than in a single set
+        """
+        self.recent.append((len(page.records), page.size, page.seconds))
+        self.pages += 1
+        self.records += len(page.records)
+        if complete and page.completeListSize is not None:
+            self.listSize = max(self.listSize or 0, page.completeListSize)
+
+
+class ProviderTuning(object):
+    """How to harvest from a single provider, as recorded in the registry.
+
+    ``strategy`` => one of ``STRATEGIES``
+    ``partitions`` => number of lists to request concurrently
+    ``reason`` => why the strategy was chosen
+    ``listSize`` => number of records in the largest list harvested from
+    any set, as an estimate of the size of the complete list, or None if
+    unknown
+    ``skew`` => fraction of the records of the last harvest in slices that
+    were in the largest slice, or None
+    ``setsCover`` => whether the provider's top-level sets were found to
+    include all of its records, or None if unknown
+    ``pages`` => number of recent pages recorded
+    ``recordsPerPage``, ``bytesPerPage``, ``secondsPerPage`` => averages of
+    the recent pages, or None
+    """
+
+    def __init__(
+        self,
+        provider,
+        strategy="sequential",
+        partitions=1,
+        reason=None,
+        listSize=None,
+        skew=None,
+        setsCover=None,
+        updated=None,
+        pages=0,
+        recordsPerPage=None,
+        bytesPerPage=None,
+        secondsPerPage=None,
+    ):
+        self.provider = provider
+        self.strategy = strategy
+        self.partitions = partitions
+        self.reason = reason
+        self.listSize = listSize
+        self.skew = skew
+        self.setsCover = None if setsCover is None else bool(setsCover)
+        self.updated = updated
+        self.pages = pages
+        self.recordsPerPage = recordsPerPage
+        self.bytesPerPage = bytesPerPage
+        self.secondsPerPage = secondsPerPage
+
+    def expected_seconds(self, records=None):
+        """Return seconds expected to harvest ``records`` in a single list.
+
+        ``records`` => number of records, default ``listSize``
+
+        Return None if there is not enough history to tell.
+        """
+        if records is None:
+            records = self.listSize
+        if records is None or self.pages < MIN_PAGES or not self.recordsPerPage:
+            return None
+        return records / self.recordsPerPage * self.secondsPerPage
+
+
+class TuningRegistry(object):
+    """History of pages, and the tuned strategies, of providers in the registry.
+
+    ``cxn`` => instance of ``sqlite3.Connection`` as returned by
+    ``oaiharvest.registry.verify_database``
+    ``maxPartitions`` => largest number of lists to request concurrently
+    ``parallelAfter`` => seconds that a harvest is expected to take before
+    dividing it
+    ``history`` => number of recent pages of each provider to keep
+    """
+
+    def __init__(
+        self,
+        cxn,
+        maxPartitions=4,
+        parallelAfter=PARALLEL_AFTER,
+        history=PAGE_HISTORY,
+    ):
+        self.cxn = cxn
+        self.maxPartitions = maxPartitions
+        self.parallelAfter = parallelAfter
+        self.history = history
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def get(self, provider):
+        """Return the ``ProviderTuning`` of ``provider``."""
+        row = self.cxn.execute(
+            "SELECT strategy, partitions, reason, listSize, skew, setsCover, "
+            "updated [timestamp] FROM tuning WHERE provider=?",
+            (provider,),
+        ).fetchone()
+        pages = self.cxn.execute(
+            "SELECT count(*), avg(records), avg(bytes), avg(seconds) "
+            "FROM pages WHERE provider=?",
+            (provider,),
+        ).fetchone()
+        if row is None:
+            row = ("sequential", 1, None, None, None, None, None)
+        return ProviderTuning(provider, *(tuple(row) + tuple(pages)))
+
+    def record_pages(self, provider, stats):
+        """Record the pages of ``PageStats`` ``stats`` received from ``provider``.
+
+        Only the most recent ``history`` pages of the provider are kept.
+        """
+        now = datetime.now()
+        with self.cxn:
+            self.cxn.executemany(
+                "INSERT INTO pages(provider, received, records, bytes, seconds) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(provider, now) + page for page in stats.recent],
+            )
+            self.cxn.execute(
+                "DELETE FROM pages WHERE provider=? AND id NOT IN ("
+                "SELECT id FROM pages WHERE provider=? ORDER BY id DESC LIMIT ?)",
+                (provider, provider, self.history),
+            )
+        if stats.listSize is not None:
+            with self.cxn:
+                self.cxn.execute(
+                    "INSERT OR IGNORE INTO tuning(provider, strategy, partitions) "
+                    "VALUES (?, 'sequential', 1)",
+                    (provider,),
+                )
+                self.cxn.execute(
+                    "UPDATE tuning SET listSize=max(coalesce(listSize, 0), ?) "
+                    "WHERE provider=?",
+                    (stats.listSize, provider),
+                )
+
+    def record_slices(self, provider, records):
+        """Record the number of ``records`` harvested in each slice."""
+        total = sum(records)
+        if total and len(records) > 1:
+            self._update(provider, skew=max(records) / float(total))
+
+    def record_sets_cover(self, provider, cover):
+        """Record whether the top-level sets of ``provider`` cover all records."""
+        self._update(provider, setsCover=cover)
+
+    def tune(self, provider):
+        """Choose, record and return the ``ProviderTuning`` of ``provider``."""
+        tuning = self.get(provider)
+        previous = tuning.strategy
+        tuning.strategy, tuning.partitions, tuning.reason = self.choose(tuning)
+        if tuning.updated is not None and previous != tuning.strategy:
+            self.logger.info(
+                "Harvesting %s in %s from now on: %s",
+                provider,
+                tuning.strategy,
+                tuning.reason,
+            )
+        self._update(
+            provider,
+            strategy=tuning.strategy,
+            partitions=tuning.partitions,
+            reason=tuning.reason,
+            updated=datetime.now(),
+        )
+        return tuning
+
+    def choose(self, tuning):
+        """Return strategy, number of partitions and reason for ``tuning``."""
+        if tuning.pages < MIN_PAGES:
+            return (
+                "sequential",
+                1,
+                "{0} pages received; too few to tune from".format(tuning.pages),
+            )
+        expected = tuning.expected_seconds()
+        if expected is None:
+            return "sequential", 1, "size of the complete list is unknown"
+        description = "a complete harvest is expected to take {0:.0f}s".format(expected)
+        partitions = self.partitions(expected)
+        if partitions < 2:
+            return "sequential", 1, description
+        if tuning.skew is not None and tuning.skew >= SKEW:
+            if tuning.setsCover is not False:
+                return (
+                    "sets",
+                    partitions,
+                    "{0}, and {1:.0%} of records were in one slice of "
+                    "datestamps".format(description, tuning.skew),
+                )
+            description += "; sets do not include all records"
+        return "slices", partitions, description
+
+    def partitions(self, expected):
+        """Return number of lists in which to harvest for ``expected`` seconds."""
+        if expected is None or expected <= self.parallelAfter:
+            return 1
+        return int(min(self.maxPartitions, math.ceil(expected / self.parallelAfter)))
+
+    def _update(self, provider, **values):
+        with self.cxn:
+            self.cxn.execute(
+                "INSERT OR IGNORE INTO tuning(provider, strategy, partitions) "
+                "VALUES (?, 'sequential', 1)",
+                (provider,),
+            )
+            self.cxn.execute(
+                "UPDATE tuning SET {0} WHERE provider=?".format(
+                    ", ".join("{0}=?".format(name) for name in values)
+                ),
+                tuple(values.values()) + (provider,),
+            )
+
+
+def slices(start, end, count, dayGranularity=False):
+    """Return list of (from, until) of ``count`` consecutive slices.
+
+    Slices overlap at their boundaries, as both ``from`` and ``until`` are
+    inclusive. With ``dayGranularity``, boundaries are at midnight, and
+    there are fewer slices if there are fewer days.
+    """
+    size = (end - start) / count
+    if dayGranularity:
+        size = timedelta(days=max(1, math.ceil(size.total_seconds() / 86400)))
+    bounds = []
+    while start < end:
+        until = min(start + size, end)
+        bounds.append((start, until))
+        start = until
+    return bounds
+
+
+def top_level_sets(client):
+    """Return the specs of the sets at the top of a provider's hierarchy."""
+    return sorted(
+        spec for spec, name, description in client.listSets() if ":" not in spec
+    )
+
+
+def list_size(client, metadataPrefix, **kwargs):
+    """Return the number of records in a list, from the response to its start.
+
+    The list is requested with ListIdentifiers, whose pages are smaller than
+    those of ListRecords.
+
+    ``client`` => ``oaiharvest.client.Client`` of the provider
+    ``kwargs`` => ``from_``, ``until`` and ``set`` of the list
+
+    Return None if the provider does not report the size of lists.
+    """
+    params = {"verb": "ListIdentifiers", "metadataPrefix": metadataPrefix}
+    for name, param in (("from_", "from"), ("until", "until")):
+        if kwargs.get(name) is not None:
+            params[param] = datetime_to_datestamp(kwargs[name], client._day_granularity)
+    if kwargs.get("set") is not None:
+        params["set"] = kwargs["set"]
+    body = client.makeRequest(**params)
+    if find_resumption_token(body) is not None:
+        return find_list_position(body)[0]
+    # The whole list is in this response, or there is none
+    tree = etree.fromstring(body)
+    error = tree.find(_OAI_NS + "error")
+    if error is not None:
+        if error.get("code") == "noRecordsMatch":
+            return 0
+        return None
+    return len(tree.findall("{0}ListIdentifiers/{0}header".format(_OAI_NS)))
+
+
+def sets_cover(client, metadataPrefix, sets, **kwargs):
+    """Return when every record in a list was found to be in one of ``sets``.
+
+    The headers of the whole list are requested with ListIdentifiers, and
+    checked for the spec of one of ``sets`` or of a set below them.
+
+    ``client`` => ``oaiharvest.client.Client`` of the provider
+    ``sets`` => specs of the top-level sets
+    ``kwargs`` => ``from_`` and ``until`` of the list
+
+    Return the server's responseDate for the start of the list, or None if
+    any record is in none of ``sets``.
+    """
+    sets = set(sets)
+    params = {"verb": "ListIdentifiers", "metadataPrefix": metadataPrefix}
+    for name, param in (("from_", "from"), ("until", "until")):
+        if kwargs.get(name) is not None:
+            params[param] = datetime_to_datestamp(kwargs[name], client._day_granularity)
+    # Fallback if server doesn't report responseDate
+    checked = datetime.utcnow()
+    body = client.makeRequest(**params)
+    tree = etree.fromstring(body)
+    try:
+        checked = datestamp_to_datetime(tree.findtext(_OAI_NS + "responseDate", ""))
+    except DatestampError:
+        pass
+    while True:
+        error = tree.find(_OAI_NS + "error")
+        if error is not None:
+            if error.get("code") == "noRecordsMatch":
+                return checked
+            return None
+        for header in tree.iterfind("{0}ListIdentifiers/{0}header".format(_OAI_NS)):
+            specs = header.iterfind(_OAI_NS + "setSpec")
+            if not any((spec.text or "").split(":")[0] in sets for spec in specs):
+                return None
+        token = find_resumption_token(body)
+        if not token:
+            return checked
+        body = client.makeRequest(verb="ListIdentifiers", resumptionToken=token)
+        tree = etree.fromstring(body)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""Validation of harvested records against the XML Schemas of their formats.
+
+A ``RecordValidator`` is shared by all harvests in a run. It validates the
+metadata of records in a pool of threads; lxml releases the GIL while
+validating, so threads validate concurrently with the harvest and with each
+other. The schema for each metadataPrefix is the one that the provider lists
+for it in its ``ListMetadataFormats`` response, unless given explicitly,
+e.g. to use a local copy. Each schema is fetched once, and compiled once in
+each thread, as compiled schemas must not be used by several threads at
+once.
+
+Harvesters submit records to a ``ProviderValidator`` for their provider,
+which counts valid and invalid records and their errors for the run summary.
+Invalid records may be quarantined, i.e. written to a directory of their own
+for each provider, with their errors in ``errors.jsonl``, rather than to
+the harvester's store.
+"""
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from lxml import etree
+from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import urlopen
+
+from oaiharvest.stores.directory_store import DirectoryRecordStore, FilenameQuoter
+
+#: Number of most common errors of each provider in the run summary
+SUMMARY_ERRORS = 3
+
+
+def parse_schema(argument):
+    """Parse PREFIX=LOCATION into a tuple, e.g. for argparser options."""
+    prefix, sep, location = argument.partition("=")
+    if not sep or not prefix or not location:
+        raise ValueError("Schema must be given as PREFIX=LOCATION")
+    return prefix, location
+
+
+class ValidationStats(object):
+    """Numbers of records validated from a provider in a run.
+
+    ``valid``, ``invalid`` => numbers of valid and invalid records
+    ``quarantined`` => number of invalid records quarantined
+    ``unvalidated`` => number of records for which there was no schema
+    ``errors`` => ``collections.Counter`` of error messages
+    """
+
+    def __init__(self):
+        self.valid = 0
+        self.invalid = 0
+        self.quarantined = 0
+        self.unvalidated = 0
+        self.errors = Counter()
+
+    def __str__(self):
+        summary = "{0} valid, {1} invalid".format(self.valid, self.invalid)
+        if self.quarantined:
+            summary += " ({0} quarantined)".format(self.quarantined)
+        if self.unvalidated:
+            summary += ", {0} without a schema".format(self.unvalidated)
+        if self.errors:
+            summary += "; most common errors: " + "; ".join(
+                "{0} ({1})".format(message, count)
+                for message, count in self.errors.most_common(SUMMARY_ERRORS)
+            )
+        return summary
+
+
+class RecordValidator(object):
+    """Validates records in a pool of threads, shared by all harvests.
+
+    ``schemas`` => dictionary of metadataPrefix to the path or URL of an
+    XML Schema, over-riding the schemas listed by providers
+    ``workers`` => number of threads in which to validate records
+    ``quarantine`` => directory in which to keep invalid records, rather
+    than storing them, or None to store them regardless
+    ``maxPending`` => number of records that each harvest may have waiting
+    to be validated
+    ``timeout`` => seconds to wait for a schema to be fetched, or None to
+    wait indefinitely
+    """
+
+    def __init__(
+        self, schemas=None, workers=4, quarantine=None, maxPending=1000, timeout=None
+    ):
+        self.schemas = dict(schemas or {})
+        self.workers = workers
+        self.quarantine = quarantine
+        self.maxPending = maxPending
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # Guards the dictionaries below, never held while waiting for I/O
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Content of each schema, by location, and a lock for fetching each
+        self._sources = {}
+        self._sourceLocks = {}
+        # Statistics of each provider, and a lock for recording its records
+        self._stats = {}
+        self._providerLocks = {}
+        self._quarantines = {}
+        self._quote = FilenameQuoter()
+
+    def for_provider(self, provider):
+        """Return a ``ProviderValidator`` for records from ``provider``."""
+        return ProviderValidator(self, provider)
+
+    def stats(self):
+        """Return dictionary of provider to ``ValidationStats``."""
+        with self._lock:
+            return dict(self._stats)
+
+    def compile(self, location):
+        """Return the compiled schema at ``location`` for this thread."""
+        schemas = getattr(self._local, "schemas", None)
+        if schemas is None:
+            schemas = self._local.schemas = {}
+        schema = schemas.get(location)
+        if schema is None:
+            source = self._source(location)
+            schema = etree.XMLSchema(etree.fromstring(source, base_url=location))
+            schemas[location] = schema
+        return schema
+
+    def submit(self, location, metadata):
+        """Validate ``metadata`` in the pool of threads.
+
+        Return a ``concurrent.futures.Future`` of the list of errors, which is
+        empty if ``metadata`` is valid.
+        """
+        return self._executor.submit(self._validate, location, metadata)
+
+    def close(self):
+        self._executor.shutdown()
+        for store, errors in self._quarantines.values():
+            store.close()
+            errors.close()
+
+    def _validate(self, location, metadata):
+        schema = self.compile(location)
+        if not metadata:
+            return ["Record has no metadata"]
+        try:
+            document = etree.fromstring(metadata.encode("utf-8"))
+        except etree.XMLSyntaxError as e:
+            return [str(e)]
+        if schema.validate(document):
+            return []
+        return [
+            "line {0}: {1}".format(error.line, error.message)
+            for error in schema.error_log
+        ]
+
+    def _source(self, location):
+        with self._lock:
+            source = self._sources.get(location)
+            if source is not None:
+                return source
+            lock = self._sourceLocks.setdefault(location, threading.Lock())
+        # Fetch each schema once, without holding up other schemas
+        with lock:
+            with self._lock:
+                source = self._sources.get(location)
+            if source is None:
+                if urlparse(location).scheme in ("http", "https", "file"):
+                    response = urlopen(location, timeout=self.timeout)
+                    try:
+                        source = response.read()
+                    finally:
+                        response.close()
+                else:
+                    with open(location, "rb") as fh:
+                        source = fh.read()
+                with self._lock:
+                    self._sources[location] = source
+        return source
+
+    def record(self, provider, record, metadataPrefix, errors):
+        """Count a validated record, quarantining it if invalid.
+
+        Return whether the record was quarantined.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(provider, ValidationStats())
+            lock = self._providerLocks.setdefault(provider, threading.Lock())
+        # Quarantining from one provider does not hold up the others
+        with lock:
+            if errors is None:
+                stats.unvalidated += 1
+                return False
+            if not errors:
+                stats.valid += 1
+                return False
+            stats.invalid += 1
+            # Count errors by message, irrespective of where they occurred
+            stats.errors.update(set(error.split(": ", 1)[-1] for error in errors))
+            if self.quarantine is None:
+                return False
+            store, log = self._quarantine_for(provider)
+            store.write(record, metadataPrefix)
+            log.write(
+                json.dumps(
+                    {
+                        "identifier": record.header.identifier(),
+                        "metadataPrefix": metadataPrefix,
+                        "datestamp": str(record.header.datestamp()),
+                        "errors": errors,
+                        "quarantined": datetime.now().isoformat(),
+                    }
+                )
+                + "\n"
+            )
+            stats.quarantined += 1
+            return True
+
+    def _quarantine_for(self, provider):
+        quarantine = self._quarantines.get(provider)
+        if quarantine is None:
+            directory = os.path.join(self.quarantine, self._quote(provider))
+            store = DirectoryRecordStore(directory)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            errors = open(os.path.join(directory, "errors.jsonl"), "a")
+            quarantine = self._quarantines[provider] = (store, errors)
+        return quarantine
+
+
+class ProviderValidator(object):
+    """Validates records harvested from ``provider`` with a ``RecordValidator``."""
+
+    def __init__(self, validator, provider):
+        self.validator = validator
+        self.provider = provider
+        self.maxPending = validator.maxPending
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def schema_location(self, metadataPrefix, client):
+        """Return location of the schema for ``metadataPrefix``, or None.
+
+        ``client`` => ``oaiharvest.client.Client`` of the provider, from which
+        to list its metadata formats
+        """
+        location = self.validator.schemas.get(metadataPrefix)
+        try:
+            if location is None:
+                for prefix, schema, namespace in client.listMetadataFormats():
+                    if prefix == metadataPrefix:
+                        location = schema
+                        break
+            if location is not None:
+                # Fail now, rather than for each record
+                self.validator.compile(location)
+        except Exception as e:
+            self.logger.warning(
+                "Not validating %s records from %s; could not load schema %s: %s",
+                metadataPrefix,
+                self.provider,
+                location,
+                e,
+            )
+            return None
+        if location is None:
+            self.logger.warning(
+                "Not validating %s records from %s; no schema is known",
+                metadataPrefix,
+                self.provider,
+            )
+        return location
+
+    def submit(self, location, record):
+        """Return ``concurrent.futures.Future`` of the errors of ``record``.
+
+        Return None if the record cannot be validated.
+        """
+        if location is None:
+            return None
+        return self.validator.submit(location, record.metadata)
+
+    def record(self, record, metadataPrefix, errors):
+        """Count ``record``, with its ``errors``, or None if not validated.
+
+        Return whether the record was quarantined, rather than to be stored.
+        """
+        if errors:
+            self.logger.debug(
+                "%s.%s is not valid: %s",
+                record.header.identifier(),
+                metadataPrefix,
+                errors[0],
+            )
+        return self.validator.record(self.provider, record, metadataPrefix, errors)
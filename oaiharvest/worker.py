@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""Harvest from a queue of providers shared by workers on several nodes.
+
+usage: oai-harvest enqueue [-h] [--db DATABASEPATH] [-f YYYY-MM-DD]
+                           [-u YYYY-MM-DD] [--slice DAYS] [-v | -q]
+                           [--log-file PATH] [--log-json] [--log-sample N]
+                           provider [provider ...]
+
+usage: oai-harvest worker [-h] [--name NAME] [--lease SECONDS]
+                          [--poll SECONDS] [--exit-when-idle]
+                          [--max-attempts N] [--retry-delay SECONDS]
+                          [harvest options]
+
+The coordinator (enqueue) adds harvests to the queue in the registry
+database, one for each provider, or with --slice one for each slice of its
+datestamps. Workers, run on any nodes that share the registry database,
+claim harvests from the queue with a lease that they renew while
+harvesting, and record the resumptionToken every --checkpoint-pages pages
+(default: 10 for workers). Harvests that fail are released to be retried;
+harvests whose worker stops renewing its lease, e.g. because its node
+crashed, are claimed by another worker, which continues from the last
+recorded resumptionToken. Options of a worker are as for harvesting,
+except that the times between which to harvest are those of each claimed
+harvest.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from datetime import datetime, timedelta
+
+from oaiharvest.exceptions import (
+    HarvestPausedException,
+    LeaseLostException,
+    NoSuchProviderException,
+)
+from oaiharvest.harvest import (
+    close,
+    close_store,
+    configure_provider,
+    harvest_arguments,
+    health_registry,
+    make_harvester,
+    metadata_registry,
+    options,
+    parse_date,
+    parse_days,
+    prepare,
+    run_harvest,
+)
+from oaiharvest.harvesters.base import OAIRecordGetter
+from oaiharvest.log import add_logging_arguments, configure_logging
+from oaiharvest.registry import verify_database
+from oaiharvest.workqueue import WorkQueue
+
+
+def main(argv):
+    """Run the ``enqueue`` or ``worker`` command given first in ``argv``."""
+    command, argv = argv[0], argv[1:]
+    if command == "enqueue":
+        args = enqueueparser.parse_args(argv)
+        configure_logging(args)
+        return enqueue(args)
+    args = workerparser.parse_args(argv)
+    configure_logging(args)
+    return work(args)
+
+
+def enqueue(args):
+    """Add harvests from providers in ``args`` to the queue."""
+    logger = logging.getLogger(__name__).getChild("enqueue")
+    queue = WorkQueue(args.databasePath)
+    cxn = verify_database(args.databasePath)
+    try:
+        providers = set(args.provider)
+        if "all" in providers:
+            providers.remove("all")
+            providers.update(
+                row[0] for row in cxn.execute("SELECT name FROM providers")
+            )
+        for provider in sorted(providers):
+            if provider.startswith(("http://", "https://")):
+                baseUrl, lastHarvest = provider, None
+            else:
+                row = cxn.execute(
+                    "SELECT url, lastHarvest [timestamp] FROM providers "
+                    "WHERE name=?",
+                    (provider,),
+                ).fetchone()
+                if row is None:
+                    logger.error(
+                        "Provider {0} does not exists in database {1}"
+                        "".format(provider, args.databasePath)
+                    )
+                    continue
+                baseUrl, lastHarvest = row
+            if args.slice is None:
+                added = [queue.enqueue(provider, args.from_, args.until)]
+            else:
+                start = args.from_ or lastHarvest
+                if start is None or start <= datetime.utcfromtimestamp(0):
+                    try:
+                        start = earliest_datestamp(baseUrl)
+                    except Exception as e:
+                        logger.error(
+                            "Unable to find the earliest datestamp of {0}: {1}"
+                            "".format(provider, e)
+                        )
+                        continue
+                added = enqueue_slices(
+                    queue,
+                    provider,
+                    start,
+                    args.until or datetime.utcnow(),
+                    args.slice,
+                )
+            added = [task for task in added if task is not None]
+            if added:
+                logger.info("Queued {0} harvests from {1}".format(len(added), provider))
+            else:
+                logger.warning("Harvest from {0} is already queued".format(provider))
+        counts = queue.counts()
+        logger.info(
+            "Queue: {0} pending, {1} leased, {2} done, {3} failed".format(
+                *(
+                    counts.get(state, 0)
+                    for state in ("pending", "leased", "done", "failed")
+                )
+            )
+        )
+    finally:
+        cxn.close()
+        queue.close()
+    return 0
+
+
+def enqueue_slices(queue, provider, start, stop, size):
+    """Queue harvests of ``size`` slices of datestamps from start to stop.
+
+    Return list of ids of queued tasks, None for any already queued.
+    """
+    batch = "{0:%Y%m%dT%H%M%S}-{1}".format(datetime.utcnow(), os.getpid())
+    added = []
+    while start < stop:
+        until = min(start + size, stop)
+        added.append(queue.enqueue(provider, start, until, batch))
+        start = until
+    return added
+
+
+def earliest_datestamp(baseUrl):
+    """Return the datestamp of the earliest record of provider ``baseUrl``."""
+    client = OAIRecordGetter(metadata_registry).get_client(baseUrl)
+    return client.identify().earliestDatestamp()
+
+
+def work(args):
+    """Harvest from queued providers until told to stop, or idle."""
+    logger = logging.getLogger(__name__).getChild("worker")
+    name = args.name or "{0}-{1}".format(socket.gethostname(), os.getpid())
+    names = [name]
+    if args.workers > 1:
+        names = ["{0}-{1}".format(name, i) for i in range(args.workers)]
+    queue = WorkQueue(args.databasePath)
+    prepare(args)
+    try:
+        if len(names) == 1:
+            done = [work_loop(args, queue, name)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(names)) as executor:
+                done = list(
+                    executor.map(lambda name: work_loop(args, queue, name), names)
+                )
+    finally:
+        close(args)
+        queue.close()
+    logger.info("Worker {0} completed {1} harvests".format(name, sum(done)))
+    return 0
+
+
+def work_loop(args, queue, name):
+    """Claim and run harvests as worker ``name``, return number run."""
+    logger = logging.getLogger(__name__).getChild("worker")
+    done = 0
+    while True:
+        task = queue.claim(name, args.lease)
+        if task is None:
+            if args.exitWhenIdle:
+                return done
+            logger.debug("Nothing to harvest; waiting %d seconds", args.poll)
+            time.sleep(args.poll)
+            continue
+        run_task(args, queue, task)
+        done += 1
+
+
+def run_task(args, queue, task):
+    """Harvest ``task`` claimed from ``queue``, and complete or release it."""
+    logger = logging.getLogger(__name__).getChild("worker")
+    logger.info("{0} claimed {1!r}".format(task.worker, task))
+    # Settings from the registry must not leak into other harvests
+    args = copy(args)
+    args.from_ = None
+    args.until = task.untilTime
+    args.resumptionToken = None
+    cxn = verify_database(args.databasePath)
+    health = health_registry(args, cxn).get(task.provider)
+    if health.is_open() and not args.ignoreHealth:
+        logger.warning(
+            "Deferring {0!r} until {1} after {2} consecutive failures".format(
+                task, health.retryAt, health.failures
+            )
+        )
+        queue.release(task, notBefore=health.retryAt)
+        cxn.close()
+        return
+    heartbeat = Heartbeat(queue, task, args.lease)
+    heartbeat.start()
+    harvester = None
+    try:
+        baseUrl = configure_provider(args, cxn, task.provider)
+        if task.resumptionToken is None and task.watermark is not None:
+            # Windows up to the watermark were completed in an earlier lease
+            args.from_ = task.watermark
+        elif task.fromTime is not None:
+            args.from_ = task.fromTime
+        harvester = make_harvester(args, cxn, task.provider)
+        completed = run_harvest(
+            args,
+            task.provider,
+            harvester,
+            baseUrl,
+            harvest_arguments(args),
+            cxn,
+            resume=True,
+            checkpoints=TaskCheckpoints(queue, task, heartbeat),
+            updateRegistry=not task.sliced,
+            raiseErrors=True,
+        )
+    except HarvestPausedException as e:
+        queue.release(task, notBefore=e.resumeAt)
+    except LeaseLostException:
+        logger.warning("Abandoning {0!r}, now claimed by another".format(task))
+    except NoSuchProviderException as e:
+        # Retrying cannot help
+        logger.error(str(e))
+        queue.release(task, error=str(e), maxAttempts=0)
+    except KeyboardInterrupt:
+        queue.release(task)
+        raise
+    except Exception as e:
+        logger.error(str(e), exc_info=True)
+        delay = args.retryDelay * 2 ** max(0, task.attempts - 1)
+        queue.release(
+            task,
+            error=str(e) or e.__class__.__name__,
+            notBefore=datetime.utcnow() + timedelta(seconds=delay),
+            maxAttempts=args.maxAttempts,
+        )
+    else:
+        if not completed:
+            logger.warning("Harvest of {0!r} stopped at the limit".format(task))
+        if queue.complete(task) and task.sliced:
+            advance_last_harvest(cxn, queue, task)
+    finally:
+        heartbeat.stop()
+        cxn.close()
+        if harvester is not None:
+            close_store(harvester)
+
+
+def advance_last_harvest(cxn, queue, task):
+    """Update lastHarvest to the end of the completed slices of ``task``."""
+    until = queue.completed_until(task.provider, task.batch)
+    if until is None:
+        return
+    with cxn:
+        cxn.execute(
+            "UPDATE providers SET lastHarvest=? "
+            "WHERE name=? AND (lastHarvest IS NULL OR lastHarvest<?)",
+            (until, task.provider, until),
+        )
+
+
+class TaskCheckpoints(object):
+    """Where to resume ``task``, in the queue shared with other workers.
+
+    Recording a checkpoint raises ``LeaseLostException`` if the lease on the
+    task has been lost, so that the harvest is abandoned to its new worker.
+    """
+
+    def __init__(self, queue, task, heartbeat=None):
+        self.queue = queue
+        self.task = task
+        self.heartbeat = heartbeat
+
+    def load(self):
+        """Return (resumptionToken, watermark) to resume from, or None."""
+        if self.task.resumptionToken is None:
+            return None
+        return self.task.resumptionToken, self.task.watermark
+
+    def save(self, resumptionToken, watermark=None):
+        """Record where to resume, or that there is nothing to resume."""
+        lost = self.heartbeat is not None and self.heartbeat.lost
+        if lost or not self.queue.checkpoint(self.task, resumptionToken, watermark):
+            raise LeaseLostException("Lease on {0!r} was lost".format(self.task))
+
+
+class Heartbeat(threading.Thread):
+    """Renew the lease on ``task`` every third of ``lease`` seconds."""
+
+    def __init__(self, queue, task, lease):
+        threading.Thread.__init__(self, name="heartbeat-{0}".format(task.id))
+        self.daemon = True
+        self.queue = queue
+        self.task = task
+        self.lease = lease
+        #: Whether the lease has been lost, e.g. after it expired
+        self.lost = False
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.lease / 3.0):
+            if not self.queue.heartbeat(self.task, self.lease):
+                self.lost = True
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+# Set up argument parsers
+docbits = __doc__.split("\n\n")
+
+enqueueparser = ArgumentParser(
+    prog="oai-harvest enqueue",
+    description="Add harvests to the queue shared by workers.",
+    epilog=docbits[-1],
+)
+enqueueparser.add_argument(
+    "--db",
+    "--database",
+    dest="databasePath",
+    default=os.path.expanduser("~/.oai-harvest/registry.db"),
+    help=("Path to provider registry database. Currently " "supports sqlite3 only."),
+)
+enqueueparser.add_argument(
+    "-f",
+    "--from",
+    type=parse_date,
+    dest="from_",
+    metavar="YYYY-MM-DD",
+    help=(
+        "harvest only records added/modified after this date. default: the "
+        "provider's lastHarvest"
+    ),
+)
+enqueueparser.add_argument(
+    "-u",
+    "--until",
+    type=parse_date,
+    dest="until",
+    metavar="YYYY-MM-DD",
+    help="harvest only records added/modified up to this date.",
+)
+enqueueparser.add_argument(
+    "--slice",
+    type=parse_days,
+    metavar="DAYS",
+    help=(
+        "queue a harvest for each slice of DAYS days, so that workers "
+        "harvest slices of one provider concurrently. lastHarvest is updated "
+        "as consecutive slices are completed"
+    ),
+)
+add_logging_arguments(enqueueparser)
+enqueueparser.add_argument(
+    "provider",
+    nargs="+",
+    help=(
+        "OAI-PMH Provider from which to harvest: the base URL of an OAI-PMH "
+        'server, the short name of a registered provider, or "all"'
+    ),
+)
+
+workerparser = ArgumentParser(
+    prog="oai-harvest worker",
+    description="Harvest from providers claimed from the queue.",
+    epilog=docbits[-1],
+    parents=[options],
+)
+workerparser.add_argument(
+    "--name",
+    help="name of the worker in the queue. default: HOSTNAME-PID",
+)
+workerparser.add_argument(
+    "--lease",
+    type=float,
+    default=300,
+    metavar="SECONDS",
+    help=(
+        "claim harvests for SECONDS seconds at a time, renewed every third "
+        "of that while harvesting (default: 300)"
+    ),
+)
+workerparser.add_argument(
+    "--poll",
+    type=float,
+    default=30,
+    metavar="SECONDS",
+    help="check the queue every SECONDS seconds when idle (default: 30)",
+)
+workerparser.add_argument(
+    "--exit-when-idle",
+    dest="exitWhenIdle",
+    action="store_true",
+    help="exit once there is nothing to harvest rather than waiting",
+)
+workerparser.add_argument(
+    "--max-attempts",
+    dest="maxAttempts",
+    type=int,
+    default=3,
+    metavar="N",
+    help="give up on harvests that have failed N times (default: 3)",
+)
+workerparser.add_argument(
+    "--retry-delay",
+    dest="retryDelay",
+    type=float,
+    default=60,
+    metavar="SECONDS",
+    help=(
+        "wait SECONDS seconds before retrying a failed harvest, doubling "
+        "after each attempt (default: 60)"
+    ),
+)
+workerparser.set_defaults(checkpointPages=10)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Queue of harvests shared by workers on one or more nodes.
+
+Harvests waiting to be done are rows in the ``tasks`` table of the provider
+registry, each for a whole provider or for a slice of its datestamps
+between two times. A worker claims a task by taking a lease on it, which it
+must extend (heartbeat) while harvesting. A task whose lease has expired,
+e.g. because its worker crashed or lost its network, may be claimed by any
+other worker, which continues from the resumptionToken last checkpointed in
+the queue rather than from the start.
+
+Claims are made in an immediate SQLite transaction, so that no two workers
+may lease the same task. Any number of processes on nodes sharing the
+registry database file may take part, provided that the file system
+supports locking, and that their clocks agree to well within the lease.
+All times in the queue are UTC.
+"""
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from oaiharvest.registry import verify_database
+
+#: Columns of tasks, in the order of Task attributes
+TASK_COLUMNS = (
+    "id",
+    "provider",
+    "fromTime [timestamp]",
+    "untilTime [timestamp]",
+    "batch",
+    "state",
+    "worker",
+    "leaseExpires [timestamp]",
+    "attempts",
+    "lastError",
+    "resumptionToken",
+    "watermark [timestamp]",
+)
+
+
+class Task(object):
+    """A harvest from a single provider, claimed from a ``WorkQueue``.
+
+    ``fromTime``, ``untilTime`` => slice of datestamps to harvest, or None
+    to harvest from the provider's lastHarvest onwards
+    ``batch`` => identifier shared by the slices of one harvest, or None
+    ``resumptionToken``, ``watermark`` => where to continue a harvest
+    interrupted in an earlier lease, or None
+    """
+
+    def __init__(
+        self,
+        id,
+        provider,
+        fromTime=None,
+        untilTime=None,
+        batch=None,
+        state="pending",
+        worker=None,
+        leaseExpires=None,
+        attempts=0,
+        lastError=None,
+        resumptionToken=None,
+        watermark=None,
+    ):
+        self.id = id
+        self.provider = provider
+        self.fromTime = fromTime
+        self.untilTime = untilTime
+        self.batch = batch
+        self.state = state
+        self.worker = worker
+        self.leaseExpires = leaseExpires
+        self.attempts = attempts
+        self.lastError = lastError
+        self.resumptionToken = resumptionToken
+        self.watermark = watermark
+
+    @property
+    def sliced(self):
+        """Whether the task is one slice of a harvest."""
+        return self.batch is not None
+
+    def __repr__(self):
+        if self.sliced:
+            return (
+                "<{0.__class__.__name__} {0.id} {0.provider} "
+                "{0.fromTime} - {0.untilTime}>".format(self)
+            )
+        return "<{0.__class__.__name__} {0.id} {0.provider}>".format(self)
+
+
+class WorkQueue(object):
+    """Queue of harvest tasks leased to workers, in the provider registry.
+
+    ``path`` => path to the registry database
+    ``timeout`` => seconds to wait for other workers to release the database
+    """
+
+    def __init__(self, path, timeout=30):
+        # Create the registry and its tables if necessary
+        verify_database(path).close()
+        # Transactions are begun explicitly, in order to lock immediately
+        self.cxn = sqlite3.connect(
+            path,
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        )
+        # Heartbeats are sent from other threads than harvests
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+
+    def close(self):
+        self.cxn.close()
+
+    def enqueue(self, provider, fromTime=None, untilTime=None, batch=None):
+        """Add a task to harvest from ``provider``, return its id.
+
+        Return None, adding nothing, if the same task is already waiting or
+        leased.
+        """
+        with self._transaction():
+            row = self.cxn.execute(
+                "SELECT id FROM tasks WHERE provider=? "
+                "AND fromTime IS ? AND untilTime IS ? "
+                "AND state IN ('pending', 'leased')",
+                (provider, fromTime, untilTime),
+            ).fetchone()
+            if row is not None:
+                return None
+            return self.cxn.execute(
+                "INSERT INTO tasks(provider, fromTime, untilTime, batch, state, "
+                "enqueued) VALUES (?, ?, ?, ?, 'pending', ?)",
+                (provider, fromTime, untilTime, batch, datetime.utcnow()),
+            ).lastrowid
+
+    def claim(self, worker, lease=300):
+        """Lease the next task to ``worker`` for ``lease`` seconds.
+
+        Tasks whose leases have expired are claimed before waiting tasks, so
+        that interrupted harvests are completed first. Return the ``Task``,
+        or None if there is nothing to do.
+        """
+        now = datetime.utcnow()
+        with self._transaction():
+            row = self.cxn.execute(
+                "SELECT {0} FROM tasks "
+                "WHERE (state='pending' OR (state='leased' AND leaseExpires<?)) "
+                "AND (notBefore IS NULL OR notBefore<=?) "
+                "ORDER BY state, fromTime, id LIMIT 1".format(", ".join(TASK_COLUMNS)),
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            task = Task(*row)
+            if task.state == "leased":
+                self.logger.warning(
+                    "Lease of %r by %s expired at %s; taking over",
+                    task,
+                    task.worker,
+                    task.leaseExpires,
+                )
+            task.state = "leased"
+            task.worker = worker
+            task.leaseExpires = now + timedelta(seconds=lease)
+            task.attempts += 1
+            self.cxn.execute(
+                "UPDATE tasks SET state=?, worker=?, leaseExpires=?, attempts=? "
+                "WHERE id=?",
+                (task.state, worker, task.leaseExpires, task.attempts, task.id),
+            )
+        return task
+
+    def heartbeat(self, task, lease=300):
+        """Extend the lease on ``task``, return whether it is still held."""
+        leaseExpires = datetime.utcnow() + timedelta(seconds=lease)
+        if not self._update(task, "leaseExpires=?", (leaseExpires,)):
+            return False
+        task.leaseExpires = leaseExpires
+        return True
+
+    def checkpoint(self, task, resumptionToken, watermark=None):
+        """Record where to continue ``task`` if its lease is lost.
+
+        Return whether the lease is still held.
+        """
+        if not self._update(
+            task, "resumptionToken=?, watermark=?", (resumptionToken, watermark)
+        ):
+            return False
+        task.resumptionToken = resumptionToken
+        task.watermark = watermark
+        return True
+
+    def complete(self, task):
+        """Mark ``task`` as done, return whether the lease was still held."""
+        return self._update(
+            task,
+            "state='done', leaseExpires=NULL, resumptionToken=NULL, watermark=NULL",
+        )
+
+    def release(self, task, error=None, notBefore=None, maxAttempts=3):
+        """Release ``task`` to be claimed again, e.g. by another worker.
+
+        ``error`` => why the harvest failed, or None if it was interrupted,
+        e.g. paused outside of its harvest window
+        ``notBefore`` => time before which it may not be claimed
+        ``maxAttempts`` => number of failed attempts after which to give up
+
+        Return whether the lease was still held.
+        """
+        if error is None:
+            # Interruptions do not count towards failed attempts
+            task.attempts -= 1
+        elif task.attempts >= maxAttempts:
+            self.logger.error(
+                "Giving up on %r after %d attempts: %s", task, task.attempts, error
+            )
+            return self._update(
+                task, "state='failed', leaseExpires=NULL, lastError=?", (error,)
+            )
+        return self._update(
+            task,
+            "state='pending', worker=NULL, leaseExpires=NULL, notBefore=?, "
+            "attempts=?, lastError=?",
+            (notBefore, task.attempts, error),
+        )
+
+    def completed_until(self, provider, batch):
+        """Return the time up to which slices of ``batch`` are all done.
+
+        Slices after the first that is not done are ignored, so that the
+        provider's lastHarvest never skips records. Return None if the
+        first slice is not done.
+        """
+        with self._lock:
+            rows = self.cxn.execute(
+                "SELECT state, untilTime [timestamp] FROM tasks "
+                "WHERE provider=? AND batch=? ORDER BY fromTime",
+                (provider, batch),
+            ).fetchall()
+        until = None
+        for state, untilTime in rows:
+            if state != "done":
+                break
+            until = untilTime
+        return until
+
+    def counts(self):
+        """Return dictionary of the number of tasks in each state."""
+        with self._lock:
+            return dict(
+                self.cxn.execute("SELECT state, count(*) FROM tasks GROUP BY state")
+            )
+
+    def _update(self, task, assignments, params=()):
+        """Update ``task`` if it is still leased to its worker."""
+        with self._transaction():
+            cursor = self.cxn.execute(
+                "UPDATE tasks SET {0} WHERE id=? AND worker=? AND state='leased'"
+                "".format(assignments),
+                tuple(params) + (task.id, task.worker),
+            )
+        if cursor.rowcount != 1:
+            self.logger.warning("Lease of %r by %s was lost", task, task.worker)
+            return False
+        return True
+
+    def _transaction(self):
+        return _Transaction(self.cxn, self._lock)
+
+
+class _Transaction(object):
+    """Context manager for a transaction that locks the database at once."""
+
+    def __init__(self, cxn, lock):
+        self.cxn = cxn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.cxn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.lock.release()
+            raise
+        return self.cxn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.cxn.execute("COMMIT")
+            else:
+                self.cxn.execute("ROLLBACK")
+        finally:
+            self.lock.release()
+        return False
@@ -39,11 +39,14 @@ setup(
     extras_require={
         ':python_version=="2.6"': ['argparse'],
         ':python_version=="2.7"': ['argparse'],
+        's3': ['boto3'],
+        'parquet': ['pyarrow'],
     },
     entry_points={
         'console_scripts': [
             "oai-harvest = oaiharvest.harvest:main",
-            "oai-reg = oaiharvest.registry:main"
+            "oai-reg = oaiharvest.registry:main",
+            "oai-reshard = oaiharvest.reshard:main",
         ]
     },
     url='http://github.com/bloomonkey/oai-harvest',